@@ -0,0 +1,198 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from apscheduler.schedulers.background import BackgroundScheduler
+from db import criar_conexao_dedicada, registrar_execucao_job
+from email_service import enviar_notificacoes, verificar_agendamentos_24h, WORKER_ID
+from logs import get_logger
+import metricas
+
+logger = get_logger(__name__)
+
+AGENDADOR_HEARTBEAT = float(os.getenv('AGENDADOR_HEARTBEAT', '10'))
+# Locks do GET_LOCK valem para o servidor inteiro; o nome do banco separa ambientes
+PREFIXO_LOCK = f"{os.getenv('DB_NAME', 'medical_appointments')}:agendador"
+
+
+class LiderancaMySQL:
+    """Eleição de líder com GET_LOCK em uma conexão dedicada.
+
+    O lock pertence à sessão: se o processo morre ou a conexão cai, o MySQL o
+    libera e outra instância assume no próximo heartbeat. Os locks de cada job
+    ficam na mesma conexão, então só o líder atual consegue iniciar um job.
+    """
+
+    def __init__(self, conectar, nome=PREFIXO_LOCK, intervalo=AGENDADOR_HEARTBEAT):
+        self._conectar = conectar
+        self.nome = nome
+        self.intervalo = intervalo
+        self._conn = None
+        self._lider = False
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._thread = None
+
+    def _consultar(self, sql, parametros):
+        if self._conn is None:
+            self._conn = self._conectar()
+        cursor = self._conn.cursor()
+        try:
+            cursor.execute(sql, parametros)
+            return cursor.fetchone()
+        finally:
+            cursor.close()
+
+    def _descartar_conexao(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+    def renovar(self):
+        """Um ciclo do heartbeat: confirma a liderança ou tenta assumi-la."""
+        with self._lock:
+            anterior = self._lider
+            try:
+                if self._lider:
+                    linha = self._consultar('SELECT IS_USED_LOCK(%s) = CONNECTION_ID()', (self.nome,))
+                else:
+                    linha = self._consultar('SELECT GET_LOCK(%s, 0)', (self.nome,))
+                self._lider = linha[0] == 1
+            except Exception as e:
+                # Sem conexão não há lock: o MySQL já o liberou para outra instância
+                logger.warning("Falha no heartbeat do agendador: %s", e)
+                self._lider = False
+                self._descartar_conexao()
+            lider = self._lider
+        if lider != anterior:
+            logger.info("Liderança do agendador %s", 'assumida' if lider else 'perdida',
+                        extra={'instancia': WORKER_ID})
+        return lider
+
+    def eh_lider(self):
+        return self._lider
+
+    @contextmanager
+    def bloqueio_job(self, job):
+        """Lock não bloqueante do job; também confirma a liderança na mesma consulta."""
+        nome_job = f'{self.nome}:{job}'
+        obtido = False
+        with self._lock:
+            try:
+                lider, obtido = self._consultar(
+                    'SELECT IS_USED_LOCK(%s) = CONNECTION_ID(), GET_LOCK(%s, 0)', (self.nome, nome_job))
+                self._lider = lider == 1
+                obtido = obtido == 1
+                if obtido and not self._lider:
+                    self._consultar('SELECT RELEASE_LOCK(%s)', (nome_job,))
+                    obtido = False
+            except Exception as e:
+                logger.warning("Falha ao obter o lock do job: %s", e, extra={'job': job})
+                self._lider = False
+                self._descartar_conexao()
+        try:
+            yield obtido
+        finally:
+            if obtido:
+                with self._lock:
+                    try:
+                        self._consultar('SELECT RELEASE_LOCK(%s)', (nome_job,))
+                    except Exception:
+                        # Conexão perdida: o lock já foi liberado pelo servidor
+                        self._descartar_conexao()
+
+    def _executar(self):
+        while not self._parar.is_set():
+            self.renovar()
+            self._parar.wait(self.intervalo)
+
+    def iniciar(self):
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._executar, name='lideranca-agendador', daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.intervalo)
+        with self._lock:
+            if self._lider and self._conn is not None:
+                try:
+                    self._consultar('SELECT RELEASE_LOCK(%s)', (self.nome,))
+                except Exception:
+                    pass
+            self._lider = False
+            self._descartar_conexao()
+
+
+class Agendador:
+    """APScheduler em que cada job só roda na instância líder e nunca em paralelo consigo mesmo."""
+
+    def __init__(self, lideranca, registrar=registrar_execucao_job):
+        self.lideranca = lideranca
+        self._registrar = registrar
+        self._em_execucao = set()
+        self._lock = threading.Lock()
+        self.scheduler = BackgroundScheduler(job_defaults={
+            'max_instances': 1,
+            'coalesce': True,
+            'misfire_grace_time': 60,
+        })
+
+    def adicionar(self, nome, funcao, **gatilho):
+        self.scheduler.add_job(self.executar, 'interval', args=(nome, funcao), id=nome, name=nome, **gatilho)
+
+    def executar(self, nome, funcao):
+        if not self.lideranca.eh_lider():
+            return None
+        with self._lock:
+            if nome in self._em_execucao:
+                return None
+            self._em_execucao.add(nome)
+        try:
+            with self.lideranca.bloqueio_job(nome) as obtido:
+                if not obtido:
+                    if self.lideranca.eh_lider():
+                        logger.info("Execução anterior ainda em andamento", extra={'job': nome})
+                        self._registrar(nome, WORKER_ID, datetime.now(), 0, 'ignorado')
+                    return None
+                return self._executar_registrando(nome, funcao)
+        finally:
+            with self._lock:
+                self._em_execucao.discard(nome)
+
+    def _executar_registrando(self, nome, funcao):
+        iniciado_em = datetime.now()
+        inicio = time.perf_counter()
+        status, detalhe, resultado = 'sucesso', None, None
+        try:
+            resultado = funcao()
+            detalhe = json.dumps(resultado, default=str) if resultado is not None else None
+        except Exception as e:
+            status, detalhe = 'erro', str(e)
+            logger.exception("Erro na execução do job", extra={'job': nome})
+        duracao = time.perf_counter() - inicio
+        self._registrar(nome, WORKER_ID, iniciado_em, duracao, status, detalhe)
+        return resultado
+
+    def iniciar(self):
+        self.lideranca.iniciar()
+        self.scheduler.start()
+
+    def parar(self, aguardar=True):
+        self.scheduler.shutdown(wait=aguardar)
+        self.lideranca.parar()
+
+
+def criar_agendador():
+    agendador = Agendador(LiderancaMySQL(criar_conexao_dedicada))
+    agendador.adicionar('enviar_notificacoes', enviar_notificacoes, minutes=5)
+    agendador.adicionar('verificar_agendamentos_24h', verificar_agendamentos_24h, hours=1)
+    metricas.medidor('agendador_lider', 'Se esta instância é a líder dos jobs agendados',
+                     lambda: 1 if agendador.lideranca.eh_lider() else 0)
+    return agendador
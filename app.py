@@ -1,19 +1,41 @@
+import os
+import secrets
 from flask import Flask
-from apscheduler.schedulers.background import BackgroundScheduler
 from dotenv import load_dotenv
-from email_service import enviar_notificacoes, verificar_agendamentos_24h
+from agendador import criar_agendador
 
 load_dotenv()
 
+def _chave_secreta():
+    # O cookie de sessão assinado guarda o paciente_id e dá acesso à conta: uma
+    # chave conhecida permitiria forjar a sessão de qualquer paciente
+    chave = os.getenv('SECRET_KEY')
+    if chave:
+        return chave
+    if os.getenv('FLASK_DEBUG') == '1':
+        # Só em desenvolvimento: as sessões caem a cada reinício
+        return secrets.token_hex(32)
+    raise RuntimeError('SECRET_KEY não configurada; defina-a no .env (FLASK_DEBUG=1 gera uma chave temporária)')
+
 def create_app():
     app = Flask(__name__)
-    app.secret_key = 'chave_secreta_do_app'
+    app.secret_key = _chave_secreta()
+    app.config['SESSION_COOKIE_HTTPONLY'] = True
+    app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
+
+    # Os envios rodam no worker.py; AGENDADOR_HABILITADO=1 volta a executá-los no
+    # processo web (só o líder eleito no MySQL executa os jobs)
+    if os.getenv('AGENDADOR_HABILITADO', '0') == '1':
+        criar_agendador().iniciar()
+
+    # Perfil opcional por requisição (cabeçalho Server-Timing); registrado antes da
+    # unidade de trabalho para que o commit final entre na medição
+    from perfil import init_app as init_perfil
+    init_perfil(app)
 
-    # Inicializa o scheduler
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(enviar_notificacoes, 'interval', minutes=5)
-    scheduler.add_job(verificar_agendamentos_24h, 'interval', hours=1)
-    scheduler.start()
+    # Uma conexão e uma transação por requisição
+    from db import init_app as init_db
+    init_db(app)
 
     # Registra as blueprints
     from routes import init_app
@@ -0,0 +1,113 @@
+"""Servidor SMTP local que aceita e descarta as mensagens, para benchmarks.
+
+Aceita qualquer AUTH PLAIN/LOGIN, não usa TLS e conta as mensagens recebidas.
+Com --latencia-ms cada mensagem demora o tempo informado, simulando um servidor remoto.
+
+    python benchmarks/smtp_local.py --porta 2525 --latencia-ms 20
+
+Configure a aplicação com EMAIL_HOST=127.0.0.1, EMAIL_PORT=2525 e EMAIL_STARTTLS=0.
+"""
+import argparse
+import socketserver
+import threading
+import time
+
+
+class ManipuladorSMTP(socketserver.StreamRequestHandler):
+    def responder(self, linha):
+        self.wfile.write(linha.encode('ascii') + b'\r\n')
+
+    def ler_linha(self):
+        linha = self.rfile.readline()
+        if not linha:
+            return None
+        return linha.decode('utf-8', 'replace').rstrip('\r\n')
+
+    def receber_dados(self):
+        while True:
+            linha = self.rfile.readline()
+            if not linha or linha in (b'.\r\n', b'.\n'):
+                return
+
+    def handle(self):
+        self.responder('220 smtp-local pronto')
+        while True:
+            linha = self.ler_linha()
+            if linha is None:
+                return
+            comando = linha.split(' ', 1)[0].upper()
+            if comando == 'EHLO':
+                self.responder('250-smtp-local')
+                self.responder('250-AUTH PLAIN LOGIN')
+                self.responder('250 8BITMIME')
+            elif comando == 'HELO':
+                self.responder('250 smtp-local')
+            elif comando == 'AUTH':
+                partes = linha.split()
+                if partes[1].upper() == 'LOGIN':
+                    # usuário e senha em duas etapas
+                    for _ in range(2 if len(partes) == 2 else 1):
+                        self.responder('334 ')
+                        self.ler_linha()
+                elif len(partes) == 2:
+                    self.responder('334 ')
+                    self.ler_linha()
+                self.responder('235 autenticado')
+            elif comando in ('MAIL', 'RCPT', 'RSET', 'NOOP'):
+                self.responder('250 ok')
+            elif comando == 'DATA':
+                self.responder('354 envie a mensagem')
+                self.receber_dados()
+                if self.server.latencia:
+                    time.sleep(self.server.latencia)
+                self.server.contar()
+                self.responder('250 mensagem aceita')
+            elif comando == 'QUIT':
+                self.responder('221 tchau')
+                return
+            else:
+                self.responder('502 comando nao implementado')
+
+
+class ServidorSMTPLocal(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, endereco, latencia=0.0):
+        super().__init__(endereco, ManipuladorSMTP)
+        self.latencia = latencia
+        self.mensagens = 0
+        self._lock = threading.Lock()
+
+    def contar(self):
+        with self._lock:
+            self.mensagens += 1
+
+    @property
+    def porta(self):
+        return self.server_address[1]
+
+
+def iniciar(porta=0, latencia_ms=0):
+    """Sobe o servidor em uma thread; porta 0 escolhe uma porta livre."""
+    servidor = ServidorSMTPLocal(('127.0.0.1', porta), latencia_ms / 1000)
+    threading.Thread(target=servidor.serve_forever, name='smtp-local', daemon=True).start()
+    return servidor
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Servidor SMTP local para benchmarks')
+    parser.add_argument('--porta', type=int, default=2525)
+    parser.add_argument('--latencia-ms', type=float, default=0)
+    args = parser.parse_args(argv)
+
+    servidor = ServidorSMTPLocal(('127.0.0.1', args.porta), args.latencia_ms / 1000)
+    print(f"SMTP local em 127.0.0.1:{servidor.porta}")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        print(f"{servidor.mensagens} mensagens recebidas")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Dispara vários agendamentos simultâneos para o mesmo horário.
+
+Requer o banco configurado no .env com as migrações aplicadas. Exemplo:
+
+    python benchmarks/stress_agendamento.py --paciente-id 1 --concorrencia 50
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+
+
+def contar_ativos(data_hora):
+    conn = db.get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT COUNT(*) FROM agendamentos
+            WHERE data_hora = %s AND status = 'agendado'
+        ''', (data_hora,))
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def executar(paciente_id, concorrencia, data_hora):
+    barreira = threading.Barrier(concorrencia)
+
+    def agendar(_):
+        barreira.wait()
+        # Sem o atalho em memória, toda tentativa chega ao banco ao mesmo tempo
+        db._ocupacao.invalidar(data_hora.date())
+        inicio = time.perf_counter()
+        # Como numa requisição: uma conexão por agendamento, para que o pool
+        # nunca seja o gargalo e só o índice único decida o vencedor
+        with db.unidade_de_trabalho():
+            sucesso = db.agendar_exame(paciente_id, 'Raio-X', data_hora)
+        return sucesso, time.perf_counter() - inicio
+
+    with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+        resultados = list(executor.map(agendar, range(concorrencia)))
+
+    vencedores = sum(1 for sucesso, _ in resultados if sucesso)
+    latencias = sorted(duracao for _, duracao in resultados)
+    return vencedores, latencias
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Teste de estresse de agendamento concorrente')
+    parser.add_argument('--paciente-id', type=int, required=True)
+    parser.add_argument('--concorrencia', type=int, default=50)
+    parser.add_argument('--data-hora', help='horário disputado (AAAA-MM-DDTHH:MM)')
+    args = parser.parse_args(argv)
+
+    if args.data_hora:
+        data_hora = datetime.strptime(args.data_hora, '%Y-%m-%dT%H:%M')
+    else:
+        # Horário improvável de já estar ocupado: daqui a um ano, com minuto aleatório
+        data_hora = (datetime.now() + timedelta(days=365)).replace(
+            hour=10, minute=int(time.time()) % 60, second=0, microsecond=0)
+
+    vencedores, latencias = executar(args.paciente_id, args.concorrencia, data_hora)
+    ativos = contar_ativos(data_hora)
+    p50 = latencias[len(latencias) // 2]
+    p99 = latencias[min(len(latencias) - 1, int(len(latencias) * 0.99))]
+    print(f"{args.concorrencia} tentativas para {data_hora}: {vencedores} venceram, "
+          f"{ativos} agendamentos ativos no banco (p50 {p50 * 1000:.1f} ms, p99 {p99 * 1000:.1f} ms)")
+
+    if vencedores != 1 or ativos != 1:
+        print("FALHA: o horário deveria ter exatamente um agendamento")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,280 @@
+"""Benchmarks de agendamento, painéis e envio de notificações.
+
+Roda contra um MySQL local em um banco próprio (criado e esvaziado pelo script)
+e um servidor SMTP local (benchmarks/smtp_local.py), sem tocar no banco da
+aplicação nem no Gmail. As credenciais do MySQL vêm do .env.
+
+    python benchmarks/suite.py --tamanhos 1000,10000,100000 --salvar benchmarks/baseline.json
+    python benchmarks/suite.py --comparar benchmarks/baseline.json --limite 0.2
+
+Com --comparar, termina com código 1 se alguma latência p95 piorar ou a vazão
+de envio cair mais que --limite (fração) em relação à baseline.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import smtp_local
+
+TIPOS_EXAME = ['Raio-X', 'Ultrassom', 'Tomografia', 'Ressonância Magnética', 'Exame de Sangue']
+LOTE_INSERCAO = 1000
+
+
+def configurar_ambiente(banco, porta_smtp):
+    # Lido pelos módulos da aplicação na importação, por isso antes de importar db
+    os.environ['DB_NAME'] = banco
+    os.environ['EMAIL_HOST'] = '127.0.0.1'
+    os.environ['EMAIL_PORT'] = str(porta_smtp)
+    os.environ['EMAIL_STARTTLS'] = '0'
+    os.environ['EMAIL_USER'] = 'benchmark@exemplo.com'
+    os.environ['EMAIL_PASSWORD'] = 'benchmark'
+    os.environ['EMAIL_TAXA_MAXIMA'] = '0'
+    # Sem cache, os painéis medem o caminho até o banco
+    os.environ['CACHE_BACKEND'] = 'memoria'
+    os.environ['CACHE_TTL'] = '0'
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+
+def criar_banco(banco):
+    import mysql.connector
+    import migrate
+
+    conn = mysql.connector.connect(
+        host=os.getenv('DB_HOST', 'localhost'),
+        user=os.getenv('DB_USER', 'root'),
+        password=os.getenv('DB_PASSWORD', '')
+    )
+    cursor = conn.cursor()
+    cursor.execute(f'DROP DATABASE IF EXISTS `{banco}`')
+    cursor.execute(f'CREATE DATABASE `{banco}`')
+    cursor.execute(f'USE `{banco}`')
+    with open(os.path.join(RAIZ, 'script.sql'), encoding='utf-8') as f:
+        comandos = [c.strip() for c in f.read().split(';') if c.strip()]
+    for comando in comandos:
+        if comando.upper().startswith(('CREATE DATABASE', 'USE ')):
+            continue
+        cursor.execute(comando)
+    conn.commit()
+    cursor.close()
+    conn.close()
+    if not migrate.aplicar():
+        raise RuntimeError('falha ao aplicar as migrações no banco de benchmark')
+
+
+def _inserir_em_lotes(cursor, sql, linhas):
+    for inicio in range(0, len(linhas), LOTE_INSERCAO):
+        cursor.executemany(sql, linhas[inicio:inicio + LOTE_INSERCAO])
+
+
+def popular(db, total_atual, total_desejado, pacientes):
+    """Completa a tabela de agendamentos até `total_desejado`, um paciente a cada 10 agendamentos."""
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    try:
+        while len(pacientes) < max(1, total_desejado // 10):
+            n = len(pacientes) + 1
+            cursor.execute('''
+                INSERT INTO users (username, password, nome, email, tipo_usuario)
+                VALUES (%s, 'bench', %s, %s, 'paciente')
+            ''', (f'paciente{n}', f'Paciente {n}', f'paciente{n}@exemplo.com'))
+            cursor.execute('''
+                INSERT INTO pacientes (user_id, cpf, data_nascimento) VALUES (%s, %s, '1990-01-01')
+            ''', (cursor.lastrowid, f'{n:011d}'))
+            pacientes.append(cursor.lastrowid)
+
+        # Horários distintos a cada 30 min para trás a partir de ontem: o índice
+        # único só aceita um agendamento ativo por horário
+        base = datetime.now().replace(minute=0, second=0, microsecond=0) - timedelta(days=1)
+        novos = range(total_atual, total_desejado)
+        exames = [(random.choice(TIPOS_EXAME), base - timedelta(minutes=30 * i),
+                   random.choice(['agendado', 'realizado', 'cancelado'])) for i in novos]
+        _inserir_em_lotes(cursor, 'INSERT INTO exames (tipo_exame, data_hora, status) VALUES (%s, %s, %s)', exames)
+        cursor.execute('SELECT id FROM exames ORDER BY id DESC LIMIT %s', (len(exames),))
+        exame_ids = sorted(linha[0] for linha in cursor.fetchall())
+        agendamentos = [(random.choice(pacientes), exame_id, data_hora, status)
+                        for exame_id, (_, data_hora, status) in zip(exame_ids, exames)]
+        _inserir_em_lotes(cursor, '''
+            INSERT INTO agendamentos (paciente_id, exame_id, data_hora, status) VALUES (%s, %s, %s, %s)
+        ''', agendamentos)
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def percentis(duracoes):
+    ordenadas = sorted(duracoes)
+
+    def p(q):
+        return round(ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * q))] * 1000, 3)
+
+    return {'p50_ms': p(0.50), 'p95_ms': p(0.95), 'p99_ms': p(0.99), 'amostras': len(ordenadas)}
+
+
+def cronometrar(funcao, repeticoes):
+    funcao()  # aquecimento
+    duracoes = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        duracoes.append(time.perf_counter() - inicio)
+    return percentis(duracoes)
+
+
+def medir_agendamento(db, paciente_id, repeticoes):
+    # Horários futuros em dias úteis, todos livres
+    slot = (datetime.now() + timedelta(days=400)).replace(hour=8, minute=0, second=0, microsecond=0)
+    duracoes = []
+    for _ in range(repeticoes):
+        while slot.weekday() >= 5 or not 8 <= slot.hour < 18:
+            slot = (slot + timedelta(days=1)).replace(hour=8, minute=0)
+        inicio = time.perf_counter()
+        if not db.agendar_exame(paciente_id, 'Raio-X', slot):
+            raise RuntimeError(f'agendamento falhou em {slot}')
+        duracoes.append(time.perf_counter() - inicio)
+        slot += timedelta(minutes=30)
+    return percentis(duracoes)
+
+
+def medir_paineis(db, pacientes, tamanho, repeticoes):
+    resultados = {}
+    resultados[f'painel_paciente@{tamanho}'] = cronometrar(
+        lambda: db.get_agendamentos_paciente(random.choice(pacientes)), repeticoes)
+    resultados[f'notificacoes_paciente@{tamanho}'] = cronometrar(
+        lambda: db.get_notificacoes_paciente(random.choice(pacientes)), repeticoes)
+    resultados[f'painel_recepcionista@{tamanho}'] = cronometrar(
+        lambda: db.get_agendamentos_recepcionista(), repeticoes)
+
+    hoje = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    resultados[f'painel_recepcionista_hoje@{tamanho}'] = cronometrar(
+        lambda: db.get_agendamentos_recepcionista(data_inicio=hoje - timedelta(days=1), data_fim=hoje),
+        repeticoes)
+
+    def paginar():
+        apos = None
+        for _ in range(5):
+            _, apos = db.get_agendamentos_recepcionista(status='realizado', apos=apos)
+            if apos is None:
+                break
+    resultados[f'painel_recepcionista_5_paginas@{tamanho}'] = cronometrar(paginar, max(1, repeticoes // 5))
+    return resultados
+
+
+def medir_envio(db, email_service, servidor, pacientes, quantidade):
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("UPDATE notificacoes SET status_envio = 'enviado' WHERE status_envio = 'pendente'")
+        linhas = [(paciente_id, 'Olá,\n\nSeu exame de Raio-X foi agendado com sucesso.',
+                   f'paciente{paciente_id}@exemplo.com')
+                  for paciente_id in random.choices(pacientes, k=quantidade)]
+        _inserir_em_lotes(cursor, '''
+            INSERT INTO notificacoes (paciente_id, mensagem, email_destino, status_envio)
+            VALUES (%s, %s, %s, 'pendente')
+        ''', linhas)
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+
+    recebidas_antes = servidor.mensagens
+    # Sem resumos: cada notificação semeada deve virar um envio
+    resumo = email_service.enviar_notificacoes(janela_resumo=0)
+    recebidas = servidor.mensagens - recebidas_antes
+    if recebidas < quantidade:
+        raise RuntimeError(f'só {recebidas} de {quantidade} e-mails chegaram ao servidor local')
+    return {'por_segundo': resumo['por_segundo'], 'enviadas': resumo['enviadas'], 'duracao_s': resumo['duracao']}
+
+
+def comparar(atual, baseline, limite):
+    regressoes = []
+    for nome, base in baseline['resultados'].items():
+        medida = atual['resultados'].get(nome)
+        if medida is None:
+            continue
+        if 'p95_ms' in base and medida['p95_ms'] > base['p95_ms'] * (1 + limite):
+            regressoes.append(f"{nome}: p95 {base['p95_ms']} ms -> {medida['p95_ms']} ms")
+        if 'por_segundo' in base and medida['por_segundo'] < base['por_segundo'] * (1 - limite):
+            regressoes.append(f"{nome}: {base['por_segundo']} -> {medida['por_segundo']} e-mails/s")
+    return regressoes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks contra MySQL e SMTP locais')
+    parser.add_argument('--banco', default='medical_appointments_bench',
+                        help='banco descartável (é recriado a cada execução)')
+    parser.add_argument('--tamanhos', default='1000,10000,100000',
+                        help='quantidades de agendamentos para os painéis')
+    parser.add_argument('--repeticoes', type=int, default=200)
+    parser.add_argument('--agendamentos', type=int, default=200, help='agendamentos medidos')
+    parser.add_argument('--notificacoes', type=int, default=2000, help='notificações na fila de envio')
+    parser.add_argument('--latencia-smtp-ms', type=float, default=0)
+    parser.add_argument('--salvar', help='grava o resultado como baseline neste arquivo')
+    parser.add_argument('--comparar', help='baseline para detectar regressões')
+    parser.add_argument('--limite', type=float, default=0.2, help='piora tolerada (0.2 = 20%%)')
+    args = parser.parse_args(argv)
+
+    if 'bench' not in args.banco:
+        parser.error('por segurança o nome do banco precisa conter "bench"')
+
+    random.seed(42)
+    servidor = smtp_local.iniciar(latencia_ms=args.latencia_smtp_ms)
+    configurar_ambiente(args.banco, servidor.porta)
+
+    import db
+    import email_service
+
+    criar_banco(args.banco)
+    resultados = {}
+    pacientes = []
+    total = 0
+    for tamanho in sorted(int(t) for t in args.tamanhos.split(',')):
+        print(f"Populando {tamanho} agendamentos...")
+        popular(db, total, tamanho, pacientes)
+        total = tamanho
+        resultados.update(medir_paineis(db, pacientes, tamanho, args.repeticoes))
+
+    print("Medindo agendamentos...")
+    resultados['agendar_exame'] = medir_agendamento(db, pacientes[0], args.agendamentos)
+    print("Medindo envio de notificações...")
+    resultados['envio_notificacoes'] = medir_envio(db, email_service, servidor, pacientes, args.notificacoes)
+
+    relatorio = {
+        'executado_em': datetime.now().isoformat(timespec='seconds'),
+        'maquina': platform.node(),
+        'python': platform.python_version(),
+        'parametros': {k: v for k, v in vars(args).items() if k not in ('salvar', 'comparar')},
+        'resultados': resultados,
+    }
+    for nome, medida in resultados.items():
+        print(f"{nome:45s} {json.dumps(medida)}")
+
+    if args.salvar:
+        with open(args.salvar, 'w', encoding='utf-8') as f:
+            json.dump(relatorio, f, indent=2, ensure_ascii=False)
+        print(f"Baseline gravada em {args.salvar}")
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressoes = comparar(relatorio, baseline, args.limite)
+        if regressoes:
+            print(f"REGRESSÃO (limite {args.limite:.0%}):")
+            for regressao in regressoes:
+                print(f"  {regressao}")
+            return 1
+        print(f"Sem regressões acima de {args.limite:.0%} em relação a {args.comparar}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
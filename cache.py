@@ -0,0 +1,252 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+# Tipos das linhas do MySQL que o JSON não representa; ao contrário de pickle, ler
+# o arquivo nunca executa código
+_TIPOS_JSON = {
+    'datetime': (datetime, datetime.isoformat, datetime.fromisoformat),
+    'date': (date, date.isoformat, date.fromisoformat),
+    'timedelta': (timedelta, timedelta.total_seconds, lambda segundos: timedelta(seconds=segundos)),
+    'decimal': (Decimal, str, Decimal),
+}
+
+
+def _codificar(valor):
+    # datetime antes de date: datetime é subclasse de date
+    for tipo, (classe, serializar, _) in _TIPOS_JSON.items():
+        if isinstance(valor, classe):
+            return {'__tipo__': tipo, 'valor': serializar(valor)}
+    raise TypeError(f'tipo não suportado pelo cache: {type(valor).__name__}')
+
+
+def _decodificar(objeto):
+    tipo = objeto.get('__tipo__')
+    if tipo in _TIPOS_JSON and len(objeto) == 2:
+        return _TIPOS_JSON[tipo][2](objeto['valor'])
+    return objeto
+
+
+def serializar(valor):
+    return json.dumps(valor, default=_codificar, ensure_ascii=False)
+
+
+def desserializar(texto):
+    return json.loads(texto, object_hook=_decodificar)
+
+
+def diretorio_privado(caminho):
+    """Cria (ou confere) um diretório acessível só pelo usuário do processo."""
+    os.makedirs(caminho, mode=0o700, exist_ok=True)
+    info = os.stat(caminho)
+    if info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise RuntimeError(f'{caminho} precisa pertencer a este usuário e ter permissão 0700')
+    return caminho
+
+
+class CacheLRU:
+    """Cache em memória do processo, com expiração por TTL e descarte LRU.
+
+    Cada chave tem uma versão incrementada a cada invalidação: um valor lido do
+    banco antes de uma escrita concorrente não é gravado depois da invalidação.
+    """
+
+    def __init__(self, capacidade=1000, ttl=60):
+        self.capacidade = capacidade
+        self.ttl = ttl
+        self._entradas = OrderedDict()
+        self._versoes = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def buscar(self, chave):
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada and entrada[1] > time.monotonic():
+                self._entradas.move_to_end(chave)
+                self._hits += 1
+                return True, entrada[0]
+            if entrada:
+                del self._entradas[chave]
+            self._misses += 1
+            return False, self._versoes.get(chave, 0)
+
+    def guardar(self, chave, valor, versao):
+        with self._lock:
+            if self._versoes.get(chave, 0) != versao:
+                return
+            self._entradas[chave] = (valor, time.monotonic() + self.ttl)
+            self._entradas.move_to_end(chave)
+            while len(self._entradas) > self.capacidade:
+                self._entradas.popitem(last=False)
+
+    def invalidar(self, *chaves):
+        with self._lock:
+            for chave in chaves:
+                self._entradas.pop(chave, None)
+                self._versoes[chave] = self._versoes.get(chave, 0) + 1
+
+    def limpar(self):
+        with self._lock:
+            self._entradas.clear()
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'backend': 'memoria',
+                'hits': self._hits,
+                'misses': self._misses,
+                'tamanho': len(self._entradas),
+                'capacidade': self.capacidade,
+            }
+
+
+class CacheSQLite:
+    """Cache compartilhado pelos processos da mesma máquina em um arquivo SQLite.
+
+    Guarda dados de pacientes: o arquivo é criado com permissão 0600 e os valores
+    são gravados em JSON.
+    """
+
+    def __init__(self, arquivo, capacidade=10000, ttl=60):
+        self.arquivo = arquivo
+        # Os arquivos -wal e -shm herdam a permissão do arquivo principal
+        os.close(os.open(arquivo, os.O_RDWR | os.O_CREAT, 0o600))
+        if os.stat(arquivo).st_uid != os.getuid():
+            raise RuntimeError(f'{arquivo} pertence a outro usuário')
+        os.chmod(arquivo, 0o600)
+        self.capacidade = capacidade
+        self.ttl = ttl
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._gravacoes = 0
+        with self._conexao() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS entradas (
+                    chave TEXT PRIMARY KEY,
+                    valor TEXT NOT NULL,
+                    expira_em REAL NOT NULL
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS versoes (
+                    chave TEXT PRIMARY KEY,
+                    versao INTEGER NOT NULL
+                )
+            ''')
+
+    def _conexao(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.arquivo, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _contar(self, hit):
+        with self._lock:
+            if hit:
+                self._hits += 1
+            else:
+                self._misses += 1
+
+    def buscar(self, chave):
+        conn = self._conexao()
+        linha = conn.execute(
+            'SELECT valor FROM entradas WHERE chave = ? AND expira_em > ?',
+            (chave, time.time())
+        ).fetchone()
+        if linha:
+            try:
+                valor = desserializar(linha[0])
+            except (TypeError, ValueError):
+                # Entrada de uma versão anterior (pickle): descartada como falta
+                conn.execute('DELETE FROM entradas WHERE chave = ?', (chave,))
+            else:
+                self._contar(True)
+                return True, valor
+        self._contar(False)
+        versao = conn.execute('SELECT versao FROM versoes WHERE chave = ?', (chave,)).fetchone()
+        return False, versao[0] if versao else 0
+
+    def guardar(self, chave, valor, versao):
+        conn = self._conexao()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            atual = conn.execute('SELECT versao FROM versoes WHERE chave = ?', (chave,)).fetchone()
+            if (atual[0] if atual else 0) == versao:
+                conn.execute(
+                    'INSERT OR REPLACE INTO entradas (chave, valor, expira_em) VALUES (?, ?, ?)',
+                    (chave, serializar(valor), time.time() + self.ttl)
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        with self._lock:
+            self._gravacoes += 1
+            aparar = self._gravacoes % 100 == 0
+        if aparar:
+            self._aparar(conn)
+
+    def _aparar(self, conn):
+        conn.execute('DELETE FROM entradas WHERE expira_em <= ?', (time.time(),))
+        conn.execute('''
+            DELETE FROM entradas WHERE chave IN (
+                SELECT chave FROM entradas ORDER BY expira_em DESC LIMIT -1 OFFSET ?
+            )
+        ''', (self.capacidade,))
+
+    def invalidar(self, *chaves):
+        conn = self._conexao()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for chave in chaves:
+                conn.execute('DELETE FROM entradas WHERE chave = ?', (chave,))
+                conn.execute('''
+                    INSERT INTO versoes (chave, versao) VALUES (?, 1)
+                    ON CONFLICT(chave) DO UPDATE SET versao = versao + 1
+                ''', (chave,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def limpar(self):
+        self._conexao().execute('DELETE FROM entradas')
+
+    def estatisticas(self):
+        with self._lock:
+            stats = {
+                'backend': 'sqlite',
+                'hits': self._hits,
+                'misses': self._misses,
+                'capacidade': self.capacidade,
+            }
+        stats['tamanho'] = self._conexao().execute('SELECT COUNT(*) FROM entradas').fetchone()[0]
+        return stats
+
+
+def criar_cache():
+    ttl = float(os.getenv('CACHE_TTL', '60'))
+    capacidade = int(os.getenv('CACHE_CAPACIDADE', '1000'))
+    # O padrão é compartilhado: o worker de notificações e cada processo do
+    # servidor web invalidam entradas uns dos outros. 'memoria' só é seguro com
+    # um único processo usando o banco.
+    if os.getenv('CACHE_BACKEND', 'sqlite') == 'sqlite':
+        arquivo = os.getenv('CACHE_ARQUIVO')
+        if not arquivo:
+            # Nunca no /tmp compartilhado: outro usuário poderia criar o arquivo antes
+            diretorio = diretorio_privado(os.path.expanduser('~/.cache/agendamentos'))
+            arquivo = os.path.join(diretorio, f"{os.getenv('DB_NAME', 'medical_appointments')}.sqlite3")
+        return CacheSQLite(arquivo, capacidade=capacidade, ttl=ttl)
+    return CacheLRU(capacidade=capacidade, ttl=ttl)
@@ -1,26 +1,114 @@
 import mysql.connector
-from mysql.connector import Error
+from mysql.connector import Error, IntegrityError, errorcode
 import os
 from dotenv import load_dotenv
-from datetime import datetime
-from email_utils import enviar_email
+from datetime import datetime, timedelta
 from models import Paciente, Recepcionista, Agendamento, Notificacao, Exame
+from db_pool import ConnectionPool, PoolTimeoutError
+from ocupacao import IndiceOcupacao
+from cache import criar_cache
+from mensagens import renderizar_mensagem
+import unidade_trabalho
+from logs import get_logger
+import metricas
+from perfil import CursorMedido
 
 load_dotenv()
 
+logger = get_logger(__name__)
+
+DB_DURACAO = metricas.histograma('db_funcao_duracao_segundos', 'Duração das chamadas às funções de db.py')
+
+def _medido(funcao):
+    return DB_DURACAO.medir(funcao=funcao.__name__)(funcao)
+
+def _conectar():
+    return mysql.connector.connect(
+        host=os.getenv('DB_HOST', 'localhost'),
+        user=os.getenv('DB_USER', 'root'),
+        password=os.getenv('DB_PASSWORD', ''),
+        database=os.getenv('DB_NAME', 'medical_appointments')
+    )
+
+_pool = ConnectionPool(
+    _conectar,
+    tamanho=int(os.getenv('DB_POOL_SIZE', '5')),
+    max_overflow=int(os.getenv('DB_POOL_MAX_OVERFLOW', '10')),
+    timeout=float(os.getenv('DB_POOL_TIMEOUT', '30')),
+    recycle=float(os.getenv('DB_POOL_RECYCLE', '3600')),
+    pre_ping=os.getenv('DB_POOL_PRE_PING', '1') == '1',
+    instrumentar_cursor=CursorMedido
+)
+
+@_medido
 def get_db_connection():
+    # Dentro de uma unidade de trabalho todas as funções compartilham a mesma
+    # conexão e transação; fora dela cada chamada pega uma conexão do pool.
+    unidade = unidade_trabalho.unidade_atual()
     try:
-        connection = mysql.connector.connect(
-            host=os.getenv('DB_HOST', 'localhost'),
-            user=os.getenv('DB_USER', 'root'),
-            password=os.getenv('DB_PASSWORD', ''),
-            database=os.getenv('DB_NAME', 'medical_appointments')
-        )
-        return connection
+        if unidade is not None:
+            return unidade.conexao()
+        return _pool.obter()
     except Error as e:
-        print(f"Erro ao conectar ao MySQL: {e}")
+        logger.error("Erro ao conectar ao MySQL: %s", e)
         return None
+    except PoolTimeoutError as e:
+        logger.error("Erro ao obter conexão do pool: %s", e)
+        return None
+
+def get_pool_stats():
+    return _pool.estatisticas()
+
+# Conexão fora do pool para quem segura locks de sessão (GET_LOCK): devolvê-la
+# ao pool entregaria o lock a outra parte do código
+def criar_conexao_dedicada():
+    return _conectar()
+
+# Usada pela sonda de prontidão: reaproveita uma conexão do pool em vez de abrir outra
+def verificar_banco():
+    conn = get_db_connection()
+    if not conn:
+        return False, 'sem conexão com o banco'
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT 1')
+        cursor.fetchall()
+        cursor.close()
+        return True, 'ok'
+    except Error as e:
+        return False, str(e)
+    finally:
+        conn.close()
+
+def init_app(app):
+    unidade_trabalho.init_app(app, _pool.obter)
+
+def unidade_de_trabalho():
+    return unidade_trabalho.unidade_de_trabalho(_pool.obter)
+
+# Efeitos em memória (índice de ocupação, cache) só valem depois do commit real:
+# dentro de uma unidade de trabalho eles esperam a transação ser confirmada.
+def _apos_confirmar(funcao, *args):
+    unidade = unidade_trabalho.unidade_atual()
+    if unidade is not None:
+        unidade.apos_confirmar(lambda: funcao(*args))
+    else:
+        funcao(*args)
+
+# Leituras do painel do paciente; invalidadas pelas escritas que as alteram
+_cache = criar_cache()
+
+def _invalidar_cache_paciente(*paciente_ids):
+    chaves = []
+    for paciente_id in set(paciente_ids):
+        chaves.extend([f'agendamentos:{paciente_id}', f'notificacoes:{paciente_id}'])
+    if chaves:
+        _cache.invalidar(*chaves)
+
+def get_cache_stats():
+    return _cache.estatisticas()
 
+@_medido
 def criar_usuario(username, password, nome, email, tipo_usuario):
     conn = get_db_connection()
     if conn:
@@ -33,12 +121,13 @@ def criar_usuario(username, password, nome, email, tipo_usuario):
             conn.commit()
             return cursor.lastrowid
         except Error as e:
-            print(f"Erro ao criar usuário: {e}")
+            logger.error("Erro ao criar usuário: %s", e)
             return None
         finally:
             cursor.close()
             conn.close()
 
+@_medido
 def criar_paciente(user_id, cpf, data_nascimento):
     conn = get_db_connection()
     if conn:
@@ -51,13 +140,30 @@ def criar_paciente(user_id, cpf, data_nascimento):
             conn.commit()
             return True
         except Error as e:
-            print(f"Erro ao criar paciente: {e}")
+            logger.error("Erro ao criar paciente: %s", e)
             return False
         finally:
             cursor.close()
             conn.close()
 
+def _paciente_da_linha(linha):
+    return Paciente(
+        id=linha['id'],
+        username=linha['username'],
+        nome=linha['nome'],
+        email=linha['email'],
+        cpf=linha['cpf'],
+        data_nascimento=linha['data_nascimento'],
+        user_id=linha['user_id']
+    )
+
+@_medido
 def get_paciente_by_user_id(user_id):
+    # O cache guarda a linha, não o objeto: o backend compartilhado só serializa dados
+    chave = f'paciente:{user_id}'
+    encontrado, valor = _cache.buscar(chave)
+    if encontrado:
+        return _paciente_da_linha(valor)
     conn = get_db_connection()
     if conn:
         try:
@@ -69,6 +175,30 @@ def get_paciente_by_user_id(user_id):
                 WHERE p.user_id = %s
             ''', (user_id,))
             result = cursor.fetchone()
+            if result:
+                _cache.guardar(chave, result, valor)
+                return _paciente_da_linha(result)
+            return None
+        except Error as e:
+            logger.error("Erro ao buscar paciente: %s", e)
+            return None
+        finally:
+            cursor.close()
+            conn.close()
+
+@_medido
+def get_paciente_by_id(paciente_id):
+    conn = get_db_connection()
+    if conn:
+        try:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute('''
+                SELECT p.*, u.nome, u.username, u.email 
+                FROM pacientes p 
+                JOIN users u ON p.user_id = u.id 
+                WHERE p.id = %s
+            ''', (paciente_id,))
+            result = cursor.fetchone()
             if result:
                 return Paciente(
                     id=result['id'],
@@ -81,53 +211,87 @@ def get_paciente_by_user_id(user_id):
                 )
             return None
         except Error as e:
-            print(f"Erro ao buscar paciente: {e}")
+            logger.error("Erro ao buscar paciente: %s", e)
             return None
         finally:
             cursor.close()
             conn.close()
 
-def verificar_disponibilidade(data_hora):
+SQL_OCUPACAO_DIA = '''
+    SELECT a.data_hora
+    FROM agendamentos a
+    WHERE a.data_hora >= %s AND a.data_hora < %s
+    AND a.status = 'agendado'
+'''
+
+@_medido
+def _carregar_ocupacao_dia(dia):
     conn = get_db_connection()
     if conn:
         try:
-            cursor = conn.cursor(dictionary=True)
-            cursor.execute('''
-                SELECT COUNT(*) as total
-                FROM agendamentos a
-                WHERE a.data_hora = %s
-                AND a.status = 'agendado'
-            ''', (data_hora,))
-            result = cursor.fetchone()
-            return result['total'] == 0
+            cursor = conn.cursor()
+            inicio = datetime.combine(dia, datetime.min.time())
+            cursor.execute(SQL_OCUPACAO_DIA, (inicio, inicio + timedelta(days=1)))
+            return [row[0] for row in cursor.fetchall()]
         except Error as e:
-            print(f"Erro ao verificar disponibilidade: {e}")
-            return False
+            logger.error("Erro ao carregar ocupação do dia: %s", e, extra={'dia': dia})
+            return None
         finally:
             cursor.close()
             conn.close()
 
+_ocupacao = IndiceOcupacao(
+    _carregar_ocupacao_dia,
+    ttl=float(os.getenv('OCUPACAO_TTL', '30')),
+    duracao_slot=int(os.getenv('SLOT_MINUTOS', '30'))
+)
+
+@_medido
+def verificar_disponibilidade(data_hora):
+    return _ocupacao.disponivel(data_hora)
+
+@_medido
+def get_proximos_horarios_livres(inicio, fim=None, quantidade=5):
+    fim = fim or inicio + timedelta(days=14)
+    return _ocupacao.proximos_livres(inicio, fim, quantidade)
+
+def _gravar_notificacoes(cursor, mensagens):
+    # Grava as mensagens do observador na mesma transação da alteração
+    if mensagens:
+        cursor.executemany('''
+            INSERT INTO notificacoes (paciente_id, agendamento_id, mensagem, email_destino, status_envio)
+            VALUES (%s, %s, %s, %s, %s)
+        ''', [(m['paciente_id'], m['agendamento_id'], m['mensagem'], m['email_destino'], m['status_envio'])
+              for m in mensagens])
+
+@_medido
 def agendar_exame(paciente_id, tipo_exame, data_hora):
-    print(f"Iniciando agendamento de exame para paciente {paciente_id}")
+    logger.debug("Iniciando agendamento de exame", extra={'paciente_id': paciente_id})
     if not verificar_disponibilidade(data_hora):
-        print("Horário indisponível para agendamento")
+        logger.info("Horário indisponível para agendamento", extra={'data_hora': data_hora})
         return False
-        
+
+    # Carregado antes de reservar a conexão: fora de uma unidade de trabalho
+    # get_paciente_by_id usa outra conexão do pool
+    paciente = get_paciente_by_id(paciente_id)
+    if not paciente:
+        logger.warning("Paciente não encontrado", extra={'paciente_id': paciente_id})
+        return False
+
     conn = get_db_connection()
     if conn:
         try:
             cursor = conn.cursor()
             
             # Registrando exame
-            print("Registrando exame...")
             cursor.execute('''
                 INSERT INTO exames (tipo_exame, data_hora, status)
                 VALUES (%s, %s, 'agendado')
             ''', (tipo_exame, data_hora))
             exame_id = cursor.lastrowid
             
-            # Registrando agendamento
-            print("Registrando agendamento...")
+            # Registrando agendamento. O índice único em agendamentos.horario_ativo
+            # garante no banco que só um agendamento ativo ocupa cada horário.
             cursor.execute('''
                 INSERT INTO agendamentos (paciente_id, exame_id, data_hora, status)
                 VALUES (%s, %s, %s, 'agendado')
@@ -135,11 +299,6 @@ def agendar_exame(paciente_id, tipo_exame, data_hora):
             agendamento_id = cursor.lastrowid
             
             # Criando objetos do modelo
-            paciente = get_paciente_by_user_id(paciente_id)
-            if not paciente:
-                print(f"Paciente {paciente_id} não encontrado")
-                return False
-                
             agendamento = Agendamento(
                 id=agendamento_id,
                 paciente=paciente,
@@ -151,20 +310,35 @@ def agendar_exame(paciente_id, tipo_exame, data_hora):
             notificacao = Notificacao()
             agendamento.attach(notificacao)
             
-            # Notificando sobre o novo agendamento
+            # Notificando sobre o novo agendamento; o e-mail sai pela fila
             agendamento.notify()
+            _gravar_notificacoes(cursor, notificacao.mensagens)
             
             conn.commit()
-            print("Agendamento concluído com sucesso")
+            _apos_confirmar(_ocupacao.ocupar, data_hora)
+            _apos_confirmar(_invalidar_cache_paciente, paciente_id)
+            logger.info("Agendamento concluído", extra={'paciente_id': paciente_id, 'agendamento_id': agendamento_id})
             return True
+        except IntegrityError as e:
+            if e.errno != errorcode.ER_DUP_ENTRY:
+                logger.error("Erro ao agendar exame: %s", e)
+                return False
+            logger.info("Horário ocupado por outro agendamento concluído antes", extra={'data_hora': data_hora})
+            _ocupacao.ocupar(data_hora)
+            return False
         except Exception as e:
-            print(f"Erro ao agendar exame: {e}")
+            logger.error("Erro ao agendar exame: %s", e)
             return False
         finally:
             cursor.close()
             conn.close()
 
+@_medido
 def get_agendamentos_paciente(paciente_id):
+    chave = f'agendamentos:{paciente_id}'
+    encontrado, valor = _cache.buscar(chave)
+    if encontrado:
+        return valor
     conn = get_db_connection()
     if conn:
         try:
@@ -176,39 +350,48 @@ def get_agendamentos_paciente(paciente_id):
                 WHERE a.paciente_id = %s AND a.status != 'cancelado'
                 ORDER BY a.data_hora
             ''', (paciente_id,))
-            return cursor.fetchall()
+            agendamentos = cursor.fetchall()
+            _cache.guardar(chave, agendamentos, valor)
+            return agendamentos
         except Error as e:
-            print(f"Erro ao buscar agendamentos: {e}")
+            logger.error("Erro ao buscar agendamentos: %s", e)
             return []
         finally:
             cursor.close()
             conn.close()
 
+@_medido
 def cancelar_agendamento(agendamento_id, paciente_id):
     conn = get_db_connection()
     if conn:
         try:
             cursor = conn.cursor(dictionary=True)
             
-            # Buscar informações do agendamento
+            # Buscar informações do agendamento e do paciente na mesma conexão
             cursor.execute('''
-                SELECT a.*, e.tipo_exame, e.data_hora, p.user_id
+                SELECT a.*, e.tipo_exame, e.data_hora, p.user_id, p.cpf, p.data_nascimento,
+                       u.nome, u.username, u.email
                 FROM agendamentos a
                 INNER JOIN exames e ON a.exame_id = e.id
                 INNER JOIN pacientes p ON a.paciente_id = p.id
+                INNER JOIN users u ON p.user_id = u.id
                 WHERE a.id = %s AND a.paciente_id = %s
             ''', (agendamento_id, paciente_id))
             agend_info = cursor.fetchone()
             
             if not agend_info:
-                print("Agendamento não encontrado")
+                logger.warning("Agendamento não encontrado", extra={'agendamento_id': agendamento_id})
                 return False
             
-            # Buscar paciente
-            paciente = get_paciente_by_user_id(agend_info['user_id'])
-            if not paciente:
-                print("Paciente não encontrado")
-                return False
+            paciente = Paciente(
+                id=paciente_id,
+                username=agend_info['username'],
+                nome=agend_info['nome'],
+                email=agend_info['email'],
+                cpf=agend_info['cpf'],
+                data_nascimento=agend_info['data_nascimento'],
+                user_id=agend_info['user_id']
+            )
             
             # Criar objeto de agendamento
             agendamento = Agendamento(
@@ -236,18 +419,23 @@ def cancelar_agendamento(agendamento_id, paciente_id):
                 WHERE a.id = %s
             ''', (agendamento_id,))
             
-            # Cancelar agendamento e notificar
+            # Cancelar agendamento e notificar; o e-mail sai pela fila
             agendamento.cancelar()
+            _gravar_notificacoes(cursor, notificacao.mensagens)
             
             conn.commit()
+            if agend_info['status'] == 'agendado':
+                _apos_confirmar(_ocupacao.liberar, agend_info['data_hora'])
+            _apos_confirmar(_invalidar_cache_paciente, paciente_id)
             return True
         except Exception as e:
-            print(f"Erro ao cancelar agendamento: {e}")
+            logger.error("Erro ao cancelar agendamento: %s", e)
             return False
         finally:
             cursor.close()
             conn.close()
 
+@_medido
 def criar_recepcionista(user_id, nome):
     conn = get_db_connection()
     if conn:
@@ -260,13 +448,18 @@ def criar_recepcionista(user_id, nome):
             conn.commit()
             return cursor.lastrowid
         except Error as e:
-            print(f"Erro ao criar recepcionista: {e}")
+            logger.error("Erro ao criar recepcionista: %s", e)
             return None
         finally:
             cursor.close()
             conn.close()
 
+@_medido
 def get_notificacoes_paciente(paciente_id):
+    chave = f'notificacoes:{paciente_id}'
+    encontrado, valor = _cache.buscar(chave)
+    if encontrado:
+        return valor
     conn = get_db_connection()
     if conn:
         try:
@@ -276,14 +469,17 @@ def get_notificacoes_paciente(paciente_id):
                 WHERE paciente_id = %s
                 ORDER BY created_at DESC
             ''', (paciente_id,))
-            return cursor.fetchall()
+            notificacoes = cursor.fetchall()
+            _cache.guardar(chave, notificacoes, valor)
+            return notificacoes
         except Error as e:
-            print(f"Erro ao buscar notificações: {e}")
+            logger.error("Erro ao buscar notificações: %s", e)
             return []
         finally:
             cursor.close()
             conn.close()
 
+@_medido
 def get_todos_pacientes():
     conn = get_db_connection()
     if conn:
@@ -297,12 +493,13 @@ def get_todos_pacientes():
             ''')
             return cursor.fetchall()
         except Error as e:
-            print(f"Erro ao buscar pacientes: {e}")
+            logger.error("Erro ao buscar pacientes: %s", e)
             return []
         finally:
             cursor.close()
             conn.close()
 
+@_medido
 def editar_agendamento(agendamento_id, tipo_exame, data_hora):
     if not verificar_disponibilidade(data_hora):
         return False
@@ -314,7 +511,8 @@ def editar_agendamento(agendamento_id, tipo_exame, data_hora):
             
             # Primeiro, buscar informações do paciente
             cursor.execute('''
-                SELECT p.id as paciente_id, u.email, u.nome
+                SELECT p.id as paciente_id, u.email, u.nome,
+                       a.data_hora as data_hora_anterior, a.status
                 FROM agendamentos a
                 JOIN pacientes p ON a.paciente_id = p.id
                 JOIN users u ON p.user_id = u.id
@@ -323,7 +521,7 @@ def editar_agendamento(agendamento_id, tipo_exame, data_hora):
             
             paciente_info = cursor.fetchone()
             if not paciente_info:
-                print("Paciente não encontrado")
+                logger.warning("Paciente não encontrado", extra={'agendamento_id': agendamento_id})
                 return False
             
             # Atualizar exame
@@ -342,21 +540,33 @@ def editar_agendamento(agendamento_id, tipo_exame, data_hora):
             ''', (data_hora, agendamento_id))
             
             # Criar notificação
-            mensagem = f'Seu exame de {tipo_exame} foi remarcado para {data_hora.strftime("%d/%m/%Y às %H:%M")}'
+            mensagem = renderizar_mensagem('remarcacao', paciente_info['nome'], tipo_exame, data_hora)
             cursor.execute('''
-                INSERT INTO notificacoes (paciente_id, mensagem, email_destino, status_envio)
-                VALUES (%s, %s, %s, 'pendente')
-            ''', (paciente_info['paciente_id'], mensagem, paciente_info['email']))
+                INSERT INTO notificacoes (paciente_id, agendamento_id, mensagem, email_destino, status_envio)
+                VALUES (%s, %s, %s, %s, 'pendente')
+            ''', (paciente_info['paciente_id'], agendamento_id, mensagem, paciente_info['email']))
             
             conn.commit()
+            if paciente_info['status'] == 'agendado':
+                _apos_confirmar(_ocupacao.liberar, paciente_info['data_hora_anterior'])
+                _apos_confirmar(_ocupacao.ocupar, data_hora)
+            _apos_confirmar(_invalidar_cache_paciente, paciente_info['paciente_id'])
             return True
+        except IntegrityError as e:
+            if e.errno == errorcode.ER_DUP_ENTRY:
+                logger.info("Novo horário ocupado por outro agendamento", extra={'agendamento_id': agendamento_id})
+                _ocupacao.ocupar(data_hora)
+            else:
+                logger.error("Erro ao editar agendamento: %s", e)
+            return False
         except Error as e:
-            print(f"Erro ao editar agendamento: {e}")
+            logger.error("Erro ao editar agendamento: %s", e)
             return False
         finally:
             cursor.close()
             conn.close()
 
+@_medido
 def get_agendamento(agendamento_id):
     conn = get_db_connection()
     if conn:
@@ -372,123 +582,290 @@ def get_agendamento(agendamento_id):
             ''', (agendamento_id,))
             return cursor.fetchone()
         except Error as e:
-            print(f"Erro ao buscar agendamento: {e}")
+            logger.error("Erro ao buscar agendamento: %s", e)
+            return None
+        finally:
+            cursor.close()
+            conn.close()
+
+@_medido
+def contar_notificacoes_pendentes():
+    conn = get_db_connection()
+    if conn:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM notificacoes WHERE status_envio = 'pendente'")
+            return cursor.fetchone()[0]
+        except Error as e:
+            logger.error("Erro ao contar notificações pendentes: %s", e)
             return None
         finally:
             cursor.close()
             conn.close()
+    return None
+
+# Reserva atomicamente até `limite` notificações pendentes para `worker_id`.
+# Linhas bloqueadas por outro worker são puladas (SKIP LOCKED) e reservas mais
+# antigas que `lease_segundos` são tratadas como abandonadas por um worker morto.
+# Notificações aguardando nova tentativa ficam de fora até proxima_tentativa_em.
+# Para os resumos (email_service), uma notificação só sai depois que a janela de
+# `janela` segundos iniciada por ela, ou por uma pendente anterior do mesmo
+# paciente, fechou; assim as alterações feitas em sequência chegam juntas.
+# Enquanto uma anterior do mesmo paciente espera o backoff, as seguintes também
+# ficam de fora, para que os e-mails não cheguem fora de ordem.
+SQL_RESERVAR_NOTIFICACOES = '''
+    SELECT n.id
+    FROM notificacoes n
+    LEFT JOIN agendamentos a ON n.agendamento_id = a.id
+    LEFT JOIN exames e ON a.exame_id = e.id
+    WHERE n.status_envio = 'pendente'
+    AND n.proxima_tentativa_em <= NOW()
+    AND (n.claimed_at IS NULL OR n.claimed_at < DATE_SUB(NOW(), INTERVAL %(lease)s SECOND))
+    AND (n.agendamento_id IS NULL OR e.data_hora > NOW())
+    AND (n.created_at <= DATE_SUB(NOW(), INTERVAL %(janela)s SECOND) OR EXISTS (
+        SELECT 1 FROM notificacoes h
+        WHERE h.paciente_id = n.paciente_id
+        AND h.status_envio = 'pendente'
+        AND h.created_at <= DATE_SUB(NOW(), INTERVAL %(janela)s SECOND)
+        AND h.created_at >= DATE_SUB(n.created_at, INTERVAL %(janela)s SECOND)
+    ))
+    AND NOT EXISTS (
+        SELECT 1 FROM notificacoes o
+        WHERE o.paciente_id = n.paciente_id
+        AND o.status_envio = 'pendente'
+        AND o.id < n.id
+        AND o.proxima_tentativa_em > NOW()
+    )
+    ORDER BY n.id
+    LIMIT %(limite)s
+    FOR UPDATE OF n SKIP LOCKED
+'''
+
+# Dados de envio das notificações reservadas. Cada notificação é ligada ao seu
+# próprio agendamento, sem multiplicar linhas pelos agendamentos do paciente.
+SQL_NOTIFICACOES_RESERVADAS = '''
+    SELECT n.*, u.email, e.tipo_exame, e.data_hora, u.nome as nome_paciente
+    FROM notificacoes n
+    INNER JOIN pacientes p ON n.paciente_id = p.id
+    INNER JOIN users u ON p.user_id = u.id
+    LEFT JOIN agendamentos a ON n.agendamento_id = a.id
+    LEFT JOIN exames e ON a.exame_id = e.id
+    WHERE n.id IN ({marcadores})
+    ORDER BY n.id
+'''
 
-def get_notificacoes_pendentes():
+@_medido
+def reivindicar_notificacoes(worker_id, limite=100, lease_segundos=600, janela_resumo=0):
     conn = get_db_connection()
     if conn:
         try:
             cursor = conn.cursor(dictionary=True)
-            cursor.execute('''
-                SELECT DISTINCT n.*, u.email, e.tipo_exame, e.data_hora, u.nome as nome_paciente
-                FROM notificacoes n
-                INNER JOIN pacientes p ON n.paciente_id = p.id
-                INNER JOIN users u ON p.user_id = u.id
-                LEFT JOIN agendamentos a ON n.paciente_id = a.paciente_id
-                LEFT JOIN exames e ON a.exame_id = e.id
-                WHERE n.status_envio = 'pendente'
-                AND (e.data_hora > NOW() OR e.data_hora IS NULL)
-                ORDER BY n.created_at DESC
-            ''')
+            cursor.execute(SQL_RESERVAR_NOTIFICACOES,
+                           {'lease': lease_segundos, 'janela': janela_resumo, 'limite': limite})
+            ids = [row['id'] for row in cursor.fetchall()]
+            if not ids:
+                conn.commit()
+                return []
+
+            marcadores = ', '.join(['%s'] * len(ids))
+            cursor.execute(f'''
+                UPDATE notificacoes
+                SET claimed_by = %s, claimed_at = NOW()
+                WHERE id IN ({marcadores})
+            ''', (worker_id, *ids))
+            conn.commit()
+
+            cursor.execute(SQL_NOTIFICACOES_RESERVADAS.format(marcadores=marcadores), tuple(ids))
             return cursor.fetchall()
         except Error as e:
-            print(f"Erro ao buscar notificações pendentes: {e}")
+            logger.error("Erro ao reivindicar notificações: %s", e)
             return []
         finally:
             cursor.close()
             conn.close()
 
+# Conta a tentativa e agenda a próxima com backoff exponencial: base * 2^(n-1)
+# segundos, limitado a `maximo`, com jitter entre 50% e 100% para que falhas do
+# mesmo lote não voltem todas no mesmo instante. As atribuições do UPDATE são
+# avaliadas da esquerda para a direita, então status_envio já vê `tentativas`
+# incrementado.
+SQL_REGISTRAR_FALHA_NOTIFICACAO = '''
+    UPDATE notificacoes
+    SET tentativas = tentativas + 1,
+        ultimo_erro = %s,
+        status_envio = IF(%s OR tentativas >= %s, 'erro', 'pendente'),
+        proxima_tentativa_em = DATE_ADD(NOW(), INTERVAL
+            ROUND(LEAST(%s, %s * POW(2, tentativas - 1)) * (0.5 + RAND() / 2)) SECOND),
+        claimed_by = NULL, claimed_at = NULL
+    WHERE id = %s AND claimed_by = %s
+'''
+
+# As notificações seguintes do mesmo paciente esperam a que falhou, para não
+# chegarem antes dela; se ela foi para 'erro', voltam para a fila normalmente.
+SQL_ADIAR_NOTIFICACOES = '''
+    UPDATE notificacoes n
+    INNER JOIN notificacoes f ON f.id = %s
+    SET n.proxima_tentativa_em = IF(f.status_envio = 'pendente',
+            GREATEST(n.proxima_tentativa_em, f.proxima_tentativa_em), n.proxima_tentativa_em),
+        n.claimed_by = NULL, n.claimed_at = NULL
+    WHERE n.id IN ({marcadores}) AND n.claimed_by = %s
+'''
+
+@_medido
+def registrar_falhas_notificacoes(falhas, worker_id, max_tentativas=8, backoff_base=60, backoff_maximo=21600):
+    """Grava as falhas de envio de uma execução.
+
+    `falhas` é uma lista de dicts com id, erro, permanente e adiadas (ids das
+    notificações seguintes do paciente, que não chegaram a ser tentadas).
+    """
+    if not falhas:
+        return True
+    conn = get_db_connection()
+    if conn:
+        try:
+            cursor = conn.cursor()
+            cursor.executemany(SQL_REGISTRAR_FALHA_NOTIFICACAO, [
+                ((falha['erro'] or '')[:500], bool(falha['permanente']), max_tentativas,
+                 backoff_maximo, backoff_base, falha['id'], worker_id)
+                for falha in falhas
+            ])
+            for falha in falhas:
+                if falha['adiadas']:
+                    marcadores = ', '.join(['%s'] * len(falha['adiadas']))
+                    cursor.execute(SQL_ADIAR_NOTIFICACOES.format(marcadores=marcadores),
+                                   (falha['id'], *falha['adiadas'], worker_id))
+            # O painel do paciente mostra as notificações que foram para 'erro'
+            marcadores = ', '.join(['%s'] * len(falhas))
+            cursor.execute(f'''
+                SELECT DISTINCT paciente_id FROM notificacoes
+                WHERE id IN ({marcadores}) AND status_envio = 'erro'
+            ''', tuple(falha['id'] for falha in falhas))
+            paciente_ids = [row[0] for row in cursor.fetchall()]
+            conn.commit()
+            _apos_confirmar(_invalidar_cache_paciente, *paciente_ids)
+            return True
+        except Error as e:
+            logger.error("Erro ao registrar falhas de envio: %s", e)
+            return False
+        finally:
+            cursor.close()
+            conn.close()
+    return False
+
+@_medido
 def marcar_notificacao_enviada(notificacao_id):
+    return marcar_notificacoes_enviadas([notificacao_id])
+
+@_medido
+def marcar_notificacoes_enviadas(notificacao_ids):
+    if not notificacao_ids:
+        return True
     conn = get_db_connection()
     if conn:
         try:
             cursor = conn.cursor()
-            cursor.execute('''
+            marcadores = ', '.join(['%s'] * len(notificacao_ids))
+            cursor.execute(f'''
                 UPDATE notificacoes
-                SET status_envio = 'enviado'
-                WHERE id = %s
-            ''', (notificacao_id,))
+                SET status_envio = 'enviado', claimed_by = NULL, claimed_at = NULL
+                WHERE id IN ({marcadores})
+            ''', tuple(notificacao_ids))
+            # O status de envio aparece no painel do paciente
+            cursor.execute(f'''
+                SELECT DISTINCT paciente_id FROM notificacoes WHERE id IN ({marcadores})
+            ''', tuple(notificacao_ids))
+            paciente_ids = [row[0] for row in cursor.fetchall()]
             conn.commit()
+            _apos_confirmar(_invalidar_cache_paciente, *paciente_ids)
             return True
         except Error as e:
-            print(f"Erro ao atualizar notificação: {e}")
+            logger.error("Erro ao atualizar notificações: %s", e)
             return False
         finally:
             cursor.close()
             conn.close()
+    return False
 
+SQL_AGENDAMENTOS_PROXIMAS_24H = '''
+    SELECT a.*, e.tipo_exame, u.email, u.nome as nome_paciente
+    FROM agendamentos a
+    INNER JOIN exames e ON a.exame_id = e.id
+    INNER JOIN pacientes p ON a.paciente_id = p.id
+    INNER JOIN users u ON p.user_id = u.id
+    WHERE a.status = 'agendado'
+    AND e.data_hora BETWEEN NOW() AND DATE_ADD(NOW(), INTERVAL 24 HOUR)
+    AND NOT EXISTS (
+        SELECT 1 FROM notificacoes n
+        WHERE n.agendamento_id = a.id
+        AND n.mensagem LIKE '%lembrete%'
+        AND n.created_at > DATE_SUB(NOW(), INTERVAL 24 HOUR)
+    )
+'''
+
+@_medido
 def get_agendamentos_proximas_24h():
     conn = get_db_connection()
     if conn:
         try:
             cursor = conn.cursor(dictionary=True)
-            cursor.execute('''
-                SELECT a.*, e.tipo_exame, u.email, u.nome as nome_paciente
-                FROM agendamentos a
-                INNER JOIN exames e ON a.exame_id = e.id
-                INNER JOIN pacientes p ON a.paciente_id = p.id
-                INNER JOIN users u ON p.user_id = u.id
-                WHERE a.status = 'agendado'
-                AND e.data_hora BETWEEN NOW() AND DATE_ADD(NOW(), INTERVAL 24 HOUR)
-                AND NOT EXISTS (
-                    SELECT 1 FROM notificacoes n
-                    WHERE n.paciente_id = a.paciente_id
-                    AND n.mensagem LIKE '%lembrete%'
-                    AND n.created_at > DATE_SUB(NOW(), INTERVAL 24 HOUR)
-                )
-            ''')
+            cursor.execute(SQL_AGENDAMENTOS_PROXIMAS_24H)
             return cursor.fetchall()
         except Error as e:
-            print(f"Erro ao buscar agendamentos próximos: {e}")
+            logger.error("Erro ao buscar agendamentos próximos: %s", e)
             return []
         finally:
             cursor.close()
             conn.close()
 
+@_medido
 def criar_notificacao_lembrete(agendamento):
+    return criar_notificacoes_lembrete([agendamento]) == 1
+
+# Grava os lembretes de vários agendamentos em uma única transação; o
+# executemany do conector transforma cada lote em um INSERT de várias linhas.
+@_medido
+def criar_notificacoes_lembrete(agendamentos, tamanho_lote=500):
+    linhas = [
+        (agend['paciente_id'], agend['id'],
+         renderizar_mensagem('lembrete', agend['nome_paciente'], agend['tipo_exame'], agend['data_hora']),
+         agend['email'])
+        for agend in agendamentos
+    ]
+    if not linhas:
+        return 0
     conn = get_db_connection()
     if conn:
         try:
             cursor = conn.cursor()
-            mensagem = f'''Olá {agendamento['nome_paciente']},
-
-LEMBRETE: Seu exame de {agendamento["tipo_exame"]} está agendado para amanhã às {agendamento["data_hora"].strftime("%H:%M")}.
-
-Local: Clínica de Exames
-Endereço: Rua dos Exames, 123
-Data: {agendamento["data_hora"].strftime("%d/%m/%Y")}
-Horário: {agendamento["data_hora"].strftime("%H:%M")}
-
-Lembretes importantes:
-- Chegue com 15 minutos de antecedência
-- Traga um documento com foto
-- Em caso de necessidade de cancelamento, avise com antecedência
-
-Atenciosamente,
-Equipe da Clínica'''
-
-            cursor.execute('''
-                INSERT INTO notificacoes (paciente_id, mensagem, email_destino, status_envio)
-                VALUES (%s, %s, %s, 'pendente')
-            ''', (agendamento['paciente_id'], mensagem, agendamento['email']))
+            for inicio in range(0, len(linhas), tamanho_lote):
+                cursor.executemany('''
+                    INSERT INTO notificacoes (paciente_id, agendamento_id, mensagem, email_destino, status_envio)
+                    VALUES (%s, %s, %s, %s, 'pendente')
+                ''', linhas[inicio:inicio + tamanho_lote])
             conn.commit()
-            return True
+            _apos_confirmar(_invalidar_cache_paciente, *(linha[0] for linha in linhas))
+            return len(linhas)
         except Error as e:
-            print(f"Erro ao criar notificação de lembrete: {e}")
-            return False
+            logger.error("Erro ao criar notificações de lembrete: %s", e)
+            return 0
         finally:
             cursor.close()
             conn.close()
+    return 0
 
+@_medido
 def atualizar_status_exame(exame_id, novo_status):
     conn = get_db_connection()
     if conn:
         try:
-            cursor = conn.cursor()
+            cursor = conn.cursor(dictionary=True)
+            
+            cursor.execute('''
+                SELECT paciente_id, data_hora, status
+                FROM agendamentos
+                WHERE exame_id = %s
+            ''', (exame_id,))
+            anteriores = cursor.fetchall()
             
             cursor.execute('''
                 UPDATE exames 
@@ -503,32 +880,92 @@ def atualizar_status_exame(exame_id, novo_status):
             ''', (novo_status, exame_id))
             
             conn.commit()
+            for anterior in anteriores:
+                if anterior['status'] == 'agendado' and novo_status != 'agendado':
+                    _apos_confirmar(_ocupacao.liberar, anterior['data_hora'])
+                elif anterior['status'] != 'agendado' and novo_status == 'agendado':
+                    _apos_confirmar(_ocupacao.ocupar, anterior['data_hora'])
+            _apos_confirmar(_invalidar_cache_paciente, *(anterior['paciente_id'] for anterior in anteriores))
             return True
         except Error as e:
-            print(f"Erro ao atualizar status do exame: {e}")
+            logger.error("Erro ao atualizar status do exame: %s", e)
             return False
         finally:
             cursor.close()
             conn.close()
 
-def get_agendamentos_recepcionista():
+@_medido
+def get_agendamentos_recepcionista(data_inicio=None, data_fim=None, status=None, tipo_exame=None,
+                                   paciente=None, apos=None, limite=50):
+    # Paginação por keyset em (data_hora, id) decrescentes: `apos` é o par do
+    # último item da página anterior. Retorna (agendamentos, cursor da próxima página).
+    condicoes = []
+    parametros = []
+    if data_inicio:
+        condicoes.append('a.data_hora >= %s')
+        parametros.append(data_inicio)
+    if data_fim:
+        condicoes.append('a.data_hora < %s')
+        parametros.append(data_fim)
+    if status:
+        condicoes.append('a.status = %s')
+        parametros.append(status)
+    if tipo_exame:
+        condicoes.append('e.tipo_exame = %s')
+        parametros.append(tipo_exame)
+    if paciente:
+        condicoes.append('u.nome LIKE %s')
+        parametros.append(f'%{paciente}%')
+    if apos:
+        condicoes.append('(a.data_hora < %s OR (a.data_hora = %s AND a.id < %s))')
+        parametros.extend([apos[0], apos[0], apos[1]])
+    where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ''
+
     conn = get_db_connection()
     if conn:
         try:
             cursor = conn.cursor(dictionary=True)
-            cursor.execute('''
+            cursor.execute(f'''
                 SELECT a.*, e.tipo_exame, e.status,
                        p.id as paciente_id, u.nome as nome_paciente
                 FROM agendamentos a
                 INNER JOIN exames e ON a.exame_id = e.id
                 INNER JOIN pacientes p ON a.paciente_id = p.id
                 INNER JOIN users u ON p.user_id = u.id
-                ORDER BY a.data_hora DESC
-            ''')
-            return cursor.fetchall()
+                {where}
+                ORDER BY a.data_hora DESC, a.id DESC
+                LIMIT %s
+            ''', (*parametros, limite + 1))
+            agendamentos = cursor.fetchall()
+            if len(agendamentos) > limite:
+                agendamentos = agendamentos[:limite]
+                ultimo = agendamentos[-1]
+                return agendamentos, (ultimo['data_hora'], ultimo['id'])
+            return agendamentos, None
         except Error as e:
-            print(f"Erro ao buscar agendamentos: {e}")
-            return []
+            logger.error("Erro ao buscar agendamentos: %s", e)
+            return [], None
         finally:
             cursor.close()
-            conn.close() 
\ No newline at end of file
+            conn.close()
+    return [], None
+
+@_medido
+def registrar_execucao_job(job, instancia, iniciado_em, duracao, status, detalhe=None):
+    conn = get_db_connection()
+    if conn:
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO execucoes_jobs (job, instancia, iniciado_em, duracao_ms, status, detalhe)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            ''', (job, instancia, iniciado_em, int(duracao * 1000), status, detalhe))
+            conn.commit()
+            return True
+        except Error as e:
+            logger.error("Erro ao registrar execução do job: %s", e, extra={'job': job})
+            return False
+        finally:
+            cursor.close()
+            conn.close()
+    return False
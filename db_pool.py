@@ -0,0 +1,181 @@
+import threading
+import time
+from collections import deque
+
+
+class PoolTimeoutError(Exception):
+    pass
+
+
+class ConexaoPool:
+    """Conexão emprestada do pool: close() devolve a conexão em vez de fechá-la."""
+
+    def __init__(self, pool, conn, criada_em):
+        self._pool = pool
+        self._conn = conn
+        self._criada_em = criada_em
+        self._devolvida = False
+
+    def close(self):
+        if not self._devolvida:
+            self._devolvida = True
+            self._pool._devolver(self._conn, self._criada_em)
+
+    def cursor(self, *args, **kwargs):
+        cursor = self._conn.cursor(*args, **kwargs)
+        if self._pool.instrumentar_cursor:
+            cursor = self._pool.instrumentar_cursor(cursor)
+        return cursor
+
+    def invalidar(self):
+        """Descarta a conexão física (por exemplo, após erro de rede)."""
+        if not self._devolvida:
+            self._devolvida = True
+            self._pool._descartar(self._conn)
+
+    def __getattr__(self, nome):
+        return getattr(self._conn, nome)
+
+
+class ConnectionPool:
+    def __init__(self, criar_conexao, tamanho=5, max_overflow=10, timeout=30,
+                 recycle=3600, pre_ping=True, instrumentar_cursor=None):
+        self._criar_conexao = criar_conexao
+        # Envolve cada cursor entregue (ex.: para medir as consultas)
+        self.instrumentar_cursor = instrumentar_cursor
+        self.tamanho = tamanho
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+
+        self._cond = threading.Condition()
+        self._ociosas = deque()
+        self._abertas = 0
+        self._em_uso = 0
+        self._stats = {
+            'checkouts': 0,
+            'esperas': 0,
+            'timeouts': 0,
+            'criadas': 0,
+            'recicladas': 0,
+            'descartadas': 0,
+            'tempo_espera_total': 0.0,
+        }
+
+    def obter(self):
+        inicio = time.monotonic()
+        limite = inicio + self.timeout
+        conn = None
+        criada_em = None
+
+        with self._cond:
+            while True:
+                if self._ociosas:
+                    conn, criada_em = self._ociosas.pop()
+                    break
+                if self._abertas < self.tamanho + self.max_overflow:
+                    self._abertas += 1
+                    break
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeoutError(
+                        f"Nenhuma conexão livre após {self.timeout}s "
+                        f"({self._abertas} abertas, {self._em_uso} em uso)"
+                    )
+                self._stats['esperas'] += 1
+                self._cond.wait(restante)
+            self._em_uso += 1
+            self._stats['checkouts'] += 1
+            self._stats['tempo_espera_total'] += time.monotonic() - inicio
+
+        # Validação e criação acontecem fora do lock para não serializar o pool
+        if conn is not None:
+            if self.recycle and time.monotonic() - criada_em > self.recycle:
+                self._fechar(conn)
+                conn = None
+                with self._cond:
+                    self._stats['recicladas'] += 1
+            elif self.pre_ping and not self._ping(conn):
+                self._fechar(conn)
+                conn = None
+                with self._cond:
+                    self._stats['descartadas'] += 1
+
+        if conn is None:
+            try:
+                conn = self._criar_conexao()
+                criada_em = time.monotonic()
+            except Exception:
+                with self._cond:
+                    self._abertas -= 1
+                    self._em_uso -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._stats['criadas'] += 1
+
+        return ConexaoPool(self, conn, criada_em)
+
+    def _devolver(self, conn, criada_em):
+        try:
+            # Descarta qualquer transação não confirmada antes de reutilizar
+            conn.rollback()
+        except Exception:
+            self._descartar(conn)
+            return
+
+        with self._cond:
+            self._em_uso -= 1
+            if len(self._ociosas) >= self.tamanho:
+                self._abertas -= 1
+                excedente = True
+            else:
+                self._ociosas.append((conn, criada_em))
+                excedente = False
+            self._cond.notify()
+
+        if excedente:
+            self._fechar(conn)
+
+    def _descartar(self, conn):
+        with self._cond:
+            self._em_uso -= 1
+            self._abertas -= 1
+            self._stats['descartadas'] += 1
+            self._cond.notify()
+        self._fechar(conn)
+
+    def _ping(self, conn):
+        try:
+            return conn.is_connected()
+        except Exception:
+            return False
+
+    def _fechar(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def fechar_todas(self):
+        with self._cond:
+            ociosas = list(self._ociosas)
+            self._ociosas.clear()
+            self._abertas -= len(ociosas)
+        for conn, _ in ociosas:
+            self._fechar(conn)
+
+    def estatisticas(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'tamanho': self.tamanho,
+                'max_overflow': self.max_overflow,
+                'abertas': self._abertas,
+                'em_uso': self._em_uso,
+                'ociosas': len(self._ociosas),
+            })
+        stats['tempo_espera_total'] = round(stats['tempo_espera_total'], 6)
+        return stats
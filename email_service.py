@@ -1,51 +1,263 @@
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from db import (
-    get_notificacoes_pendentes, marcar_notificacao_enviada,
-    get_agendamentos_proximas_24h, criar_notificacao_lembrete
+    reivindicar_notificacoes, registrar_falhas_notificacoes, marcar_notificacoes_enviadas,
+    get_agendamentos_proximas_24h, criar_notificacoes_lembrete, unidade_de_trabalho
 )
-from email_utils import enviar_email
+from email_utils import entregar_email
+from mensagens import assunto as assunto_email, identificar_tipo, renderizar_resumo, ASSUNTO_RESUMO
+from logs import get_logger
+import metricas
 
-def enviar_notificacoes():
-    try:
-        notificacoes = get_notificacoes_pendentes()
-        if not notificacoes:
-            print("Nenhuma notificação pendente")
+logger = get_logger(__name__)
+
+JOB_DURACAO = metricas.histograma('job_duracao_segundos', 'Duração das execuções dos jobs agendados',
+                                  buckets=(0.1, 0.5, 1, 5, 15, 30, 60, 120, 300, 600))
+
+NOTIFICACOES_CONCORRENCIA = int(os.getenv('NOTIFICACOES_CONCORRENCIA', '4'))
+# Limite deste processo; com vários workers, cada um recebe o limite do relay dividido por N
+EMAIL_TAXA_MAXIMA = float(os.getenv('EMAIL_TAXA_MAXIMA', '5'))
+NOTIFICACOES_LOTE = int(os.getenv('NOTIFICACOES_LOTE', '100'))
+NOTIFICACOES_LEASE_SEGUNDOS = int(os.getenv('NOTIFICACOES_LEASE_SEGUNDOS', '600'))
+NOTIFICACOES_INTERVALO_CONFIRMACAO = float(os.getenv('NOTIFICACOES_INTERVALO_CONFIRMACAO', '5'))
+NOTIFICACOES_MAX_TENTATIVAS = int(os.getenv('NOTIFICACOES_MAX_TENTATIVAS', '8'))
+NOTIFICACOES_BACKOFF_BASE = int(os.getenv('NOTIFICACOES_BACKOFF_BASE', '60'))
+NOTIFICACOES_BACKOFF_MAXIMO = int(os.getenv('NOTIFICACOES_BACKOFF_MAXIMO', '21600'))
+# Notificações do mesmo destinatário criadas dentro desta janela (segundos) saem em um único e-mail; 0 desliga
+NOTIFICACOES_JANELA_RESUMO = float(os.getenv('NOTIFICACOES_JANELA_RESUMO', '120'))
+WORKER_ID = os.getenv('WORKER_ID') or f"{socket.gethostname()}:{os.getpid()}"
+
+class LimitadorTaxa:
+    """Token bucket compartilhado pelas threads de envio do processo: no máximo `taxa` envios por segundo."""
+
+    def __init__(self, taxa, rajada=None):
+        self.taxa = taxa
+        self.capacidade = rajada or max(1.0, taxa)
+        self._tokens = self.capacidade
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def aguardar(self):
+        if self.taxa <= 0:
             return
-            
-        for notif in notificacoes:
-            try:
-                if not notif.get('email'):
-                    print(f"E-mail não encontrado para notificação {notif.get('id')}")
-                    continue
-                    
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                self._tokens = min(self.capacidade, self._tokens + (agora - self._ultimo) * self.taxa)
+                self._ultimo = agora
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                espera = (1 - self._tokens) / self.taxa
+            time.sleep(espera)
+
+class ConfirmacoesEmLote:
+    """Acumula os resultados dos envios e os grava com um UPDATE por lote.
+
+    Enviadas são gravadas quando o lote enche ou após `intervalo` segundos.
+    Falhas continuam reservadas até fechar(), para não serem reivindicadas
+    de novo na mesma execução; lá cada uma ganha sua próxima tentativa (ou vai
+    para 'erro') e as seguintes do paciente são adiadas junto.
+    """
+
+    def __init__(self, worker_id, tamanho_lote=100, intervalo=5.0):
+        self.worker_id = worker_id
+        self.tamanho_lote = tamanho_lote
+        self.intervalo = intervalo
+        self._enviadas = []
+        self._falhas = []
+        self._falha_por_paciente = {}
+        self._ultima_gravacao = time.monotonic()
+        self._lock = threading.Lock()
+
+    def enviada(self, *notificacao_ids):
+        with self._lock:
+            self._enviadas.extend(notificacao_ids)
+            cheio = len(self._enviadas) >= self.tamanho_lote
+            expirado = time.monotonic() - self._ultima_gravacao >= self.intervalo
+        if cheio or expirado:
+            self.gravar()
+
+    def falhou(self, notificacao, erro, permanente=False, seguintes=()):
+        falha = {'id': notificacao['id'], 'erro': erro, 'permanente': permanente, 'adiadas': list(seguintes)}
+        with self._lock:
+            self._falhas.append(falha)
+            self._falha_por_paciente[notificacao['paciente_id']] = falha
+
+    def adiar(self, paciente_id, notificacao_ids):
+        with self._lock:
+            self._falha_por_paciente[paciente_id]['adiadas'].extend(notificacao_ids)
+
+    def gravar(self):
+        with self._lock:
+            ids, self._enviadas = self._enviadas, []
+            self._ultima_gravacao = time.monotonic()
+        # Se a gravação falhar, as linhas voltam para a fila quando a reserva expirar
+        if ids and not marcar_notificacoes_enviadas(ids):
+            logger.warning("Não foi possível confirmar notificações enviadas", extra={'quantidade': len(ids)})
+
+    def fechar(self):
+        self.gravar()
+        with self._lock:
+            falhas, self._falhas = self._falhas, []
+            self._falha_por_paciente = {}
+        # Se a gravação falhar, as linhas voltam para a fila quando a reserva expirar
+        if not registrar_falhas_notificacoes(falhas, self.worker_id, NOTIFICACOES_MAX_TENTATIVAS,
+                                             NOTIFICACOES_BACKOFF_BASE, NOTIFICACOES_BACKOFF_MAXIMO):
+            logger.warning("Não foi possível registrar falhas de envio", extra={'quantidade': len(falhas)})
+
+def _agrupar_por_paciente(notificacoes):
+    grupos = OrderedDict()
+    for notif in sorted(notificacoes, key=lambda n: (n['created_at'], n['id'])):
+        grupos.setdefault(notif['paciente_id'], []).append(notif)
+    return list(grupos.values())
+
+def _agrupar_em_resumos(grupo, janela):
+    # Notificações seguidas para o mesmo e-mail, criadas até `janela` segundos
+    # depois da primeira, viram um único envio
+    resumos = []
+    for notif in grupo:
+        atual = resumos[-1] if resumos else None
+        if (atual and janela > 0 and notif.get('email') and notif['email'] == atual[0].get('email')
+                and (notif['created_at'] - atual[0]['created_at']).total_seconds() <= janela):
+            atual.append(notif)
+        else:
+            resumos.append([notif])
+    return resumos
+
+def _enviar_grupo(grupo, limitador, confirmacoes, janela_resumo=None):
+    # As notificações de um paciente saem em ordem; uma falha interrompe o grupo
+    # para que as seguintes não cheguem antes dela na próxima execução.
+    janela_resumo = NOTIFICACOES_JANELA_RESUMO if janela_resumo is None else janela_resumo
+    resultado = {'enviadas': 0, 'agrupadas': 0, 'falhas': 0, 'ignoradas': 0}
+    resumos = _agrupar_em_resumos(grupo, janela_resumo)
+    for posicao, resumo in enumerate(resumos):
+        notif = resumo[0]
+        seguintes = [n['id'] for n in resumo[1:]] + [n['id'] for r in resumos[posicao + 1:] for n in r]
+        try:
+            if not notif.get('email'):
+                logger.warning("E-mail não encontrado para notificação", extra={'notificacao_id': notif.get('id')})
+                confirmacoes.falhou(notif, 'paciente sem e-mail', permanente=True)
+                resultado['ignoradas'] += 1
+                continue
+
+            if len(resumo) == 1:
                 # Determina o assunto com base no conteúdo da mensagem
-                assunto = 'Lembrete de Exame' if 'LEMBRETE' in notif['mensagem'] else 'Confirmação de Agendamento'
-                
-                if enviar_email(notif['email'], assunto, notif['mensagem']):
-                    marcar_notificacao_enviada(notif['id'])
-                
-            except Exception as e:
-                print(f"Erro ao processar notificação para {notif.get('email')}: {e}")
-                
-    except Exception as e:
-        print(f"Erro geral no processo de envio de notificações: {e}")
+                assunto = assunto_email(identificar_tipo(notif['mensagem']))
+                texto = notif['mensagem']
+            else:
+                assunto = ASSUNTO_RESUMO
+                texto = renderizar_resumo(notif.get('nome_paciente'), [n['mensagem'] for n in resumo])
+
+            limitador.aguardar()
+            envio = entregar_email(notif['email'], assunto, texto)
+            if envio['enviado']:
+                confirmacoes.enviada(*[n['id'] for n in resumo])
+                resultado['enviadas'] += len(resumo)
+                resultado['agrupadas'] += len(resumo) - 1
+            else:
+                resultado['falhas'] += 1
+                if envio['permanente']:
+                    # O destinatário foi recusado: todo o resumo vai para 'erro'
+                    for outra in resumo[1:]:
+                        confirmacoes.falhou(outra, envio['erro'], permanente=True)
+                    seguintes = seguintes[len(resumo) - 1:]
+                confirmacoes.falhou(notif, envio['erro'], envio['permanente'], seguintes)
+                break
+
+        except Exception as e:
+            logger.exception("Erro ao processar notificação", extra={'notificacao_id': notif.get('id')})
+            resultado['falhas'] += 1
+            confirmacoes.falhou(notif, repr(e), False, seguintes)
+            break
+    return resultado
+
+@JOB_DURACAO.medir(job='enviar_notificacoes')
+def enviar_notificacoes(concorrencia=None, taxa_maxima=None, worker_id=None, parar=None, janela_resumo=None):
+    # `parar` (threading.Event) interrompe a reserva de novos lotes; o lote em
+    # andamento termina e as confirmações são gravadas antes de retornar
+    concorrencia = concorrencia or NOTIFICACOES_CONCORRENCIA
+    taxa_maxima = EMAIL_TAXA_MAXIMA if taxa_maxima is None else taxa_maxima
+    janela_resumo = NOTIFICACOES_JANELA_RESUMO if janela_resumo is None else janela_resumo
+    worker_id = worker_id or WORKER_ID
+    inicio = time.monotonic()
+    resumo = {'total': 0, 'enviadas': 0, 'agrupadas': 0, 'falhas': 0, 'ignoradas': 0}
+    confirmacoes = ConfirmacoesEmLote(worker_id, NOTIFICACOES_LOTE, NOTIFICACOES_INTERVALO_CONFIRMACAO)
+    pacientes_com_falha = set()
+    try:
+        limitador = LimitadorTaxa(taxa_maxima)
+        executor = ThreadPoolExecutor(max_workers=concorrencia) if concorrencia > 1 else None
+        try:
+            while not (parar and parar.is_set()):
+                notificacoes = reivindicar_notificacoes(
+                    worker_id, NOTIFICACOES_LOTE, NOTIFICACOES_LEASE_SEGUNDOS, janela_resumo
+                ) or []
+                if not notificacoes:
+                    break
+
+                resumo['total'] += len(notificacoes)
+                grupos = []
+                for grupo in _agrupar_por_paciente(notificacoes):
+                    if grupo[0]['paciente_id'] in pacientes_com_falha:
+                        confirmacoes.adiar(grupo[0]['paciente_id'], [n['id'] for n in grupo])
+                    else:
+                        grupos.append(grupo)
+
+                if executor is None:
+                    resultados = [_enviar_grupo(grupo, limitador, confirmacoes, janela_resumo) for grupo in grupos]
+                else:
+                    resultados = list(executor.map(
+                        lambda grupo: _enviar_grupo(grupo, limitador, confirmacoes, janela_resumo), grupos
+                    ))
 
+                for grupo, resultado in zip(grupos, resultados):
+                    if resultado['falhas']:
+                        pacientes_com_falha.add(grupo[0]['paciente_id'])
+                    for chave, valor in resultado.items():
+                        resumo[chave] += valor
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    except Exception:
+        logger.exception("Erro geral no processo de envio de notificações")
+    finally:
+        confirmacoes.fechar()
+
+    if not resumo['total']:
+        logger.debug("Nenhuma notificação pendente")
+        return resumo
+
+    duracao = time.monotonic() - inicio
+    resumo['duracao'] = round(duracao, 3)
+    resumo['por_segundo'] = round(resumo['enviadas'] / duracao, 2) if duracao > 0 else 0.0
+    logger.info("Envio de notificações concluído", extra=resumo)
+    return resumo
+
+@JOB_DURACAO.medir(job='verificar_agendamentos_24h')
 def verificar_agendamentos_24h():
     try:
-        agendamentos = get_agendamentos_proximas_24h()
-        if not agendamentos:
-            return
-            
-        for agend in agendamentos:
-            try:
+        # A leitura e a gravação dos lembretes usam a mesma conexão e um único commit
+        with unidade_de_trabalho():
+            agendamentos = get_agendamentos_proximas_24h()
+            if not agendamentos:
+                return 0
+
+            com_email = []
+            for agend in agendamentos:
                 if not agend.get('email'):
-                    print(f"E-mail não encontrado para agendamento {agend.get('id')}")
+                    logger.warning("E-mail não encontrado para agendamento", extra={'agendamento_id': agend.get('id')})
                     continue
-                    
-                criar_notificacao_lembrete(agend)
-                print(f"Lembrete criado com sucesso para {agend['email']}")
-                
-            except Exception as e:
-                print(f"Erro ao criar lembrete para {agend.get('email')}: {e}")
-                
-    except Exception as e:
-        print(f"Erro geral no processo de verificação de agendamentos: {e}") 
\ No newline at end of file
+                com_email.append(agend)
+
+            criados = criar_notificacoes_lembrete(com_email)
+        logger.info("Lembretes criados", extra={'quantidade': criados})
+        return criados
+
+    except Exception:
+        logger.exception("Erro geral no processo de verificação de agendamentos")
+        return 0
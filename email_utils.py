@@ -1,92 +1,223 @@
 import yagmail
 import smtplib
 import os
+import re
+import threading
+import time
+import atexit
 from dotenv import load_dotenv
+from mensagens import renderizar_html
+from logs import get_logger
+import metricas
+from perfil import registrar_smtp
 
 load_dotenv()
 
+logger = get_logger(__name__)
+
+SMTP_DURACAO = metricas.histograma('smtp_envio_duracao_segundos', 'Duração do envio de um e-mail pela sessão SMTP')
+SMTP_FALHAS = metricas.contador('smtp_falhas_total', 'E-mails não enviados, por motivo')
+
 def get_yagmail_instance():
     try:
         email = os.getenv('EMAIL_USER')
         password = os.getenv('EMAIL_PASSWORD')
         if not email or not password:
-            print("Erro: Credenciais de e-mail não configuradas")
+            logger.error("Credenciais de e-mail não configuradas")
             return None
             
-        print(f"Tentando conectar com o e-mail: {email}")
-        print("Configurações SMTP:")
-        print("- Host: smtp.gmail.com")
-        print("- Porta: 587")
-        print("- TLS: Ativado")
-        print("- SSL: Desativado")
+        # Gmail por padrão; os benchmarks apontam para um servidor SMTP local
+        host = os.getenv('EMAIL_HOST', 'smtp.gmail.com')
+        porta = int(os.getenv('EMAIL_PORT', '587'))
+        starttls = os.getenv('EMAIL_STARTTLS', '1') == '1'
+        logger.debug("Abrindo conexão SMTP", extra={'usuario': email, 'host': host, 'porta': porta,
+                                                     'starttls': starttls, 'ssl': False})
             
         return yagmail.SMTP(
             user=email,
             password=password,
-            host='smtp.gmail.com',
-            port=587,
-            smtp_starttls=True,
+            host=host,
+            port=porta,
+            smtp_starttls=starttls,
             smtp_ssl=False
         )
     except smtplib.SMTPAuthenticationError as e:
-        print(f"Erro de autenticação detalhado: {str(e)}")
-        print("Por favor, verifique:")
-        print("1. Se a verificação em duas etapas está ativada")
-        print("2. Se a senha de app foi gerada corretamente")
-        print("3. Se a senha foi copiada sem espaços extras")
+        logger.error("Erro de autenticação SMTP: %s. Verifique se a verificação em duas etapas está "
+                     "ativada e se a senha de app foi gerada e copiada corretamente", e)
         return None
     except Exception as e:
-        print(f"Erro ao criar instância do yagmail: {e}")
+        logger.error("Erro ao criar instância do yagmail: %s", e)
         return None
 
-def enviar_email(destinatario, assunto, mensagem):
-    print(f"\nIniciando envio de e-mail para {destinatario}")
-    print(f"Assunto: {assunto}")
-    
-    try:
-        print("Obtendo instância do yagmail...")
+class SessaoSMTP:
+    """Conexão SMTP autenticada reaproveitada entre vários envios."""
+
+    def __init__(self, max_mensagens):
+        self.max_mensagens = max_mensagens
+        self.yag = None
+        self.enviadas = 0
+        self.ultimo_uso = 0.0
+
+    def conectar(self):
+        self.fechar()
         yag = get_yagmail_instance()
         if not yag:
-            print("Não foi possível inicializar o serviço de e-mail - yagmail retornou None")
             return False
-            
-        print("Preparando conteúdo do e-mail...")
-        conteudo = [
-            f'''
-            <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto; padding: 20px;">
-                <h2 style="color: #2c3e50;">Sistema de Agendamento de Exames</h2>
-                <div style="background-color: #f8f9fa; padding: 20px; border-radius: 5px;">
-                    {mensagem.replace(chr(10), '<br>')}
-                </div>
-                <p style="color: #7f8c8d; font-size: 12px; margin-top: 20px;">
-                    Esta é uma mensagem automática, por favor não responda.
-                </p>
-            </div>
-            '''
-        ]
-        
-        print("Enviando e-mail via yagmail...")
-        yag.send(
+        try:
+            yag.login()
+        except Exception:
+            yag.close()
+            raise
+        self.yag = yag
+        self.enviadas = 0
+        return True
+
+    def enviar(self, destinatario, assunto, conteudo):
+        if self.yag is None or self.enviadas >= self.max_mensagens:
+            if not self.conectar():
+                return False
+        # O HTML já sai pronto de mensagens.renderizar_html; o prettify do yagmail
+        # (premailer) reprocessaria o CSS de cada mensagem
+        destinatarios, mensagem = self.yag.prepare_send(
             to=destinatario,
             subject=assunto,
-            contents=conteudo
+            contents=conteudo,
+            prettify_html=False
         )
-        print(f"E-mail enviado com sucesso para {destinatario}")
+        self.yag.smtp.sendmail(self.yag.user, destinatarios, mensagem)
+        self.enviadas += 1
+        self.ultimo_uso = time.monotonic()
         return True
-    except smtplib.SMTPAuthenticationError as e:
-        print(f"Erro de autenticação SMTP: {e}")
-        print("Verifique as credenciais no arquivo .env")
+
+    def fechar(self):
+        if self.yag is not None:
+            try:
+                self.yag.close()
+            except Exception:
+                pass
+            self.yag = None
+
+
+class GerenciadorSessoesSMTP:
+    """Mantém até max_sessoes conexões SMTP abertas e as empresta a cada envio."""
+
+    def __init__(self, max_sessoes=2, max_mensagens_por_conexao=100, tempo_ocioso=60):
+        self.max_mensagens_por_conexao = max_mensagens_por_conexao
+        self.tempo_ocioso = tempo_ocioso
+        self._ociosas = []
+        self._lock = threading.Lock()
+        self._vagas = threading.BoundedSemaphore(max_sessoes)
+
+    def _obter_sessao(self):
+        with self._lock:
+            while self._ociosas:
+                sessao = self._ociosas.pop()
+                # Servidores derrubam conexões ociosas; melhor reabrir do que falhar no envio
+                if time.monotonic() - sessao.ultimo_uso > self.tempo_ocioso:
+                    sessao.fechar()
+                return sessao
+        return SessaoSMTP(self.max_mensagens_por_conexao)
+
+    def enviar(self, destinatario, assunto, conteudo):
+        self._vagas.acquire()
+        sessao = self._obter_sessao()
+        try:
+            try:
+                return sessao.enviar(destinatario, assunto, conteudo)
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                logger.warning("Conexão SMTP perdida, reconectando")
+                sessao.fechar()
+                return sessao.enviar(destinatario, assunto, conteudo)
+        except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+            # Recusa do servidor para esta mensagem; a conexão continua válida.
+            # SMTPRecipientsRefused não herda de SMTPResponseException.
+            raise
+        except Exception:
+            sessao.fechar()
+            raise
+        finally:
+            with self._lock:
+                self._ociosas.append(sessao)
+            self._vagas.release()
+
+    def fechar_todas(self):
+        with self._lock:
+            for sessao in self._ociosas:
+                sessao.fechar()
+
+_sessoes_smtp = GerenciadorSessoesSMTP(
+    max_sessoes=int(os.getenv('EMAIL_MAX_SESSOES', '4')),
+    max_mensagens_por_conexao=int(os.getenv('EMAIL_MAX_MENSAGENS_POR_CONEXAO', '100')),
+    tempo_ocioso=float(os.getenv('EMAIL_TEMPO_OCIOSO', '60'))
+)
+atexit.register(_sessoes_smtp.fechar_todas)
+
+# Código estendido (RFC 3463) no início da resposta, ex.: b'5.1.1 User unknown'
+_CODIGO_ESTENDIDO = re.compile(r'^\s*([245])\.(\d{1,3})\.\d{1,3}')
+
+
+def _classe_estendida(resposta):
+    if isinstance(resposta, bytes):
+        resposta = resposta.decode('utf-8', 'replace')
+    encontrado = _CODIGO_ESTENDIDO.match(resposta or '')
+    return (encontrado.group(1), encontrado.group(2)) if encontrado else None
+
+
+def _destinatario_invalido(codigo, resposta):
+    # Recusa no RCPT: permanente se 5xx, exceto cota (5.4.x) e política (5.7.x),
+    # que dependem da conta ou do relay e passam numa nova tentativa
+    if not 500 <= codigo < 600:
         return False
-    except smtplib.SMTPException as e:
-        print(f"Erro SMTP ao enviar e-mail: {e}")
+    return _classe_estendida(resposta) not in (('5', '4'), ('5', '7'))
+
+
+def falha_permanente(excecao):
+    """Só recusas do endereço de destino são permanentes; o resto volta para a fila.
+
+    Autenticação, remetente recusado (ex.: cota diária do Gmail no MAIL FROM) e
+    recusas do DATA vêm da conta ou do relay, não do destinatário. Fora do RCPT,
+    só um código estendido 5.1.x (endereço inválido) é permanente.
+    """
+    if isinstance(excecao, (smtplib.SMTPAuthenticationError, smtplib.SMTPSenderRefused)):
         return False
+    if isinstance(excecao, smtplib.SMTPRecipientsRefused):
+        recusas = list(excecao.recipients.values())
+        return bool(recusas) and all(_destinatario_invalido(codigo, resposta) for codigo, resposta in recusas)
+    if isinstance(excecao, smtplib.SMTPResponseException):
+        return 500 <= excecao.smtp_code < 600 and _classe_estendida(excecao.smtp_error) == ('5', '1')
+    return False
+
+def entregar_email(destinatario, assunto, mensagem):
+    """Envia e devolve {'enviado', 'permanente', 'erro'} para quem agenda novas tentativas."""
+    campos = {'destinatario': destinatario, 'assunto': assunto}
+    try:
+        conteudo = [renderizar_html(mensagem)]
+        inicio = time.perf_counter()
+        try:
+            enviado = _sessoes_smtp.enviar(destinatario, assunto, conteudo)
+        finally:
+            duracao = time.perf_counter() - inicio
+            SMTP_DURACAO.observar(duracao)
+            registrar_smtp(duracao)
+        if not enviado:
+            SMTP_FALHAS.inc(motivo='sem_conexao')
+            logger.error("Não foi possível inicializar o serviço de e-mail", extra=campos)
+            return {'enviado': False, 'permanente': False, 'erro': 'sem conexão SMTP'}
+        logger.debug("E-mail enviado", extra=campos)
+        return {'enviado': True, 'permanente': False, 'erro': None}
+    except smtplib.SMTPAuthenticationError as e:
+        SMTP_FALHAS.inc(motivo='autenticacao')
+        logger.error("Erro de autenticação SMTP: %s. Verifique as credenciais no arquivo .env", e, extra=campos)
+        return {'enviado': False, 'permanente': False, 'erro': str(e)}
+    except smtplib.SMTPException as e:
+        permanente = falha_permanente(e)
+        SMTP_FALHAS.inc(motivo='recusa_permanente' if permanente else 'smtp')
+        logger.error("Erro SMTP ao enviar e-mail: %s", e, extra={**campos, 'permanente': permanente})
+        return {'enviado': False, 'permanente': permanente, 'erro': str(e)}
     except Exception as e:
-        print(f"Erro inesperado ao enviar e-mail: {e}")
-        return False
-    finally:
-        if 'yag' in locals():
-            try:
-                print("Fechando conexão SMTP...")
-                yag.close()
-            except:
-                pass 
\ No newline at end of file
+        SMTP_FALHAS.inc(motivo='inesperado')
+        logger.exception("Erro inesperado ao enviar e-mail", extra=campos)
+        return {'enviado': False, 'permanente': False, 'erro': repr(e)}
+
+def enviar_email(destinatario, assunto, mensagem):
+    return entregar_email(destinatario, assunto, mensagem)['enviado']
@@ -0,0 +1,107 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+
+# Atributos que todo LogRecord já tem; o resto veio de `extra` e vira campo estruturado
+_ATRIBUTOS_PADRAO = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_lock = threading.Lock()
+_listener = None
+_handler = None
+
+
+class FormatadorEstruturado(logging.Formatter):
+    """Uma linha por registro, em texto (chave=valor) ou JSON, com os campos de `extra`."""
+
+    def __init__(self, formato='texto'):
+        super().__init__()
+        self.formato = formato
+
+    def format(self, record):
+        campos = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'nivel': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        campos.update((chave, valor) for chave, valor in vars(record).items()
+                      if chave not in _ATRIBUTOS_PADRAO)
+        if record.exc_text:
+            campos['exc'] = record.exc_text
+        if self.formato == 'json':
+            return json.dumps(campos, default=str, ensure_ascii=False)
+        base = f"{campos.pop('ts')} {campos.pop('nivel'):<7} {campos.pop('logger')} {campos.pop('msg')}"
+        extras = ' '.join(f'{chave}={valor!r}' if isinstance(valor, str) and ' ' in valor else f'{chave}={valor}'
+                          for chave, valor in campos.items())
+        return f'{base} {extras}' if extras else base
+
+
+class FilaHandler(logging.handlers.QueueHandler):
+    """Entrega o registro à fila sem formatar e sem bloquear a thread que registrou.
+
+    Com a fila cheia o registro é descartado e contado, em vez de segurar a
+    requisição ou o envio de e-mails.
+    """
+
+    def __init__(self, fila):
+        super().__init__(fila)
+        self.descartados = 0
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+
+def configurar(nivel=None, formato=None, tamanho_fila=None):
+    """Liga o logger raiz à fila; a escrita em stderr fica com a thread do QueueListener."""
+    global _listener, _handler
+    with _lock:
+        if _listener is not None:
+            return
+        nivel = nivel or os.getenv('LOG_LEVEL', 'INFO')
+        formato = formato or os.getenv('LOG_FORMATO', 'texto')
+        tamanho_fila = tamanho_fila or int(os.getenv('LOG_FILA_MAXIMA', '10000'))
+
+        saida = logging.StreamHandler(sys.stderr)
+        saida.setFormatter(FormatadorEstruturado(formato))
+        fila = queue.Queue(tamanho_fila)
+
+        raiz = logging.getLogger()
+        raiz.setLevel(nivel.upper())
+        _handler = FilaHandler(fila)
+        raiz.addHandler(_handler)
+
+        _listener = logging.handlers.QueueListener(fila, saida, respect_handler_level=True)
+        _listener.start()
+        atexit.register(encerrar)
+
+
+def encerrar():
+    """Esvazia a fila e para a thread de escrita."""
+    global _listener, _handler
+    with _lock:
+        if _listener is not None:
+            logging.getLogger().removeHandler(_handler)
+            _listener.stop()
+            _listener = _handler = None
+
+
+def get_logger(nome):
+    configurar()
+    return logging.getLogger(nome)
@@ -0,0 +1,87 @@
+from functools import lru_cache
+from html import escape
+from string import Template
+
+# Cada tipo de notificação: (assunto do e-mail, texto com variáveis $nome, $tipo_exame,
+# $data_hora, $data e $hora)
+MODELOS = {
+    'confirmacao': ('Confirmação de Agendamento', '''Olá $nome,
+
+Seu exame de $tipo_exame foi agendado com sucesso para $data_hora.
+
+Por favor, chegue com 15 minutos de antecedência.'''),
+    'cancelamento': ('Cancelamento de Exame', '''Olá $nome,
+
+Seu exame de $tipo_exame agendado para $data_hora foi cancelado.'''),
+    'remarcacao': ('Remarcação de Exame', 'Seu exame de $tipo_exame foi remarcado para $data_hora'),
+    'lembrete': ('Lembrete de Exame', '''Olá $nome,
+
+LEMBRETE: Seu exame de $tipo_exame está agendado para amanhã às $hora.
+
+Local: Clínica de Exames
+Endereço: Rua dos Exames, 123
+Data: $data
+Horário: $hora
+
+Lembretes importantes:
+- Chegue com 15 minutos de antecedência
+- Traga um documento com foto
+- Em caso de necessidade de cancelamento, avise com antecedência
+
+Atenciosamente,
+Equipe da Clínica'''),
+}
+
+# Várias notificações do mesmo paciente enviadas juntas (email_service)
+ASSUNTO_RESUMO = 'Atualizações dos seus exames'
+_RESUMO = Template('''Olá $nome,
+
+Houve $quantidade atualizações nos seus exames:
+
+$mensagens''')
+_SEPARADOR_RESUMO = '\n\n' + '-' * 40 + '\n\n'
+
+# O invólucro HTML é montado uma única vez; cada envio só insere o corpo
+_HTML_INICIO, _HTML_FIM = '''
+            <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto; padding: 20px;">
+                <h2 style="color: #2c3e50;">Sistema de Agendamento de Exames</h2>
+                <div style="background-color: #f8f9fa; padding: 20px; border-radius: 5px;">
+                    {corpo}
+                </div>
+                <p style="color: #7f8c8d; font-size: 12px; margin-top: 20px;">
+                    Esta é uma mensagem automática, por favor não responda.
+                </p>
+            </div>
+            '''.split('{corpo}')
+
+@lru_cache(maxsize=None)
+def _modelo(tipo):
+    return Template(MODELOS[tipo][1])
+
+def renderizar_mensagem(tipo, nome, tipo_exame, data_hora):
+    return _modelo(tipo).substitute(
+        nome=nome,
+        tipo_exame=tipo_exame,
+        data_hora=data_hora.strftime("%d/%m/%Y às %H:%M"),
+        data=data_hora.strftime("%d/%m/%Y"),
+        hora=data_hora.strftime("%H:%M")
+    )
+
+def renderizar_resumo(nome, mensagens):
+    return _RESUMO.substitute(nome=nome or 'paciente', quantidade=len(mensagens),
+                              mensagens=_SEPARADOR_RESUMO.join(mensagens))
+
+def assunto(tipo):
+    return MODELOS[tipo][0]
+
+def identificar_tipo(mensagem):
+    if 'LEMBRETE' in mensagem:
+        return 'lembrete'
+    if 'foi cancelado' in mensagem:
+        return 'cancelamento'
+    if 'foi remarcado' in mensagem:
+        return 'remarcacao'
+    return 'confirmacao'
+
+def renderizar_html(mensagem):
+    return _HTML_INICIO + escape(mensagem).replace('\n', '<br>') + _HTML_FIM
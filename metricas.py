@@ -0,0 +1,189 @@
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BUCKETS_PADRAO = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _formatar_rotulos(rotulos):
+    if not rotulos:
+        return ''
+    return '{' + ','.join(f'{nome}="{_escapar(valor)}"' for nome, valor in rotulos) + '}'
+
+
+def _formatar_valor(valor):
+    if valor == float('inf'):
+        return '+Inf'
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return repr(valor) if isinstance(valor, float) else str(valor)
+
+
+class Contador:
+    tipo = 'counter'
+
+    def __init__(self, nome, ajuda):
+        self.nome = nome
+        self.ajuda = ajuda
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def inc(self, valor=1, **rotulos):
+        chave = tuple(sorted(rotulos.items()))
+        with self._lock:
+            self._valores[chave] = self._valores.get(chave, 0) + valor
+
+    def amostras(self):
+        with self._lock:
+            return [(self.nome, chave, valor) for chave, valor in sorted(self._valores.items())]
+
+
+class Histograma:
+    """Histograma com buckets cumulativos no formato do Prometheus."""
+
+    tipo = 'histogram'
+
+    def __init__(self, nome, ajuda, buckets=BUCKETS_PADRAO):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor, **rotulos):
+        chave = tuple(sorted(rotulos.items()))
+        posicao = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(chave)
+            if serie is None:
+                # contagem por bucket (o último é +Inf), soma e total
+                serie = self._series[chave] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            serie[0][posicao] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    @contextmanager
+    def cronometrar(self, **rotulos):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio, **rotulos)
+
+    def medir(self, **rotulos):
+        def decorador(funcao):
+            @functools.wraps(funcao)
+            def medida(*args, **kwargs):
+                with self.cronometrar(**rotulos):
+                    return funcao(*args, **kwargs)
+            return medida
+        return decorador
+
+    def amostras(self):
+        with self._lock:
+            series = [(chave, list(serie[0]), serie[1], serie[2]) for chave, serie in sorted(self._series.items())]
+        linhas = []
+        for chave, contagens, soma, total in series:
+            acumulado = 0
+            for limite, contagem in zip(self.buckets + (float('inf'),), contagens):
+                acumulado += contagem
+                linhas.append((f'{self.nome}_bucket', chave + (('le', _formatar_valor(float(limite))),), acumulado))
+            linhas.append((f'{self.nome}_sum', chave, soma))
+            linhas.append((f'{self.nome}_count', chave, total))
+        return linhas
+
+
+class Medidor:
+    """Valor calculado no momento da coleta (gauge, ou counter mantido em outro lugar).
+
+    `coletar` devolve um número ou uma lista de (rótulos, valor); None omite a métrica.
+    """
+
+    def __init__(self, nome, ajuda, coletar, tipo='gauge'):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.coletar = coletar
+        self.tipo = tipo
+
+    def amostras(self):
+        valores = self.coletar()
+        if valores is None:
+            return []
+        if isinstance(valores, (int, float)):
+            return [(self.nome, (), valores)]
+        return [(self.nome, tuple(sorted(rotulos.items())), valor) for rotulos, valor in valores]
+
+
+class Registro:
+    def __init__(self):
+        self._metricas = {}
+        self._lock = threading.Lock()
+
+    def registrar(self, metrica):
+        with self._lock:
+            # Reimportar um módulo não duplica a métrica
+            return self._metricas.setdefault(metrica.nome, metrica)
+
+    def exportar(self):
+        with self._lock:
+            metricas = list(self._metricas.values())
+        linhas = []
+        for metrica in metricas:
+            try:
+                amostras = metrica.amostras()
+            except Exception:
+                continue
+            if not amostras:
+                continue
+            linhas.append(f'# HELP {metrica.nome} {metrica.ajuda}')
+            linhas.append(f'# TYPE {metrica.nome} {metrica.tipo}')
+            for nome, rotulos, valor in amostras:
+                linhas.append(f'{nome}{_formatar_rotulos(rotulos)} {_formatar_valor(valor)}')
+        return '\n'.join(linhas) + '\n'
+
+
+REGISTRO = Registro()
+
+
+def contador(nome, ajuda):
+    return REGISTRO.registrar(Contador(nome, ajuda))
+
+
+def histograma(nome, ajuda, buckets=BUCKETS_PADRAO):
+    return REGISTRO.registrar(Histograma(nome, ajuda, buckets))
+
+
+def medidor(nome, ajuda, coletar, tipo='gauge'):
+    return REGISTRO.registrar(Medidor(nome, ajuda, coletar, tipo))
+
+
+class _ManipuladorMetricas(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        corpo = self.server.registro.exportar().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, formato, *args):
+        pass
+
+
+def servir(porta, endereco='0.0.0.0', registro=REGISTRO):
+    """Expõe /metrics em uma thread, para processos sem Flask (worker.py); porta 0 escolhe uma livre."""
+    servidor = ThreadingHTTPServer((endereco, porta), _ManipuladorMetricas)
+    servidor.daemon_threads = True
+    servidor.registro = registro
+    threading.Thread(target=servidor.serve_forever, name='metricas-http', daemon=True).start()
+    return servidor
@@ -0,0 +1,185 @@
+import argparse
+import os
+import re
+import sys
+from datetime import datetime
+from mysql.connector import Error
+from db import (
+    get_db_connection, SQL_OCUPACAO_DIA, SQL_NOTIFICACOES_RESERVADAS,
+    SQL_RESERVAR_NOTIFICACOES, SQL_AGENDAMENTOS_PROXIMAS_24H
+)
+
+MIGRACOES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+# Consultas quentes de db.py: (sql, parâmetros de exemplo, aliases que não podem virar full scan)
+CONSULTAS_CRITICAS = {
+    'verificar_disponibilidade': (SQL_OCUPACAO_DIA, (datetime(2024, 1, 1), datetime(2024, 1, 2)), ['a']),
+    'reivindicar_notificacoes': (SQL_RESERVAR_NOTIFICACOES, {'lease': 600, 'janela': 120, 'limite': 100}, ['n']),
+    'notificacoes_reservadas': (SQL_NOTIFICACOES_RESERVADAS.format(marcadores='%s, %s'), (1, 2), ['n']),
+    'get_agendamentos_proximas_24h': (SQL_AGENDAMENTOS_PROXIMAS_24H, None, ['a', 'e']),
+}
+
+def _comandos(sql):
+    return [comando.strip() for comando in sql.split(';') if comando.strip()]
+
+def _separar_secoes(conteudo):
+    secoes = {'up': [], 'down': []}
+    atual = None
+    for linha in conteudo.splitlines():
+        marcador = linha.strip().lower()
+        if marcador in ('-- up', '-- down'):
+            atual = marcador[3:]
+            continue
+        if atual and not marcador.startswith('--'):
+            secoes[atual].append(linha)
+    return _comandos('\n'.join(secoes['up'])), _comandos('\n'.join(secoes['down']))
+
+def carregar_migracoes(diretorio=MIGRACOES_DIR):
+    migracoes = []
+    for arquivo in sorted(os.listdir(diretorio)):
+        encontrado = re.match(r'^(\d+)_(\w+)\.sql$', arquivo)
+        if not encontrado:
+            continue
+        with open(os.path.join(diretorio, arquivo), encoding='utf-8') as f:
+            up, down = _separar_secoes(f.read())
+        migracoes.append({
+            'versao': encontrado.group(1),
+            'nome': encontrado.group(2),
+            'up': up,
+            'down': down
+        })
+    return migracoes
+
+def _garantir_historico(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            versao VARCHAR(20) PRIMARY KEY,
+            nome VARCHAR(255) NOT NULL,
+            aplicada_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def _versoes_aplicadas(cursor):
+    cursor.execute('SELECT versao, aplicada_em FROM schema_migrations ORDER BY versao')
+    return {versao: aplicada_em for versao, aplicada_em in cursor.fetchall()}
+
+def aplicar(ate=None):
+    conn = get_db_connection()
+    if not conn:
+        return False
+    cursor = conn.cursor()
+    try:
+        _garantir_historico(cursor)
+        aplicadas = _versoes_aplicadas(cursor)
+        for migracao in carregar_migracoes():
+            if migracao['versao'] in aplicadas:
+                continue
+            if ate and migracao['versao'] > ate:
+                break
+            print(f"Aplicando {migracao['versao']}_{migracao['nome']}...")
+            # DDL no MySQL faz commit implícito: o histórico é gravado só após todos os comandos
+            for comando in migracao['up']:
+                cursor.execute(comando)
+            cursor.execute('INSERT INTO schema_migrations (versao, nome) VALUES (%s, %s)',
+                           (migracao['versao'], migracao['nome']))
+            conn.commit()
+        return True
+    except Error as e:
+        print(f"Erro ao aplicar migração: {e}")
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+def reverter(passos=1):
+    conn = get_db_connection()
+    if not conn:
+        return False
+    cursor = conn.cursor()
+    try:
+        _garantir_historico(cursor)
+        aplicadas = _versoes_aplicadas(cursor)
+        migracoes = [m for m in carregar_migracoes() if m['versao'] in aplicadas]
+        for migracao in reversed(migracoes[-passos:] if passos > 0 else []):
+            print(f"Revertendo {migracao['versao']}_{migracao['nome']}...")
+            for comando in migracao['down']:
+                cursor.execute(comando)
+            cursor.execute('DELETE FROM schema_migrations WHERE versao = %s', (migracao['versao'],))
+            conn.commit()
+        return True
+    except Error as e:
+        print(f"Erro ao reverter migração: {e}")
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+def status():
+    conn = get_db_connection()
+    if not conn:
+        return False
+    cursor = conn.cursor()
+    try:
+        _garantir_historico(cursor)
+        aplicadas = _versoes_aplicadas(cursor)
+        for migracao in carregar_migracoes():
+            aplicada_em = aplicadas.get(migracao['versao'])
+            situacao = f"aplicada em {aplicada_em}" if aplicada_em else "pendente"
+            print(f"{migracao['versao']}_{migracao['nome']}: {situacao}")
+        return True
+    except Error as e:
+        print(f"Erro ao consultar migrações: {e}")
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+def verificar_planos():
+    conn = get_db_connection()
+    if not conn:
+        return False
+    cursor = conn.cursor(dictionary=True)
+    ok = True
+    try:
+        for nome, (sql, parametros, aliases) in CONSULTAS_CRITICAS.items():
+            cursor.execute('EXPLAIN ' + sql, parametros)
+            plano = cursor.fetchall()
+            varreduras = [linha['table'] for linha in plano
+                          if linha['table'] in aliases and linha['type'] == 'ALL']
+            if varreduras:
+                ok = False
+                print(f"FALHA {nome}: varredura completa em {', '.join(varreduras)}")
+            else:
+                acessos = ', '.join(f"{linha['table']}={linha['type']}" for linha in plano)
+                print(f"OK    {nome}: {acessos}")
+        return ok
+    except Error as e:
+        print(f"Erro ao verificar planos de execução: {e}")
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Migrações do banco de dados')
+    comandos = parser.add_subparsers(dest='comando', required=True)
+    aplicar_cmd = comandos.add_parser('apply', help='aplica as migrações pendentes')
+    aplicar_cmd.add_argument('--ate', help='última versão a aplicar')
+    reverter_cmd = comandos.add_parser('rollback', help='reverte as últimas migrações')
+    reverter_cmd.add_argument('--passos', type=int, default=1)
+    comandos.add_parser('status', help='lista as migrações e seu estado')
+    comandos.add_parser('explain', help='falha se uma consulta crítica fizer full scan')
+    args = parser.parse_args(argv)
+
+    if args.comando == 'apply':
+        ok = aplicar(args.ate)
+    elif args.comando == 'rollback':
+        ok = reverter(args.passos)
+    elif args.comando == 'status':
+        ok = status()
+    else:
+        ok = verificar_planos()
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
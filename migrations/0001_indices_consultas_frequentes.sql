@@ -0,0 +1,12 @@
+-- Índices para os caminhos de acesso das consultas mais executadas em db.py:
+-- verificar_disponibilidade, fila de notificações pendentes e lembretes de 24h.
+
+-- up
+CREATE INDEX idx_agendamentos_data_hora_status ON agendamentos (data_hora, status);
+CREATE INDEX idx_notificacoes_status_created ON notificacoes (status_envio, created_at);
+CREATE INDEX idx_exames_data_hora ON exames (data_hora);
+
+-- down
+DROP INDEX idx_exames_data_hora ON exames;
+DROP INDEX idx_notificacoes_status_created ON notificacoes;
+DROP INDEX idx_agendamentos_data_hora_status ON agendamentos;
@@ -0,0 +1,14 @@
+-- Garante no banco que um horário tem no máximo um agendamento ativo.
+-- A coluna gerada vale data_hora enquanto o status é 'agendado' e NULL nos demais
+-- casos; como o índice único aceita vários NULL, cancelados e realizados não conflitam.
+-- Horários já duplicados precisam ser resolvidos antes de aplicar esta migração.
+
+-- up
+ALTER TABLE agendamentos
+    ADD COLUMN horario_ativo DATETIME
+        GENERATED ALWAYS AS (IF(status = 'agendado', data_hora, NULL)) STORED;
+CREATE UNIQUE INDEX uq_agendamentos_horario_ativo ON agendamentos (horario_ativo);
+
+-- down
+DROP INDEX uq_agendamentos_horario_ativo ON agendamentos;
+ALTER TABLE agendamentos DROP COLUMN horario_ativo;
@@ -0,0 +1,16 @@
+-- Índice para a paginação do painel da recepção (ORDER BY data_hora DESC, id DESC).
+-- O InnoDB anexa a chave primária ao índice secundário, então (data_hora) já
+-- entrega as linhas na ordem (data_hora, id) sem filesort.
+--
+-- O índice (data_hora, status) da 0001 não serve: nele a chave efetiva é
+-- (data_hora, status, id), e dentro do mesmo horário (o agendamento ativo e os
+-- cancelados) a ordem é por status, não por id. Com os filtros de data vazios o
+-- painel pagina todo o histórico, e cada página ordenaria a tabela inteira.
+-- O custo é um índice a mais no INSERT/UPDATE de agendamentos, que é uma escrita
+-- por agendamento e pequena perto do envio de notificações.
+
+-- up
+CREATE INDEX idx_agendamentos_data_hora ON agendamentos (data_hora);
+
+-- down
+DROP INDEX idx_agendamentos_data_hora ON agendamentos;
@@ -0,0 +1,18 @@
+-- Histórico das execuções dos jobs agendados (agendador.py): quem executou,
+-- quanto tempo levou e o resultado. Execuções puladas por sobreposição ficam
+-- como 'ignorado'.
+
+-- up
+CREATE TABLE execucoes_jobs (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    job VARCHAR(100) NOT NULL,
+    instancia VARCHAR(100) NOT NULL,
+    iniciado_em DATETIME(3) NOT NULL,
+    duracao_ms INT NOT NULL,
+    status ENUM('sucesso', 'erro', 'ignorado') NOT NULL,
+    detalhe TEXT NULL,
+    INDEX idx_execucoes_jobs_job (job, iniciado_em)
+);
+
+-- down
+DROP TABLE execucoes_jobs;
@@ -0,0 +1,18 @@
+-- Novas tentativas de envio com backoff exponencial. Uma notificação que falha
+-- volta para a fila só em proxima_tentativa_em; recusas permanentes (SMTP 5xx)
+-- ou o limite de tentativas a movem para 'erro'. O índice atende a reserva, que
+-- só olha pendentes já vencidas.
+
+-- up
+ALTER TABLE notificacoes
+    ADD COLUMN tentativas INT NOT NULL DEFAULT 0,
+    ADD COLUMN proxima_tentativa_em DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    ADD COLUMN ultimo_erro VARCHAR(500) NULL;
+CREATE INDEX idx_notificacoes_fila ON notificacoes (status_envio, proxima_tentativa_em);
+
+-- down
+DROP INDEX idx_notificacoes_fila ON notificacoes;
+ALTER TABLE notificacoes
+    DROP COLUMN ultimo_erro,
+    DROP COLUMN proxima_tentativa_em,
+    DROP COLUMN tentativas;
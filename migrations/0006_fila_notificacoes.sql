@@ -0,0 +1,21 @@
+-- Colunas da fila de notificações que só existiam no script.sql: o agendamento
+-- de cada notificação e a reserva (claimed_by/claimed_at) usada pelo SKIP LOCKED.
+-- Bancos criados com um script.sql que já as tinha devem registrar esta versão
+-- sem aplicá-la:
+--   INSERT INTO schema_migrations (versao, nome) VALUES ('0006', 'fila_notificacoes');
+
+-- up
+ALTER TABLE notificacoes
+    ADD COLUMN agendamento_id INT NULL AFTER paciente_id,
+    ADD COLUMN claimed_by VARCHAR(100) NULL AFTER status_envio,
+    ADD COLUMN claimed_at DATETIME NULL AFTER claimed_by,
+    ADD CONSTRAINT fk_notificacoes_agendamento
+        FOREIGN KEY (agendamento_id) REFERENCES agendamentos(id) ON DELETE SET NULL;
+
+-- down
+ALTER TABLE notificacoes DROP FOREIGN KEY fk_notificacoes_agendamento;
+ALTER TABLE notificacoes
+    DROP INDEX fk_notificacoes_agendamento,
+    DROP COLUMN claimed_at,
+    DROP COLUMN claimed_by,
+    DROP COLUMN agendamento_id;
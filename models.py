@@ -1,7 +1,7 @@
 from abc import ABC, abstractmethod
 from datetime import datetime
 from typing import List
-from email_utils import enviar_email
+from mensagens import renderizar_mensagem
 
 class Observer(ABC):
     @abstractmethod
@@ -98,27 +98,18 @@ class Notificacao(Observer):
         self.mensagens: List[dict] = []
 
     def update(self, agendamento: Agendamento) -> None:
+        # Só coleta a mensagem; quem persiste grava na tabela notificacoes e o
+        # envio fica com o worker
         mensagem = self._criar_mensagem(agendamento)
         self.mensagens.append({
             'paciente_id': agendamento.paciente.id,
+            'agendamento_id': agendamento.id,
             'mensagem': mensagem,
             'email_destino': agendamento.paciente.email,
             'status_envio': 'pendente'
         })
-        self._enviar_email(agendamento.paciente.email, mensagem)
 
     def _criar_mensagem(self, agendamento: Agendamento) -> str:
-        if agendamento.status == 'cancelado':
-            return f'''Olá {agendamento.paciente.nome},
-
-Seu exame de {agendamento.exame.tipo_exame} agendado para {agendamento.data_hora.strftime("%d/%m/%Y às %H:%M")} foi cancelado.'''
-        else:
-            return f'''Olá {agendamento.paciente.nome},
-
-Seu exame de {agendamento.exame.tipo_exame} foi agendado com sucesso para {agendamento.data_hora.strftime("%d/%m/%Y às %H:%M")}.
-
-Por favor, chegue com 15 minutos de antecedência.'''
-
-    def _enviar_email(self, email_destino: str, mensagem: str) -> bool:
-        assunto = 'Cancelamento de Exame' if 'cancelado' in mensagem else 'Confirmação de Agendamento'
-        return enviar_email(email_destino, assunto, mensagem) 
\ No newline at end of file
+        tipo = 'cancelamento' if agendamento.status == 'cancelado' else 'confirmacao'
+        return renderizar_mensagem(tipo, agendamento.paciente.nome,
+                                   agendamento.exame.tipo_exame, agendamento.data_hora)
@@ -0,0 +1,96 @@
+import bisect
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+class IndiceOcupacao:
+    """Horários ocupados por dia, mantidos em listas ordenadas na memória.
+
+    Cada dia é carregado do banco na primeira consulta e recarregado após `ttl`
+    segundos, o que limita a defasagem em relação a outros processos.
+    """
+
+    def __init__(self, carregar_dia, ttl=30, duracao_slot=30, hora_abertura=8, hora_fechamento=18):
+        self._carregar_dia = carregar_dia
+        self.ttl = ttl
+        self.duracao_slot = duracao_slot
+        self.hora_abertura = hora_abertura
+        self.hora_fechamento = hora_fechamento
+        self._dias = {}
+        self._lock = threading.Lock()
+
+    def _ocupados(self, dia):
+        with self._lock:
+            entrada = self._dias.get(dia)
+            if entrada and time.monotonic() - entrada[1] < self.ttl:
+                return entrada[0]
+
+        horarios = self._carregar_dia(dia)
+        if horarios is None:
+            return None
+        ocupados = sorted(horarios)
+        with self._lock:
+            self._dias[dia] = (ocupados, time.monotonic())
+        return ocupados
+
+    def disponivel(self, data_hora):
+        ocupados = self._ocupados(data_hora.date())
+        if ocupados is None:
+            return False
+        with self._lock:
+            posicao = bisect.bisect_left(ocupados, data_hora)
+            return posicao == len(ocupados) or ocupados[posicao] != data_hora
+
+    def ocupar(self, data_hora):
+        with self._lock:
+            entrada = self._dias.get(data_hora.date())
+            if entrada:
+                bisect.insort(entrada[0], data_hora)
+
+    def liberar(self, data_hora):
+        with self._lock:
+            entrada = self._dias.get(data_hora.date())
+            if entrada:
+                ocupados = entrada[0]
+                posicao = bisect.bisect_left(ocupados, data_hora)
+                if posicao < len(ocupados) and ocupados[posicao] == data_hora:
+                    del ocupados[posicao]
+
+    def invalidar(self, dia=None):
+        with self._lock:
+            if dia is None:
+                self._dias.clear()
+            else:
+                self._dias.pop(dia, None)
+
+    def _primeiro_slot(self, inicio):
+        base = inicio.replace(second=0, microsecond=0)
+        resto = (base.hour * 60 + base.minute) % self.duracao_slot
+        if resto or base < inicio:
+            base += timedelta(minutes=self.duracao_slot - resto if resto else self.duracao_slot)
+        return base
+
+    def proximos_livres(self, inicio, fim, quantidade=5):
+        """Até `quantidade` slots livres em dias úteis, dentro do horário de funcionamento."""
+        livres = []
+        slot = self._primeiro_slot(inicio)
+        passo = timedelta(minutes=self.duracao_slot)
+        while slot < fim and len(livres) < quantidade:
+            if slot.weekday() >= 5 or slot.hour >= self.hora_fechamento:
+                slot = datetime.combine(slot.date() + timedelta(days=1), datetime.min.time())
+                slot = slot.replace(hour=self.hora_abertura)
+                continue
+            if slot.hour < self.hora_abertura:
+                slot = slot.replace(hour=self.hora_abertura, minute=0)
+                continue
+            ocupados = self._ocupados(slot.date())
+            if ocupados is None:
+                break
+            with self._lock:
+                posicao = bisect.bisect_left(ocupados, slot)
+                livre = posicao == len(ocupados) or ocupados[posicao] != slot
+            if livre:
+                livres.append(slot)
+            slot += passo
+        return livres
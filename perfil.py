@@ -0,0 +1,140 @@
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, has_app_context, request
+from logs import get_logger
+
+logger = get_logger(__name__)
+
+DB_SLOW_QUERY_MS = float(os.getenv('DB_SLOW_QUERY_MS', '200'))
+# '1' perfila toda requisição, 'cabecalho' só as que enviam X-Profile: 1, '0' desliga
+PERFIL_REQUISICOES = os.getenv('PERFIL_REQUISICOES', 'cabecalho')
+
+_local = threading.local()
+
+
+class Perfil:
+    """Consultas, tempo de banco e tempo de SMTP acumulados em uma requisição ou job."""
+
+    def __init__(self):
+        self.consultas = 0
+        self.tempo_db = 0.0
+        self.envios_smtp = 0
+        self.tempo_smtp = 0.0
+        self._lock = threading.Lock()
+
+    def consulta(self, duracao):
+        with self._lock:
+            self.consultas += 1
+            self.tempo_db += duracao
+
+    def smtp(self, duracao):
+        with self._lock:
+            self.envios_smtp += 1
+            self.tempo_smtp += duracao
+
+    def resumo(self):
+        return {
+            'consultas': self.consultas,
+            'tempo_db_ms': round(self.tempo_db * 1000, 2),
+            'envios_smtp': self.envios_smtp,
+            'tempo_smtp_ms': round(self.tempo_smtp * 1000, 2),
+        }
+
+    def server_timing(self):
+        return (f'db;dur={self.tempo_db * 1000:.2f};desc="{self.consultas} consultas", '
+                f'smtp;dur={self.tempo_smtp * 1000:.2f};desc="{self.envios_smtp} envios"')
+
+
+def perfil_atual():
+    if has_app_context() and 'perfil' in g:
+        return g.perfil
+    return getattr(_local, 'perfil', None)
+
+
+def _sql_resumido(operacao):
+    return re.sub(r'\s+', ' ', operacao).strip()[:500]
+
+
+def _quantidade_parametros(parametros):
+    if parametros is None:
+        return 0
+    return len(parametros) if hasattr(parametros, '__len__') else 1
+
+
+def registrar_consulta(operacao, parametros, duracao):
+    perfil = perfil_atual()
+    if perfil is not None:
+        perfil.consulta(duracao)
+    if duracao * 1000 >= DB_SLOW_QUERY_MS:
+        # Só o SQL com os marcadores; os valores podem conter dados de pacientes
+        logger.warning("Consulta lenta", extra={
+            'duracao_ms': round(duracao * 1000, 2),
+            'sql': _sql_resumido(operacao),
+            'parametros': f'<{_quantidade_parametros(parametros)} omitidos>',
+        })
+
+
+def registrar_smtp(duracao):
+    perfil = perfil_atual()
+    if perfil is not None:
+        perfil.smtp(duracao)
+
+
+class CursorMedido:
+    """Cursor que mede cada execute/executemany."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, operacao, parametros=None, *args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return self._cursor.execute(operacao, parametros, *args, **kwargs)
+        finally:
+            registrar_consulta(operacao, parametros, time.perf_counter() - inicio)
+
+    def executemany(self, operacao, sequencia, *args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return self._cursor.executemany(operacao, sequencia, *args, **kwargs)
+        finally:
+            registrar_consulta(operacao, sequencia, time.perf_counter() - inicio)
+
+    def __getattr__(self, nome):
+        return getattr(self._cursor, nome)
+
+
+@contextmanager
+def perfilar():
+    """Perfil fora de requisições (jobs, scripts); devolve o Perfil acumulado."""
+    perfil = Perfil()
+    anterior = getattr(_local, 'perfil', None)
+    _local.perfil = perfil
+    try:
+        yield perfil
+    finally:
+        _local.perfil = anterior
+
+
+def _perfil_solicitado():
+    if PERFIL_REQUISICOES == '1':
+        return True
+    return PERFIL_REQUISICOES == 'cabecalho' and request.headers.get('X-Profile') == '1'
+
+
+def init_app(app):
+    @app.before_request
+    def _iniciar_perfil():
+        if _perfil_solicitado():
+            g.perfil = Perfil()
+
+    @app.after_request
+    def _publicar_perfil(response):
+        perfil = g.pop('perfil', None)
+        if perfil is not None:
+            response.headers['Server-Timing'] = perfil.server_timing()
+            logger.info("Perfil da requisição", extra={'rota': request.path, **perfil.resumo()})
+        return response
@@ -1,8 +1,31 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from functools import wraps
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, g
 from db import get_db_connection, criar_usuario, criar_paciente
+from logs import get_logger
+
+logger = get_logger(__name__)
 
 auth_bp = Blueprint('auth', __name__)
 
+def usuario_autenticado(tipo_usuario):
+    """Perfil guardado na sessão no login, se for do tipo pedido; também fica em g.usuario."""
+    usuario = session.get('usuario')
+    if not usuario or usuario['tipo_usuario'] != tipo_usuario:
+        return None
+    g.usuario = usuario
+    return usuario
+
+def login_requerido(tipo_usuario):
+    def decorador(view):
+        @wraps(view)
+        def protegida(*args, **kwargs):
+            if not usuario_autenticado(tipo_usuario):
+                flash('Faça login para continuar.')
+                return redirect(url_for('auth.login'))
+            return view(*args, **kwargs)
+        return protegida
+    return decorador
+
 @auth_bp.route('/')
 def index():
     return redirect(url_for('auth.login'))
@@ -20,23 +43,28 @@ def login():
             
         try:
             cursor = conn.cursor(dictionary=True)
+            # O perfil é carregado uma vez e fica na sessão assinada; as rotas não
+            # consultam o banco para saber quem é o usuário
             cursor.execute('''
-                SELECT id, nome, tipo_usuario 
-                FROM users 
-                WHERE username = %s AND password = %s
+                SELECT u.id AS user_id, u.nome, u.email, u.tipo_usuario, p.id AS paciente_id
+                FROM users u
+                LEFT JOIN pacientes p ON p.user_id = u.id
+                WHERE u.username = %s AND u.password = %s
             ''', (username, password))
             user = cursor.fetchone()
             
-            if user:
+            if user and not (user['tipo_usuario'] == 'paciente' and user['paciente_id'] is None):
+                session.clear()
+                session['usuario'] = user
                 if user['tipo_usuario'] == 'paciente':
-                    return redirect(url_for('paciente.dashboard', user_id=user['id']))
+                    return redirect(url_for('paciente.dashboard'))
                 else:
                     return redirect(url_for('recepcionista.dashboard'))
             
             flash('Usuário ou senha incorretos')
             
-        except Exception as e:
-            print(f"Erro no login: {e}")
+        except Exception:
+            logger.exception("Erro no login")
             flash('Erro ao realizar login')
             
         finally:
@@ -47,6 +75,7 @@ def login():
 
 @auth_bp.route('/logout')
 def logout():
+    session.clear()
     return redirect(url_for('auth.login'))
 
 @auth_bp.route('/cadastro', methods=['GET', 'POST'])
@@ -1,15 +1,31 @@
+import os
 from flask import Blueprint, jsonify
-from db import get_db_connection
+from db import get_pool_stats, get_cache_stats, verificar_banco
+from saude import SondaProntidao
 
 healthcheck_bp = Blueprint('healthcheck', __name__)
 
+# O banco é verificado em segundo plano; as sondas do orquestrador só leem o resultado
+_sonda = SondaProntidao(verificar_banco, intervalo=float(os.getenv('SONDA_INTERVALO', '10')))
+
+@healthcheck_bp.record_once
+def _iniciar_sonda(state):
+    _sonda.iniciar()
+
+@healthcheck_bp.route('/healthz')
+def healthz():
+    return jsonify({"status": "alive"}), 200
+
+@healthcheck_bp.route('/readyz')
+def readyz():
+    estado = _sonda.estado()
+    return jsonify(estado), 200 if estado['pronto'] else 503
+
 @healthcheck_bp.route('/healthcheck')
 def healthcheck():
-    try:
-        conn = get_db_connection()
-        if conn:
-            conn.close()
-            return jsonify({"status": "healthy", "database": "connected"}), 200
-        return jsonify({"status": "unhealthy", "database": "disconnected"}), 500
-    except Exception as e:
-        return jsonify({"status": "unhealthy", "error": str(e)}), 500 
\ No newline at end of file
+    estado = _sonda.estado()
+    if estado['pronto']:
+        return jsonify({"status": "healthy", "database": "connected", "pool": get_pool_stats(),
+                        "cache": get_cache_stats()}), 200
+    return jsonify({"status": "unhealthy", "database": "disconnected", "error": estado['detalhe'],
+                    "pool": get_pool_stats()}), 500
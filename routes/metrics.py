@@ -0,0 +1,36 @@
+import time
+from flask import Blueprint, Response, g, request
+from db import get_pool_stats, contar_notificacoes_pendentes
+import metricas
+
+metrics_bp = Blueprint('metrics', __name__)
+
+ROTA_DURACAO = metricas.histograma('http_requisicao_duracao_segundos', 'Duração das requisições por rota')
+
+_CONTADORES_POOL = ('checkouts', 'esperas', 'timeouts', 'criadas', 'recicladas', 'descartadas')
+_ESTADOS_POOL = ('abertas', 'em_uso', 'ociosas')
+
+metricas.medidor('db_pool_conexoes', 'Conexões do pool por estado',
+                 lambda: [({'estado': estado}, get_pool_stats()[estado]) for estado in _ESTADOS_POOL])
+# Os contadores do pool vivem em db_pool; aqui só são lidos na coleta
+metricas.medidor('db_pool_eventos_total', 'Eventos acumulados do pool de conexões',
+                 lambda: [({'evento': evento}, get_pool_stats()[evento]) for evento in _CONTADORES_POOL],
+                 tipo='counter')
+metricas.medidor('notificacoes_pendentes', 'Notificações aguardando envio', contar_notificacoes_pendentes)
+
+@metrics_bp.before_app_request
+def _iniciar_cronometro():
+    g.inicio_requisicao = time.perf_counter()
+
+@metrics_bp.after_app_request
+def _registrar_duracao(response):
+    inicio = g.pop('inicio_requisicao', None)
+    if inicio is not None:
+        rota = request.url_rule.rule if request.url_rule else 'nao_encontrada'
+        ROTA_DURACAO.observar(time.perf_counter() - inicio, rota=rota, metodo=request.method,
+                              status=response.status_code)
+    return response
+
+@metrics_bp.route('/metrics')
+def metrics():
+    return Response(metricas.REGISTRO.exportar(), mimetype='text/plain; version=0.0.4')
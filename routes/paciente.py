@@ -1,70 +1,64 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask import Blueprint, render_template, request, redirect, url_for, flash, g
 from datetime import datetime
 from db import (
-    get_paciente_by_user_id, get_agendamentos_paciente,
-    get_notificacoes_paciente, agendar_exame as db_agendar_exame, 
-    cancelar_agendamento as db_cancelar_agendamento
+    get_agendamentos_paciente, get_notificacoes_paciente, agendar_exame as db_agendar_exame,
+    cancelar_agendamento as db_cancelar_agendamento, get_proximos_horarios_livres
 )
-from models import Paciente, Agendamento, Notificacao
+from logs import get_logger
+from .auth import login_requerido
+
+logger = get_logger(__name__)
 
 paciente_bp = Blueprint('paciente', __name__, url_prefix='/paciente')
 
-@paciente_bp.route('/dashboard/<int:user_id>')
-def dashboard(user_id):
-    paciente = get_paciente_by_user_id(user_id)
-    if not paciente:
-        return redirect(url_for('auth.login'))
-    
-    agendamentos = get_agendamentos_paciente(paciente.id)
-    notificacoes = get_notificacoes_paciente(paciente.id)
+@paciente_bp.route('/dashboard')
+@login_requerido('paciente')
+def dashboard():
+    paciente_id = g.usuario['paciente_id']
+    agendamentos = get_agendamentos_paciente(paciente_id)
+    notificacoes = get_notificacoes_paciente(paciente_id)
     
     return render_template('paciente/dashboard.html', 
                          agendamentos=agendamentos,
                          notificacoes=notificacoes,
-                         user_id=user_id)
+                         usuario=g.usuario)
 
-@paciente_bp.route('/agendar/<int:user_id>', methods=['GET', 'POST'])
-def agendar_exame(user_id):
-    paciente = get_paciente_by_user_id(user_id)
-    if not paciente:
-        return redirect(url_for('auth.login'))
-    
+@paciente_bp.route('/agendar', methods=['GET', 'POST'])
+@login_requerido('paciente')
+def agendar_exame():
     if request.method == 'POST':
         tipo_exame = request.form['tipo_exame']
         data_hora = datetime.strptime(request.form['data_hora'], '%Y-%m-%dT%H:%M')
         
-        if db_agendar_exame(paciente.id, tipo_exame, data_hora):
+        if db_agendar_exame(g.usuario['paciente_id'], tipo_exame, data_hora):
             flash('Exame agendado com sucesso!')
-            return redirect(url_for('paciente.dashboard', user_id=user_id))
+            return redirect(url_for('paciente.dashboard'))
         else:
             flash('Erro ao agendar exame.')
     
-    return render_template('paciente/agendar.html', user_id=user_id, now=datetime.now())
+    agora = datetime.now()
+    return render_template('paciente/agendar.html', now=agora,
+                         horarios_livres=get_proximos_horarios_livres(agora))
 
-@paciente_bp.route('/cancelar/<int:user_id>/<int:agendamento_id>', methods=['POST'])
-def cancelar_agendamento(user_id, agendamento_id):
-    print(f"[DEBUG] Iniciando cancelamento - User ID: {user_id}, Agendamento ID: {agendamento_id}")
-    
-    # Verificar se o paciente existe
-    paciente = get_paciente_by_user_id(user_id)
-    if not paciente:
-        print("[DEBUG] Paciente não encontrado")
-        flash('Paciente não encontrado.')
-        return redirect(url_for('auth.login'))
+@paciente_bp.route('/cancelar/<int:agendamento_id>', methods=['POST'])
+@login_requerido('paciente')
+def cancelar_agendamento(agendamento_id):
+    paciente_id = g.usuario['paciente_id']
+    logger.debug("Iniciando cancelamento", extra={'paciente_id': paciente_id, 'agendamento_id': agendamento_id})
     
     try:
         # Tentar cancelar o agendamento
-        if db_cancelar_agendamento(agendamento_id, paciente.id):
-            print("[DEBUG] Agendamento cancelado com sucesso")
+        if db_cancelar_agendamento(agendamento_id, paciente_id):
+            logger.info("Agendamento cancelado", extra={'agendamento_id': agendamento_id})
             flash('Agendamento cancelado com sucesso!')
         else:
-            print("[DEBUG] Erro ao cancelar agendamento")
+            logger.warning("Erro ao cancelar agendamento", extra={'agendamento_id': agendamento_id})
             flash('Erro ao cancelar agendamento.')
             
         # Importante: Redirecionar apenas uma vez, no final da função
-        return redirect(url_for('paciente.dashboard', user_id=user_id))
+        return redirect(url_for('paciente.dashboard'))
         
-    except Exception as e:
-        print(f"[DEBUG] Erro durante o cancelamento: {e}")
+    except Exception:
+        logger.exception("Erro durante o cancelamento", extra={'agendamento_id': agendamento_id})
         flash('Erro ao processar o cancelamento.')
-        return redirect(url_for('paciente.dashboard', user_id=user_id)) 
\ No newline at end of file
+        return redirect(url_for('paciente.dashboard'))
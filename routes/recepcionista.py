@@ -1,17 +1,58 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
-from datetime import datetime
+from datetime import datetime, timedelta
 from db import (
     get_agendamentos_recepcionista, get_todos_pacientes,
     agendar_exame, atualizar_status_exame, editar_agendamento as db_editar_agendamento,
-    get_agendamento, cancelar_agendamento as db_cancelar_agendamento
+    get_agendamento, cancelar_agendamento as db_cancelar_agendamento,
+    get_proximos_horarios_livres
 )
+from .auth import usuario_autenticado
 
 recepcionista_bp = Blueprint('recepcionista', __name__, url_prefix='/recepcionista')
 
+@recepcionista_bp.before_request
+def _exigir_recepcionista():
+    if not usuario_autenticado('recepcionista'):
+        flash('Faça login para continuar.')
+        return redirect(url_for('auth.login'))
+
 @recepcionista_bp.route('/dashboard')
 def dashboard():
-    agendamentos = get_agendamentos_recepcionista()
-    return render_template('recepcionista/dashboard.html', exames=agendamentos)
+    hoje = datetime.now().strftime('%Y-%m-%d')
+    filtros = {
+        'inicio': request.args.get('inicio', hoje),
+        'fim': request.args.get('fim', hoje),
+        'status': request.args.get('status', ''),
+        'tipo_exame': request.args.get('tipo_exame', ''),
+        'paciente': request.args.get('paciente', '').strip()
+    }
+    try:
+        data_inicio = datetime.strptime(filtros['inicio'], '%Y-%m-%d') if filtros['inicio'] else None
+        # A data final é inclusiva: o intervalo vai até o início do dia seguinte
+        data_fim = datetime.strptime(filtros['fim'], '%Y-%m-%d') + timedelta(days=1) if filtros['fim'] else None
+        apos = None
+        if request.args.get('apos_data') and request.args.get('apos_id'):
+            apos = (datetime.strptime(request.args['apos_data'], '%Y-%m-%dT%H:%M:%S'),
+                    int(request.args['apos_id']))
+    except ValueError:
+        flash('Filtro inválido.', 'error')
+        return redirect(url_for('recepcionista.dashboard'))
+
+    agendamentos, proxima = get_agendamentos_recepcionista(
+        data_inicio=data_inicio,
+        data_fim=data_fim,
+        status=filtros['status'] or None,
+        tipo_exame=filtros['tipo_exame'] or None,
+        paciente=filtros['paciente'] or None,
+        apos=apos
+    )
+    proxima_pagina = None
+    if proxima:
+        proxima_pagina = url_for('recepcionista.dashboard', **filtros,
+                                 apos_data=proxima[0].strftime('%Y-%m-%dT%H:%M:%S'),
+                                 apos_id=proxima[1])
+    return render_template('recepcionista/dashboard.html', exames=agendamentos,
+                           filtros=filtros, proxima_pagina=proxima_pagina)
 
 @recepcionista_bp.route('/agendar', methods=['GET', 'POST'])
 def agendar_exame():
@@ -27,7 +68,9 @@ def agendar_exame():
             flash('Erro ao agendar exame.', 'error')
     
     pacientes = get_todos_pacientes()
-    return render_template('recepcionista/agendar.html', pacientes=pacientes, now=datetime.now())
+    agora = datetime.now()
+    return render_template('recepcionista/agendar.html', pacientes=pacientes, now=agora,
+                         horarios_livres=get_proximos_horarios_livres(agora))
 
 @recepcionista_bp.route('/atualizar_status/<int:exame_id>', methods=['POST'])
 def atualizar_status(exame_id):
@@ -53,9 +96,11 @@ def editar_agendamento_route(agendamento_id):
             flash('Erro ao atualizar agendamento.', 'error')
     
     agendamento = get_agendamento(agendamento_id)
+    agora = datetime.now()
     return render_template('recepcionista/editar_agendamento.html', 
                          agendamento=agendamento, 
-                         now=datetime.now())
+                         now=agora,
+                         horarios_livres=get_proximos_horarios_livres(agora))
 
 @recepcionista_bp.route('/cancelar/<int:agendamento_id>', methods=['POST'])
 def cancelar_agendamento_route(agendamento_id):
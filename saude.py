@@ -0,0 +1,59 @@
+import threading
+import time
+from logs import get_logger
+
+logger = get_logger(__name__)
+
+
+class SondaProntidao:
+    """Verifica uma dependência a cada `intervalo` segundos em uma thread própria.
+
+    As rotas de saúde só leem o último resultado; um resultado mais velho que
+    `validade` (a thread travou ou morreu) conta como não pronto.
+    """
+
+    def __init__(self, verificar, intervalo=10, validade=None):
+        self._verificar = verificar
+        self.intervalo = intervalo
+        self.validade = validade or intervalo * 3
+        self._resultado = (False, 'aguardando a primeira verificação', None)
+        self._parar = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def verificar_agora(self):
+        inicio = time.perf_counter()
+        try:
+            pronto, detalhe = self._verificar()
+        except Exception as e:
+            pronto, detalhe = False, str(e)
+        self._resultado = (pronto, detalhe, time.monotonic())
+        if not pronto:
+            logger.warning("Sonda de prontidão falhou", extra={'detalhe': detalhe,
+                                                                 'duracao': round(time.perf_counter() - inicio, 4)})
+
+    def _executar(self):
+        while not self._parar.is_set():
+            self.verificar_agora()
+            self._parar.wait(self.intervalo)
+
+    def iniciar(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._parar.clear()
+                self._thread = threading.Thread(target=self._executar, name='sonda-prontidao', daemon=True)
+                self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+
+    def estado(self):
+        pronto, detalhe, verificado_em = self._resultado
+        idade = None if verificado_em is None else time.monotonic() - verificado_em
+        if idade is not None and idade > self.validade:
+            pronto, detalhe = False, 'verificação desatualizada'
+        return {
+            'pronto': pronto,
+            'detalhe': detalhe,
+            'idade_segundos': None if idade is None else round(idade, 3),
+        }
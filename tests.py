@@ -1,4 +1,13 @@
 import unittest
+import threading
+import time
+import os
+import smtplib
+import sqlite3
+import tempfile
+import urllib.error
+import urllib.request
+from unittest import mock
 from datetime import datetime, timedelta
 from models import Paciente, Recepcionista, Agendamento, Notificacao, Exame
 from db import (
@@ -6,6 +15,28 @@ from db import (
     cancelar_agendamento, get_paciente_by_user_id,
     editar_agendamento, get_agendamento, get_notificacoes_paciente
 )
+from db_pool import ConnectionPool, PoolTimeoutError
+from email_utils import GerenciadorSessoesSMTP, falha_permanente
+import email_utils
+import email_service
+from migrate import carregar_migracoes
+from ocupacao import IndiceOcupacao
+from cache import CacheLRU, CacheSQLite, criar_cache, diretorio_privado
+import mensagens
+import unidade_trabalho
+import db
+from mysql.connector import IntegrityError, errorcode
+import json
+import logging
+import queue
+from logs import FormatadorEstruturado, FilaHandler
+import metricas
+from saude import SondaProntidao
+import perfil
+from benchmarks import smtp_local, suite
+from flask import Flask
+import routes
+from agendador import LiderancaMySQL, Agendador
 
 class TestAgendamentoExames(unittest.TestCase):
     def setUp(self):
@@ -180,5 +211,1017 @@ class TestAgendamentoExames(unittest.TestCase):
         
         print("Teste de edição concluído.")
 
+class ConexaoFalsa:
+    def __init__(self):
+        self.conectada = True
+        self.fechada = False
+        self.rollbacks = 0
+
+    def is_connected(self):
+        return self.conectada
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.fechada = True
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.criadas = []
+
+    def criar_conexao(self):
+        conn = ConexaoFalsa()
+        self.criadas.append(conn)
+        return conn
+
+    def test_reutiliza_conexao_devolvida(self):
+        """Conexões devolvidas ao pool são reutilizadas"""
+        pool = ConnectionPool(self.criar_conexao, tamanho=2, max_overflow=0)
+        conn = pool.obter()
+        conn.close()
+        conn = pool.obter()
+        conn.close()
+        self.assertEqual(len(self.criadas), 1)
+        self.assertEqual(self.criadas[0].rollbacks, 2)
+        stats = pool.estatisticas()
+        self.assertEqual(stats['checkouts'], 2)
+        self.assertEqual(stats['criadas'], 1)
+        self.assertEqual(stats['ociosas'], 1)
+        self.assertEqual(stats['em_uso'], 0)
+
+    def test_overflow_e_timeout(self):
+        """Conexões de overflow são fechadas e o pool esgotado expira"""
+        pool = ConnectionPool(self.criar_conexao, tamanho=1, max_overflow=1, timeout=0.05)
+        c1 = pool.obter()
+        c2 = pool.obter()
+        with self.assertRaises(PoolTimeoutError):
+            pool.obter()
+        c1.close()
+        c2.close()
+        self.assertTrue(self.criadas[1].fechada)
+        self.assertEqual(pool.estatisticas()['abertas'], 1)
+        self.assertEqual(pool.estatisticas()['timeouts'], 1)
+
+    def test_pre_ping_e_recycle(self):
+        """Conexões mortas ou antigas são substituídas no checkout"""
+        pool = ConnectionPool(self.criar_conexao, tamanho=1, max_overflow=0)
+        pool.obter().close()
+        self.criadas[0].conectada = False
+        pool.obter().close()
+        self.assertEqual(len(self.criadas), 2)
+        self.assertEqual(pool.estatisticas()['descartadas'], 1)
+
+        pool.recycle = 0.000001
+        pool.obter().close()
+        self.assertEqual(len(self.criadas), 3)
+        self.assertEqual(pool.estatisticas()['recicladas'], 1)
+
+class TestSessoesSMTP(unittest.TestCase):
+    def criar_yag(self):
+        yag = mock.Mock()
+        yag.user = 'clinica@example.com'
+        yag.prepare_send.return_value = (['teste@example.com'], 'mensagem')
+        self.instancias.append(yag)
+        return yag
+
+    def setUp(self):
+        self.instancias = []
+        patcher = mock.patch('email_utils.get_yagmail_instance', side_effect=self.criar_yag)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reutiliza_sessao_ate_o_limite(self):
+        """A mesma sessão autenticada atende várias mensagens"""
+        gerenciador = GerenciadorSessoesSMTP(max_sessoes=1, max_mensagens_por_conexao=2)
+        for _ in range(3):
+            self.assertTrue(gerenciador.enviar('teste@example.com', 'Assunto', ['conteudo']))
+        self.assertEqual(len(self.instancias), 2)
+        self.assertEqual(self.instancias[0].login.call_count, 1)
+        self.assertEqual(self.instancias[0].smtp.sendmail.call_count, 2)
+        self.instancias[0].close.assert_called_once()
+
+    def test_reconecta_apos_queda(self):
+        """Uma conexão derrubada pelo servidor é reaberta e o envio repetido"""
+        gerenciador = GerenciadorSessoesSMTP(max_sessoes=1)
+        gerenciador.enviar('teste@example.com', 'Assunto', ['conteudo'])
+        self.instancias[0].smtp.sendmail.side_effect = smtplib.SMTPServerDisconnected()
+        self.assertTrue(gerenciador.enviar('teste@example.com', 'Assunto', ['conteudo']))
+        self.assertEqual(len(self.instancias), 2)
+        self.instancias[1].smtp.sendmail.assert_called_once()
+
+    def test_destinatario_recusado_mantem_sessao(self):
+        """Uma recusa permanente de destinatário não derruba a sessão autenticada"""
+        gerenciador = GerenciadorSessoesSMTP(max_sessoes=1)
+        gerenciador.enviar('teste@example.com', 'Assunto', ['conteudo'])
+        self.instancias[0].smtp.sendmail.side_effect = smtplib.SMTPRecipientsRefused(
+            {'teste@example.com': (550, b'no such user')})
+        with self.assertRaises(smtplib.SMTPRecipientsRefused):
+            gerenciador.enviar('teste@example.com', 'Assunto', ['conteudo'])
+        self.instancias[0].smtp.sendmail.side_effect = None
+        self.assertTrue(gerenciador.enviar('teste@example.com', 'Assunto', ['conteudo']))
+        self.assertEqual(len(self.instancias), 1)
+        self.assertEqual(self.instancias[0].login.call_count, 1)
+        self.instancias[0].close.assert_not_called()
+
+class TestBenchmarks(unittest.TestCase):
+    def test_envio_pelo_smtp_local(self):
+        """A sessão SMTP real autentica e entrega no servidor local dos benchmarks"""
+        servidor = smtp_local.iniciar()
+        self.addCleanup(servidor.shutdown)
+        ambiente = {'EMAIL_HOST': '127.0.0.1', 'EMAIL_PORT': str(servidor.porta), 'EMAIL_STARTTLS': '0',
+                    'EMAIL_USER': 'clinica@example.com', 'EMAIL_PASSWORD': 'senha'}
+        with mock.patch.dict(os.environ, ambiente):
+            gerenciador = GerenciadorSessoesSMTP(max_sessoes=1)
+            for _ in range(3):
+                self.assertTrue(gerenciador.enviar('teste@example.com', 'Assunto', ['<p>conteudo</p>']))
+            gerenciador.fechar_todas()
+        self.assertEqual(servidor.mensagens, 3)
+
+    def test_regressao_acima_do_limite(self):
+        """Só pioras além do limite contam como regressão"""
+        baseline = {'resultados': {'agendar_exame': {'p95_ms': 10.0},
+                                   'envio_notificacoes': {'por_segundo': 100.0}}}
+        atual = {'resultados': {'agendar_exame': {'p95_ms': 11.5},
+                                'envio_notificacoes': {'por_segundo': 70.0}}}
+        regressoes = suite.comparar(atual, baseline, 0.2)
+        self.assertEqual(len(regressoes), 1)
+        self.assertTrue(regressoes[0].startswith('envio_notificacoes'))
+
+ENVIADO = {'enviado': True, 'permanente': False, 'erro': None}
+
+class TestDespachoNotificacoes(unittest.TestCase):
+    def notificacao(self, id, paciente_id, minuto):
+        return {
+            'id': id,
+            'paciente_id': paciente_id,
+            'email': f'paciente{paciente_id}@example.com',
+            'mensagem': f'Mensagem {id}',
+            'created_at': datetime(2024, 1, 1, 10, minuto)
+        }
+
+    def test_envio_paralelo_preserva_ordem_por_paciente(self):
+        """Cada paciente recebe suas notificações na ordem de criação"""
+        pendentes = [
+            self.notificacao(3, 1, 5), self.notificacao(1, 1, 1),
+            self.notificacao(2, 2, 2), self.notificacao(4, 1, 9),
+            self.notificacao(5, 2, 7)
+        ]
+        enviados = []
+        with mock.patch.object(email_service, 'reivindicar_notificacoes', side_effect=[pendentes, []]), \
+             mock.patch.object(email_service, 'registrar_falhas_notificacoes', return_value=True), \
+             mock.patch.object(email_service, 'entregar_email',
+                               side_effect=lambda email, assunto, msg: enviados.append((email, msg)) or ENVIADO), \
+             mock.patch.object(email_service, 'marcar_notificacoes_enviadas', return_value=True) as marcar:
+            resumo = email_service.enviar_notificacoes(concorrencia=3, taxa_maxima=0)
+
+        self.assertEqual(resumo['enviadas'], 5)
+        self.assertEqual(sorted(i for chamada in marcar.call_args_list for i in chamada.args[0]),
+                         [1, 2, 3, 4, 5])
+        paciente1 = [msg for email, msg in enviados if email == 'paciente1@example.com']
+        self.assertEqual(paciente1, ['Mensagem 1', 'Mensagem 3', 'Mensagem 4'])
+
+    def test_parada_termina_o_lote_atual(self):
+        """Com o sinal de parada, o lote reservado é enviado e nenhum outro é reservado"""
+        parar = threading.Event()
+        lote = [self.notificacao(1, 1, 1), self.notificacao(2, 2, 2)]
+        def enviar(email, assunto, msg):
+            parar.set()
+            return ENVIADO
+        with mock.patch.object(email_service, 'reivindicar_notificacoes', side_effect=[lote, lote]) as reivindicar, \
+             mock.patch.object(email_service, 'registrar_falhas_notificacoes', return_value=True), \
+             mock.patch.object(email_service, 'entregar_email', side_effect=enviar), \
+             mock.patch.object(email_service, 'marcar_notificacoes_enviadas', return_value=True) as marcar:
+            resumo = email_service.enviar_notificacoes(concorrencia=1, taxa_maxima=0, parar=parar)
+        self.assertEqual(reivindicar.call_count, 1)
+        self.assertEqual(resumo['enviadas'], 2)
+        marcar.assert_called_once_with([1, 2])
+
+    def test_falha_interrompe_grupo_do_paciente(self):
+        """Após uma falha, as notificações seguintes do paciente aguardam"""
+        grupo = [self.notificacao(1, 1, 1), self.notificacao(2, 1, 2)]
+        confirmacoes = mock.Mock()
+        falha = {'enviado': False, 'permanente': False, 'erro': '421 tente mais tarde'}
+        with mock.patch.object(email_service, 'entregar_email', return_value=falha) as enviar:
+            resultado = email_service._enviar_grupo(grupo, email_service.LimitadorTaxa(0), confirmacoes)
+        self.assertEqual(resultado['falhas'], 1)
+        self.assertEqual(enviar.call_count, 1)
+        confirmacoes.falhou.assert_called_once_with(grupo[0], '421 tente mais tarde', False, [2])
+        confirmacoes.enviada.assert_not_called()
+
+    def test_falhas_registradas_com_as_seguintes_adiadas(self):
+        """Falhas vão para o registro de novas tentativas com as notificações que esperam por elas"""
+        lote1 = [self.notificacao(1, 1, 1), self.notificacao(2, 2, 2)]
+        lote2 = [self.notificacao(3, 1, 3)]
+        def entregar(email, assunto, msg):
+            if email == 'paciente1@example.com':
+                return {'enviado': False, 'permanente': False, 'erro': 'timeout'}
+            return ENVIADO
+        with mock.patch.object(email_service, 'reivindicar_notificacoes', side_effect=[lote1, lote2, []]), \
+             mock.patch.object(email_service, 'entregar_email', side_effect=entregar), \
+             mock.patch.object(email_service, 'marcar_notificacoes_enviadas', return_value=True), \
+             mock.patch.object(email_service, 'registrar_falhas_notificacoes', return_value=True) as registrar:
+            resumo = email_service.enviar_notificacoes(concorrencia=1, taxa_maxima=0, worker_id='w1')
+        self.assertEqual((resumo['enviadas'], resumo['falhas']), (1, 1))
+        registrar.assert_called_once_with(
+            [{'id': 1, 'erro': 'timeout', 'permanente': False, 'adiadas': [3]}], 'w1',
+            email_service.NOTIFICACOES_MAX_TENTATIVAS, email_service.NOTIFICACOES_BACKOFF_BASE,
+            email_service.NOTIFICACOES_BACKOFF_MAXIMO)
+
+    def test_resumo_por_destinatario_na_janela(self):
+        """Notificações do paciente dentro da janela saem em um e-mail e são confirmadas juntas"""
+        grupo = [self.notificacao(1, 1, 1), self.notificacao(2, 1, 2), self.notificacao(3, 1, 9)]
+        grupo[0]['nome_paciente'] = 'Ana'
+        confirmacoes = mock.Mock()
+        with mock.patch.object(email_service, 'entregar_email', return_value=ENVIADO) as entregar:
+            resultado = email_service._enviar_grupo(grupo, email_service.LimitadorTaxa(0), confirmacoes,
+                                                    janela_resumo=300)
+        self.assertEqual((resultado['enviadas'], resultado['agrupadas']), (3, 1))
+        self.assertEqual(entregar.call_count, 2)
+        email, assunto, texto = entregar.call_args_list[0].args
+        self.assertEqual(assunto, mensagens.ASSUNTO_RESUMO)
+        self.assertIn('Olá Ana', texto)
+        self.assertIn('Mensagem 1', texto)
+        self.assertIn('Mensagem 2', texto)
+        self.assertEqual(entregar.call_args_list[1].args[2], 'Mensagem 3')
+        self.assertEqual(confirmacoes.enviada.call_args_list, [mock.call(1, 2), mock.call(3)])
+
+    def test_resumo_com_notificacoes_de_lotes_diferentes(self):
+        """A primeira alteração espera a janela na fila e sai junto com a segunda, criada depois"""
+        primeira, segunda = self.notificacao(1, 1, 1), self.notificacao(2, 1, 2)
+        # 1ª execução: só a primeira existe e sua janela está aberta, a reserva não a entrega.
+        # 2ª execução: a janela fechou e a segunda, criada dentro dela, vem no mesmo lote.
+        reservas = [[], [primeira, segunda], []]
+        with mock.patch.object(email_service, 'reivindicar_notificacoes', side_effect=reservas) as reivindicar, \
+             mock.patch.object(email_service, 'entregar_email', return_value=ENVIADO) as entregar, \
+             mock.patch.object(email_service, 'marcar_notificacoes_enviadas', return_value=True) as marcar, \
+             mock.patch.object(email_service, 'registrar_falhas_notificacoes', return_value=True):
+            self.assertEqual(email_service.enviar_notificacoes(concorrencia=1, taxa_maxima=0,
+                                                               janela_resumo=120)['total'], 0)
+            entregar.assert_not_called()
+            resumo = email_service.enviar_notificacoes(concorrencia=1, taxa_maxima=0, janela_resumo=120)
+        self.assertEqual([chamada.args[3] for chamada in reivindicar.call_args_list], [120, 120, 120])
+        self.assertEqual((resumo['enviadas'], resumo['agrupadas']), (2, 1))
+        entregar.assert_called_once()
+        self.assertEqual(entregar.call_args.args[1], mensagens.ASSUNTO_RESUMO)
+        marcar.assert_called_once_with([1, 2])
+
+    def test_reserva_segura_a_janela_do_resumo(self):
+        """A reserva só entrega notificações cuja janela de resumo (própria ou de uma anterior) fechou"""
+        conn = ConexaoRegistrada()
+        with mock.patch('db.get_db_connection', return_value=conn):
+            self.assertEqual(db.reivindicar_notificacoes('w1', limite=50, lease_segundos=600, janela_resumo=120), [])
+        self.assertEqual(conn.argumentos[0], {'lease': 600, 'janela': 120, 'limite': 50})
+        sql = ' '.join(conn.comandos[0].split())
+        self.assertIn('n.created_at <= DATE_SUB(NOW(), INTERVAL %(janela)s SECOND) OR EXISTS', sql)
+        self.assertIn('h.created_at >= DATE_SUB(n.created_at, INTERVAL %(janela)s SECOND)', sql)
+
+    def test_cota_do_relay_nao_e_permanente(self):
+        """A cota diária esgotada no MAIL FROM volta para a fila com backoff em vez de ir para 'erro'"""
+        cota = smtplib.SMTPSenderRefused(550, b'5.4.5 Daily user sending quota exceeded', 'clinica@example.com')
+        self.assertFalse(falha_permanente(cota))
+        self.assertFalse(falha_permanente(smtplib.SMTPDataError(554, b'5.7.0 Message rejected by policy')))
+        with mock.patch('email_utils._sessoes_smtp.enviar', side_effect=cota):
+            envio = email_utils.entregar_email('paciente@example.com', 'Assunto', 'Mensagem')
+        self.assertEqual((envio['enviado'], envio['permanente']), (False, False))
+        self.assertIn('quota', envio['erro'])
+
+    def test_recusa_5xx_e_permanente(self):
+        """Só recusas do destinatário são permanentes; autenticação, relay e 4xx voltam para a fila"""
+        self.assertTrue(falha_permanente(smtplib.SMTPRecipientsRefused({'x@example.com': (550, b'no such user')})))
+        self.assertTrue(falha_permanente(smtplib.SMTPRecipientsRefused(
+            {'x@example.com': (550, b'5.1.1 The email account that you tried to reach does not exist')})))
+        self.assertTrue(falha_permanente(smtplib.SMTPDataError(550, b'5.1.1 user unknown')))
+        self.assertFalse(falha_permanente(smtplib.SMTPRecipientsRefused(
+            {'x@example.com': (550, b'5.7.1 relaying denied')})))
+        self.assertFalse(falha_permanente(smtplib.SMTPDataError(554, b'rejected')))
+        self.assertFalse(falha_permanente(smtplib.SMTPDataError(451, b'try again')))
+        self.assertFalse(falha_permanente(smtplib.SMTPAuthenticationError(535, b'bad credentials')))
+        self.assertFalse(falha_permanente(smtplib.SMTPServerDisconnected('caiu')))
+
+    def test_lembretes_criados_em_lote(self):
+        """Os lembretes do ciclo são gravados de uma vez, ignorando quem não tem e-mail"""
+        agendamentos = [
+            {'id': 1, 'paciente_id': 1, 'email': 'a@example.com'},
+            {'id': 2, 'paciente_id': 2, 'email': None},
+            {'id': 3, 'paciente_id': 3, 'email': 'c@example.com'},
+        ]
+        with mock.patch.object(email_service, 'get_agendamentos_proximas_24h', return_value=agendamentos), \
+             mock.patch.object(email_service, 'criar_notificacoes_lembrete', return_value=2) as criar:
+            self.assertEqual(email_service.verificar_agendamentos_24h(), 2)
+        criar.assert_called_once_with([agendamentos[0], agendamentos[2]])
+
+    def test_confirmacoes_gravadas_em_lote(self):
+        """Envios confirmados geram um UPDATE por lote, não por mensagem"""
+        with mock.patch.object(email_service, 'marcar_notificacoes_enviadas', return_value=True) as marcar, \
+             mock.patch.object(email_service, 'registrar_falhas_notificacoes', return_value=True) as registrar:
+            confirmacoes = email_service.ConfirmacoesEmLote('worker', tamanho_lote=3, intervalo=60)
+            for notificacao_id in range(1, 6):
+                confirmacoes.enviada(notificacao_id)
+            confirmacoes.falhou({'id': 6, 'paciente_id': 1}, '550 mailbox unavailable', permanente=True)
+            self.assertEqual(marcar.call_count, 1)
+            registrar.assert_not_called()
+            confirmacoes.fechar()
+        self.assertEqual([chamada.args[0] for chamada in marcar.call_args_list], [[1, 2, 3], [4, 5]])
+        self.assertEqual(registrar.call_args.args[:2], (
+            [{'id': 6, 'erro': '550 mailbox unavailable', 'permanente': True, 'adiadas': []}], 'worker'))
+
+class TestMigracoes(unittest.TestCase):
+    def test_migracoes_tem_up_e_down(self):
+        """Toda migração versionada pode ser aplicada e revertida"""
+        migracoes = carregar_migracoes()
+        versoes = [m['versao'] for m in migracoes]
+        self.assertEqual(versoes, sorted(set(versoes)))
+        for migracao in migracoes:
+            self.assertTrue(migracao['up'], f"{migracao['versao']} sem comandos de up")
+            self.assertTrue(migracao['down'], f"{migracao['versao']} sem comandos de down")
+
+    def test_colunas_da_fila_em_migracao(self):
+        """As colunas usadas pela fila de notificações vêm de uma migração, não só do script.sql"""
+        up = ' '.join(comando for m in carregar_migracoes() for comando in m['up'])
+        for coluna in ('agendamento_id INT NULL', 'claimed_by VARCHAR(100) NULL', 'claimed_at DATETIME NULL'):
+            self.assertIn(f'ADD COLUMN {coluna}', up)
+
+    def test_indices_das_consultas_quentes(self):
+        """A primeira migração cria os índices compostos das consultas frequentes"""
+        up = carregar_migracoes()[0]['up']
+        self.assertIn('CREATE INDEX idx_agendamentos_data_hora_status ON agendamentos (data_hora, status)', up)
+        self.assertIn('CREATE INDEX idx_notificacoes_status_created ON notificacoes (status_envio, created_at)', up)
+        self.assertIn('CREATE INDEX idx_exames_data_hora ON exames (data_hora)', up)
+
+class TestIndiceOcupacao(unittest.TestCase):
+    def setUp(self):
+        # 05/01/2024 é uma sexta-feira
+        self.ocupados = [datetime(2024, 1, 5, 9, 0), datetime(2024, 1, 5, 17, 30)]
+        self.cargas = []
+
+        def carregar_dia(dia):
+            self.cargas.append(dia)
+            return [h for h in self.ocupados if h.date() == dia]
+
+        self.indice = IndiceOcupacao(carregar_dia, ttl=60, duracao_slot=30)
+
+    def test_disponibilidade_carrega_dia_uma_vez(self):
+        """O dia é carregado na primeira consulta e respondido da memória depois"""
+        self.assertFalse(self.indice.disponivel(datetime(2024, 1, 5, 9, 0)))
+        self.assertTrue(self.indice.disponivel(datetime(2024, 1, 5, 9, 30)))
+        self.assertEqual(self.cargas, [datetime(2024, 1, 5).date()])
+
+    def test_ocupar_e_liberar(self):
+        """Agendamentos e cancelamentos atualizam o índice sem ir ao banco"""
+        horario = datetime(2024, 1, 5, 10, 0)
+        self.assertTrue(self.indice.disponivel(horario))
+        self.indice.ocupar(horario)
+        self.assertFalse(self.indice.disponivel(horario))
+        self.indice.liberar(horario)
+        self.assertTrue(self.indice.disponivel(horario))
+        self.assertEqual(len(self.cargas), 1)
+
+    def test_proximos_horarios_livres(self):
+        """Sugestões pulam horários ocupados, fora do expediente e fins de semana"""
+        livres = self.indice.proximos_livres(datetime(2024, 1, 5, 17, 10), datetime(2024, 1, 10), 3)
+        self.assertEqual(livres, [
+            datetime(2024, 1, 8, 8, 0),
+            datetime(2024, 1, 8, 8, 30),
+            datetime(2024, 1, 8, 9, 0),
+        ])
+        livres = self.indice.proximos_livres(datetime(2024, 1, 5, 8, 45), datetime(2024, 1, 10), 2)
+        self.assertEqual(livres, [datetime(2024, 1, 5, 9, 30), datetime(2024, 1, 5, 10, 0)])
+
+class TestCache(unittest.TestCase):
+    def test_padrao_compartilhado_entre_processos(self):
+        """Sem CACHE_BACKEND, o cache é o SQLite que o worker e o servidor web compartilham"""
+        with tempfile.TemporaryDirectory() as diretorio:
+            arquivo = os.path.join(diretorio, 'cache.sqlite3')
+            with mock.patch.dict(os.environ, {'CACHE_ARQUIVO': arquivo}):
+                os.environ.pop('CACHE_BACKEND', None)
+                self.assertIsInstance(criar_cache(), CacheSQLite)
+                with mock.patch.dict(os.environ, {'CACHE_BACKEND': 'memoria'}):
+                    self.assertIsInstance(criar_cache(), CacheLRU)
+
+    def test_lru_com_ttl(self):
+        """Entradas expiram pelo TTL e as menos usadas saem quando o cache enche"""
+        cache = CacheLRU(capacidade=2, ttl=60)
+        for chave in ('a', 'b'):
+            encontrado, versao = cache.buscar(chave)
+            self.assertFalse(encontrado)
+            cache.guardar(chave, chave.upper(), versao)
+        self.assertEqual(cache.buscar('a'), (True, 'A'))
+        cache.guardar('c', 'C', cache.buscar('c')[1])
+        self.assertFalse(cache.buscar('b')[0])
+        self.assertEqual(cache.estatisticas()['hits'], 1)
+
+        cache.ttl = -1
+        cache.guardar('d', 'D', cache.buscar('d')[1])
+        self.assertFalse(cache.buscar('d')[0])
+
+    def test_invalidacao_descarta_leitura_concorrente(self):
+        """Um valor lido antes de uma invalidação não volta para o cache"""
+        cache = CacheLRU()
+        encontrado, versao = cache.buscar('agendamentos:1')
+        cache.invalidar('agendamentos:1')
+        cache.guardar('agendamentos:1', ['antigo'], versao)
+        self.assertFalse(cache.buscar('agendamentos:1')[0])
+
+    def test_sqlite_privado_e_sem_pickle(self):
+        """O arquivo é só do dono, os valores ficam em JSON e as datas voltam com o tipo certo"""
+        with tempfile.TemporaryDirectory() as diretorio:
+            arquivo = os.path.join(diretorio, 'cache.sqlite3')
+            cache = CacheSQLite(arquivo, ttl=60)
+            self.assertEqual(os.stat(arquivo).st_mode & 0o777, 0o600)
+            linha = {'id': 1, 'data_hora': datetime(2024, 1, 5, 9, 30),
+                     'data_nascimento': datetime(1990, 1, 1).date()}
+            cache.guardar('agendamentos:1', [linha], cache.buscar('agendamentos:1')[1])
+            self.assertEqual(cache.buscar('agendamentos:1'), (True, [linha]))
+            bruto = cache._conexao().execute("SELECT valor FROM entradas").fetchone()[0]
+            self.assertIn('"2024-01-05T09:30:00"', bruto)
+
+            # Um valor pickle plantado no arquivo não é executado, só descartado
+            cache._conexao().execute("UPDATE entradas SET valor = ?", (b'\x80\x04cos\nsystem\n.',))
+            self.assertFalse(cache.buscar('agendamentos:1')[0])
+
+    def test_diretorio_padrao_privado(self):
+        """Um diretório de cache aberto a outros usuários é recusado"""
+        with tempfile.TemporaryDirectory() as diretorio:
+            privado = diretorio_privado(os.path.join(diretorio, 'cache'))
+            self.assertEqual(os.stat(privado).st_mode & 0o777, 0o700)
+            os.chmod(privado, 0o777)
+            with self.assertRaises(RuntimeError):
+                diretorio_privado(privado)
+
+    def test_sqlite_compartilhado_entre_processos(self):
+        """Duas instâncias sobre o mesmo arquivo enxergam gravações e invalidações"""
+        with tempfile.TemporaryDirectory() as diretorio:
+            arquivo = os.path.join(diretorio, 'cache.sqlite3')
+            web1 = CacheSQLite(arquivo, ttl=60)
+            web2 = CacheSQLite(arquivo, ttl=60)
+            web1.guardar('notificacoes:7', [{'id': 1}], web1.buscar('notificacoes:7')[1])
+            self.assertEqual(web2.buscar('notificacoes:7'), (True, [{'id': 1}]))
+            web2.invalidar('notificacoes:7')
+            self.assertFalse(web1.buscar('notificacoes:7')[0])
+
+class ConexaoRegistrada(ConexaoFalsa):
+    """Conexão falsa que registra os comandos executados."""
+
+    def __init__(self):
+        super().__init__()
+        self.comandos = []
+        self.parametros = []
+        self.resultados = []
+        self.argumentos = []
+        self.erros = {}
+        self.commits = 0
+
+    def cursor(self, *args, **kwargs):
+        conexao = self
+
+        class Cursor:
+            lastrowid = 1
+
+            def execute(self, operacao, params=None):
+                conexao.comandos.append(operacao.strip())
+                conexao.argumentos.append(params)
+                for inicio, erro in conexao.erros.items():
+                    if operacao.strip().startswith(inicio):
+                        raise erro
+
+            def executemany(self, operacao, sequencia):
+                conexao.comandos.append(operacao.strip())
+                conexao.parametros.append(list(sequencia))
+
+            def fetchall(self):
+                return conexao.resultados.pop(0) if conexao.resultados else []
+
+            def fetchone(self):
+                linhas = self.fetchall()
+                return linhas[0] if linhas else None
+
+            def close(self):
+                pass
+
+        return Cursor()
+
+    def commit(self):
+        self.commits += 1
+
+class TestUnidadeDeTrabalho(unittest.TestCase):
+    def setUp(self):
+        self.obtidas = []
+
+    def obter_conexao(self):
+        conn = ConexaoRegistrada()
+        self.obtidas.append(conn)
+        return conn
+
+    def test_uma_conexao_e_um_commit(self):
+        """Funções aninhadas compartilham a conexão e só há um commit real"""
+        with unidade_trabalho.unidade_de_trabalho(self.obter_conexao) as unidade:
+            externa = unidade.conexao()
+            externa.cursor().execute('INSERT INTO exames VALUES (1)')
+            interna = unidade.conexao()
+            interna.cursor().execute('SELECT * FROM pacientes')
+            interna.commit()
+            interna.close()
+            externa.commit()
+            externa.close()
+        self.assertEqual(len(self.obtidas), 1)
+        conn = self.obtidas[0]
+        self.assertEqual(conn.commits, 1)
+        self.assertTrue(conn.fechada)
+        self.assertEqual(conn.comandos, [
+            'SAVEPOINT uow_1', 'INSERT INTO exames VALUES (1)',
+            'SELECT * FROM pacientes', 'RELEASE SAVEPOINT uow_1'
+        ])
+
+    def test_falha_desfaz_so_a_funcao(self):
+        """Fechar sem commit desfaz apenas as escritas daquela função"""
+        with unidade_trabalho.unidade_de_trabalho(self.obter_conexao) as unidade:
+            conn = unidade.conexao()
+            conn.cursor().execute('UPDATE agendamentos SET status = 1')
+            conn.close()
+        self.assertEqual(self.obtidas[0].comandos[-1], 'ROLLBACK TO SAVEPOINT uow_1')
+        self.assertEqual(self.obtidas[0].commits, 1)
+
+    def test_efeitos_apos_commit(self):
+        """Efeitos em memória esperam o commit e são descartados no rollback"""
+        efeitos = []
+        with unidade_trabalho.unidade_de_trabalho(self.obter_conexao) as unidade:
+            unidade.conexao()
+            unidade.apos_confirmar(lambda: efeitos.append('ok'))
+            self.assertEqual(efeitos, [])
+        self.assertEqual(efeitos, ['ok'])
+
+        with self.assertRaises(RuntimeError):
+            with unidade_trabalho.unidade_de_trabalho(self.obter_conexao) as unidade:
+                unidade.conexao()
+                unidade.apos_confirmar(lambda: efeitos.append('descartado'))
+                raise RuntimeError('falha no job')
+        self.assertEqual(efeitos, ['ok'])
+        self.assertEqual(self.obtidas[1].rollbacks, 1)
+
+class TestOutboxNotificacoes(unittest.TestCase):
+    def test_agendamento_grava_notificacao_na_transacao(self):
+        """Agendar grava a notificação pendente antes do commit, sem enviar e-mail"""
+        paciente = Paciente(id=3, username="outbox", nome="Paciente Outbox", email="outbox@example.com",
+                            cpf="98765432100", data_nascimento=datetime(1985, 5, 5), user_id=3)
+        data_hora = datetime(2030, 1, 2, 9, 0)
+        conn = ConexaoRegistrada()
+        with mock.patch('db.verificar_disponibilidade', return_value=True), \
+             mock.patch('db.get_db_connection', return_value=conn), \
+             mock.patch('db.get_paciente_by_id', return_value=paciente), \
+             mock.patch('email_utils.get_yagmail_instance') as smtp:
+            self.assertTrue(agendar_exame(3, "Raio-X", data_hora))
+        smtp.assert_not_called()
+        self.assertEqual(conn.commits, 1)
+        self.assertIn('INSERT INTO notificacoes', conn.comandos[-1])
+        (linha,), = conn.parametros
+        self.assertEqual(linha[:2], (3, 1))
+        self.assertEqual(linha[3:], ("outbox@example.com", 'pendente'))
+        self.assertIn("Raio-X", linha[2])
+
+class TestHorarioUnico(unittest.TestCase):
+    def test_horario_ocupado_por_agendamento_concorrente(self):
+        """ER_DUP_ENTRY do índice único recusa o agendamento e marca o horário como ocupado"""
+        paciente = Paciente(id=3, username="dup", nome="Paciente Dup", email="dup@example.com",
+                            cpf="11122233344", data_nascimento=datetime(1980, 3, 3), user_id=3)
+        data_hora = datetime(2030, 1, 2, 11, 0)
+        conn = ConexaoRegistrada()
+        conn.erros['INSERT INTO agendamentos'] = IntegrityError(
+            msg="Duplicate entry for key 'uq_agendamentos_horario_ativo'", errno=errorcode.ER_DUP_ENTRY)
+        ordem = []
+        def obter_conexao():
+            ordem.append('conexao')
+            return conn
+        def buscar_paciente(paciente_id):
+            ordem.append('paciente')
+            return paciente
+        with mock.patch('db.verificar_disponibilidade', return_value=True), \
+             mock.patch('db.get_db_connection', side_effect=obter_conexao), \
+             mock.patch('db.get_paciente_by_id', side_effect=buscar_paciente), \
+             mock.patch.object(db._ocupacao, 'ocupar') as ocupar:
+            self.assertFalse(agendar_exame(3, "Raio-X", data_hora))
+        # O paciente é lido antes de reservar a conexão: um agendamento usa uma conexão só
+        self.assertEqual(ordem, ['paciente', 'conexao'])
+        self.assertEqual(conn.commits, 0)
+        self.assertTrue(conn.fechada)
+        ocupar.assert_called_once_with(data_hora)
+
+class TestReservaNotificacoes(unittest.TestCase):
+    def test_detalhes_ligados_ao_proprio_agendamento(self):
+        """A reserva busca os dados de envio pelo agendamento da notificação, não pelo paciente"""
+        conn = ConexaoRegistrada()
+        reservadas = [{'id': 4, 'paciente_id': 1, 'agendamento_id': 9},
+                      {'id': 7, 'paciente_id': 1, 'agendamento_id': None}]
+        conn.resultados = [[{'id': 4}, {'id': 7}], reservadas]
+        with mock.patch('db.get_db_connection', return_value=conn):
+            self.assertEqual(db.reivindicar_notificacoes('w1', limite=10), reservadas)
+        self.assertEqual(conn.commits, 1)
+        detalhes = conn.comandos[-1]
+        self.assertIn('LEFT JOIN agendamentos a ON n.agendamento_id = a.id', detalhes)
+        self.assertNotIn('a.paciente_id', detalhes)
+        self.assertIn('WHERE n.id IN (%s, %s)', detalhes)
+
+    def test_seguinte_espera_anterior_em_backoff(self):
+        """Uma notificação não é reservada enquanto uma anterior do mesmo paciente espera o backoff"""
+        conn = ConexaoRegistrada()
+        conn.resultados = [[]]
+        with mock.patch('db.get_db_connection', return_value=conn):
+            self.assertEqual(db.reivindicar_notificacoes('w1', limite=10, janela_resumo=0), [])
+        self.assertEqual(conn.argumentos[0], {'lease': 600, 'janela': 0, 'limite': 10})
+        inicio = db.SQL_RESERVAR_NOTIFICACOES.index('NOT EXISTS (')
+        fim = db.SQL_RESERVAR_NOTIFICACOES.index('\n    )', inicio)
+        ordem = db.SQL_RESERVAR_NOTIFICACOES[inicio:fim + 6].replace('NOW()', "datetime('now')")
+        # Avalia o filtro de ordem como está na consulta: a 2 espera a 1, a 4 é de outro paciente
+        banco = sqlite3.connect(':memory:')
+        banco.execute('CREATE TABLE notificacoes (id INTEGER, paciente_id INTEGER, status_envio TEXT, proxima_tentativa_em TEXT)')
+        banco.executemany("INSERT INTO notificacoes VALUES (?, ?, ?, datetime('now', ?))", [
+            (1, 1, 'pendente', '+5 minutes'), (2, 1, 'pendente', '-1 minute'),
+            (3, 2, 'enviado', '+5 minutes'), (4, 2, 'pendente', '-1 minute')])
+        liberadas = [linha[0] for linha in banco.execute(
+            f"SELECT n.id FROM notificacoes n WHERE n.status_envio = 'pendente' "
+            f"AND n.proxima_tentativa_em <= datetime('now') AND {ordem} ORDER BY n.id")]
+        self.assertEqual(liberadas, [4])
+
+class TestFalhasNotificacoes(unittest.TestCase):
+    def test_backoff_e_adiamento_em_uma_transacao(self):
+        """Cada falha conta a tentativa com backoff e as seguintes do paciente são adiadas junto"""
+        conn = ConexaoRegistrada()
+        conn.resultados = [[(5,)]]
+        falhas = [{'id': 1, 'erro': 'x' * 600, 'permanente': False, 'adiadas': [2, 3]},
+                  {'id': 4, 'erro': '550 no such user', 'permanente': True, 'adiadas': []}]
+        with mock.patch('db.get_db_connection', return_value=conn), \
+             mock.patch('db._invalidar_cache_paciente') as invalidar:
+            self.assertTrue(db.registrar_falhas_notificacoes(falhas, 'w1', max_tentativas=3,
+                                                             backoff_base=30, backoff_maximo=600))
+        self.assertEqual(conn.commits, 1)
+        self.assertIn('POW(2, tentativas - 1)', conn.comandos[0])
+        self.assertEqual(conn.parametros[0], [('x' * 500, False, 3, 600, 30, 1, 'w1'),
+                                              ('550 no such user', True, 3, 600, 30, 4, 'w1')])
+        self.assertIn('INNER JOIN notificacoes f ON f.id = %s', conn.comandos[1])
+        self.assertEqual(conn.argumentos[0], (1, 2, 3, 'w1'))
+        invalidar.assert_called_once_with(5)
+
+class TestLogs(unittest.TestCase):
+    def registro(self, msg, *args, **extra):
+        record = logging.LogRecord('db', logging.INFO, __file__, 1, msg, args, None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_campos_estruturados(self):
+        """Campos passados em extra aparecem na linha formatada"""
+        record = self.registro('Agendamento concluído', paciente_id=7)
+        linha = FormatadorEstruturado('json').format(record)
+        campos = json.loads(linha)
+        self.assertEqual(campos['msg'], 'Agendamento concluído')
+        self.assertEqual(campos['paciente_id'], 7)
+        self.assertEqual(campos['nivel'], 'INFO')
+        texto = FormatadorEstruturado('texto').format(record)
+        self.assertIn('INFO    db Agendamento concluído paciente_id=7', texto)
+
+    def test_fila_cheia_descarta_sem_bloquear(self):
+        """Com a fila cheia o registro é descartado em vez de bloquear quem registrou"""
+        handler = FilaHandler(queue.Queue(1))
+        handler.handle(self.registro('primeiro %s', 1))
+        handler.handle(self.registro('segundo'))
+        self.assertEqual(handler.descartados, 1)
+        self.assertEqual(handler.queue.get_nowait().msg, 'primeiro 1')
+
+class TestMetricas(unittest.TestCase):
+    def test_histograma_cumulativo(self):
+        """Buckets são cumulativos e acompanhados de _sum e _count"""
+        registro = metricas.Registro()
+        duracao = registro.registrar(metricas.Histograma('duracao_segundos', 'Duração', buckets=(0.1, 1)))
+        duracao.observar(0.05, funcao='agendar_exame')
+        duracao.observar(0.5, funcao='agendar_exame')
+        duracao.observar(2, funcao='agendar_exame')
+        texto = registro.exportar()
+        self.assertIn('# TYPE duracao_segundos histogram', texto)
+        self.assertIn('duracao_segundos_bucket{funcao="agendar_exame",le="0.1"} 1', texto)
+        self.assertIn('duracao_segundos_bucket{funcao="agendar_exame",le="1"} 2', texto)
+        self.assertIn('duracao_segundos_bucket{funcao="agendar_exame",le="+Inf"} 3', texto)
+        self.assertIn('duracao_segundos_sum{funcao="agendar_exame"} 2.55', texto)
+        self.assertIn('duracao_segundos_count{funcao="agendar_exame"} 3', texto)
+
+    def test_contador_e_medidor(self):
+        """Rótulos são escapados e medidores sem valor são omitidos"""
+        registro = metricas.Registro()
+        falhas = registro.registrar(metricas.Contador('falhas_total', 'Falhas'))
+        falhas.inc(motivo='resposta "5xx"')
+        registro.registrar(metricas.Medidor('pendentes', 'Pendentes', lambda: 12))
+        registro.registrar(metricas.Medidor('indisponivel', 'Sem banco', lambda: None))
+        texto = registro.exportar()
+        self.assertIn('falhas_total{motivo="resposta \\"5xx\\""} 1', texto)
+        self.assertIn('pendentes 12', texto)
+        self.assertNotIn('indisponivel', texto)
+
+    def test_servidor_http_do_worker(self):
+        """O worker expõe o mesmo texto do /metrics em uma porta própria"""
+        registro = metricas.Registro()
+        registro.registrar(metricas.Contador('smtp_falhas_total', 'Falhas')).inc(motivo='smtp')
+        servidor = metricas.servir(0, '127.0.0.1', registro)
+        self.addCleanup(servidor.server_close)
+        self.addCleanup(servidor.shutdown)
+        url = f'http://127.0.0.1:{servidor.server_address[1]}'
+        with urllib.request.urlopen(f'{url}/metrics', timeout=5) as resposta:
+            self.assertIn('text/plain', resposta.headers['Content-Type'])
+            self.assertIn('smtp_falhas_total{motivo="smtp"} 1', resposta.read().decode())
+        with self.assertRaises(urllib.error.HTTPError):
+            urllib.request.urlopen(f'{url}/outra', timeout=5)
+
+class TestSondaProntidao(unittest.TestCase):
+    def test_estado_vem_da_ultima_verificacao(self):
+        """As rotas leem o último resultado sem tocar no banco"""
+        chamadas = []
+        def verificar():
+            chamadas.append(1)
+            return True, 'ok'
+        sonda = SondaProntidao(verificar, intervalo=10)
+        self.assertFalse(sonda.estado()['pronto'])
+        sonda.verificar_agora()
+        for _ in range(100):
+            self.assertTrue(sonda.estado()['pronto'])
+        self.assertEqual(len(chamadas), 1)
+
+    def test_falha_e_resultado_desatualizado(self):
+        """Exceções e verificações antigas deixam a aplicação não pronta"""
+        def verificar():
+            raise ConnectionError('banco fora do ar')
+        sonda = SondaProntidao(verificar, intervalo=10)
+        sonda.verificar_agora()
+        estado = sonda.estado()
+        self.assertFalse(estado['pronto'])
+        self.assertEqual(estado['detalhe'], 'banco fora do ar')
+
+        sonda = SondaProntidao(lambda: (True, 'ok'), intervalo=10, validade=0.01)
+        sonda.verificar_agora()
+        time.sleep(0.02)
+        self.assertEqual(sonda.estado()['detalhe'], 'verificação desatualizada')
+
+class TestPerfil(unittest.TestCase):
+    def test_cursor_medido_acumula_no_perfil(self):
+        """Cada execute conta uma consulta e soma o tempo de banco"""
+        conn = ConexaoRegistrada()
+        pool = ConnectionPool(lambda: conn, tamanho=1, max_overflow=0, pre_ping=False,
+                              instrumentar_cursor=perfil.CursorMedido)
+        with perfil.perfilar() as atual:
+            cursor = pool.obter().cursor()
+            cursor.execute('SELECT 1')
+            cursor.execute('SELECT * FROM exames WHERE id = %s', (3,))
+            perfil.registrar_smtp(0.25)
+        self.assertIsInstance(cursor, perfil.CursorMedido)
+        self.assertEqual(atual.consultas, 2)
+        self.assertEqual(atual.resumo()['tempo_smtp_ms'], 250.0)
+        self.assertIn('2 consultas', atual.server_timing())
+
+    def test_consulta_lenta_sem_parametros(self):
+        """O log de consultas lentas mostra o SQL mas nunca os valores"""
+        with mock.patch.object(perfil, 'DB_SLOW_QUERY_MS', 0):
+            with self.assertLogs('perfil', level='WARNING') as logs_capturados:
+                perfil.registrar_consulta('SELECT *\n  FROM users WHERE email = %s', ('ana@exemplo.com',), 0.3)
+        registro = logs_capturados.records[0]
+        self.assertEqual(registro.sql, 'SELECT * FROM users WHERE email = %s')
+        self.assertEqual(registro.parametros, '<1 omitidos>')
+        self.assertNotIn('ana@exemplo.com', str(vars(registro)))
+
+class TestSessao(unittest.TestCase):
+    def setUp(self):
+        app = Flask(__name__, template_folder=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates'))
+        app.secret_key = 'teste'
+        routes.init_app(app)
+        self.cliente = app.test_client()
+
+    def entrar(self, **usuario):
+        perfil = {'user_id': 1, 'nome': 'Ana', 'email': 'ana@example.com',
+                  'tipo_usuario': 'paciente', 'paciente_id': 7}
+        perfil.update(usuario)
+        with self.cliente.session_transaction() as sessao:
+            sessao['usuario'] = perfil
+
+    def test_rotas_exigem_login(self):
+        """Sem sessão, as áreas do paciente e da recepcionista levam ao login"""
+        for url in ('/paciente/dashboard', '/paciente/agendar', '/recepcionista/dashboard'):
+            resposta = self.cliente.get(url)
+            self.assertEqual(resposta.status_code, 302)
+            self.assertTrue(resposta.location.endswith('/login'))
+
+    def test_painel_usa_perfil_da_sessao(self):
+        """O painel usa o paciente_id da sessão sem consultar o usuário no banco"""
+        self.entrar()
+        with mock.patch('routes.paciente.get_agendamentos_paciente', return_value=[]) as agendamentos, \
+             mock.patch('routes.paciente.get_notificacoes_paciente', return_value=[]), \
+             mock.patch('db.get_paciente_by_user_id') as consulta_usuario:
+            resposta = self.cliente.get('/paciente/dashboard')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertIn('Ana', resposta.get_data(as_text=True))
+        agendamentos.assert_called_once_with(7)
+        consulta_usuario.assert_not_called()
+
+    def test_chave_secreta_obrigatoria(self):
+        """Sem SECRET_KEY a aplicação não inicia, exceto em debug com uma chave aleatória"""
+        with mock.patch.dict(os.environ, {'SECRET_KEY': 'teste'}):
+            import app as aplicacao
+        with mock.patch.dict(os.environ, {'SECRET_KEY': '', 'FLASK_DEBUG': '0'}):
+            with self.assertRaises(RuntimeError):
+                aplicacao._chave_secreta()
+        with mock.patch.dict(os.environ, {'SECRET_KEY': '', 'FLASK_DEBUG': '1'}):
+            chave = aplicacao._chave_secreta()
+            self.assertEqual(len(chave), 64)
+            self.assertNotEqual(chave, aplicacao._chave_secreta())
+
+    def test_paciente_nao_acessa_recepcao_e_logout_limpa(self):
+        """O tipo do usuário na sessão é verificado e o logout encerra a sessão"""
+        self.entrar()
+        self.assertEqual(self.cliente.get('/recepcionista/dashboard').status_code, 302)
+        self.cliente.get('/logout')
+        with self.cliente.session_transaction() as sessao:
+            self.assertNotIn('usuario', sessao)
+
+class TestPainelRecepcao(unittest.TestCase):
+    setUp = TestSessao.setUp
+    entrar = TestSessao.entrar
+
+    def test_filtros_e_cursor_da_proxima_pagina(self):
+        """Os filtros viram condições parametrizadas e a próxima página parte do último (data_hora, id)"""
+        linhas = [{'id': 10 - i, 'data_hora': datetime(2024, 3, 1, 10 - i)} for i in range(3)]
+        conn = ConexaoRegistrada()
+        conn.resultados = [linhas]
+        apos = (datetime(2024, 3, 1, 12), 11)
+        with mock.patch('db.get_db_connection', return_value=conn):
+            pagina, proxima = db.get_agendamentos_recepcionista(
+                data_inicio=datetime(2024, 3, 1), data_fim=datetime(2024, 3, 2), status='agendado',
+                paciente='Ana', apos=apos, limite=2)
+        self.assertEqual(pagina, linhas[:2])
+        self.assertEqual(proxima, (datetime(2024, 3, 1, 9), 9))
+        sql = conn.comandos[0]
+        self.assertIn('WHERE a.data_hora >= %s AND a.data_hora < %s AND a.status = %s AND u.nome LIKE %s '
+                      'AND (a.data_hora < %s OR (a.data_hora = %s AND a.id < %s))', ' '.join(sql.split()))
+        self.assertIn('ORDER BY a.data_hora DESC, a.id DESC', sql)
+        self.assertEqual(conn.argumentos[0], (datetime(2024, 3, 1), datetime(2024, 3, 2), 'agendado', '%Ana%',
+                                              apos[0], apos[0], 11, 3))
+
+    def test_ultima_pagina_sem_cursor(self):
+        """Sem filtros não há WHERE, e uma página incompleta não tem próxima"""
+        conn = ConexaoRegistrada()
+        conn.resultados = [[{'id': 1, 'data_hora': datetime(2024, 3, 1, 8)}]]
+        with mock.patch('db.get_db_connection', return_value=conn):
+            pagina, proxima = db.get_agendamentos_recepcionista(limite=2)
+        self.assertEqual(len(pagina), 1)
+        self.assertIsNone(proxima)
+        self.assertNotIn('WHERE', conn.comandos[0])
+        self.assertEqual(conn.argumentos[0], (3,))
+
+    def test_painel_data_final_inclusiva_e_link_da_proxima_pagina(self):
+        """A data final inclui o dia inteiro e o link da próxima página leva o cursor e os filtros"""
+        self.entrar(tipo_usuario='recepcionista', paciente_id=None)
+        ultimo = {'id': 42, 'data_hora': datetime(2024, 3, 5, 16, 30), 'tipo_exame': 'Raio-X',
+                  'status': 'agendado', 'nome_paciente': 'Ana', 'paciente_id': 7, 'exame_id': 1}
+        with mock.patch('routes.recepcionista.get_agendamentos_recepcionista',
+                        return_value=([ultimo], (ultimo['data_hora'], 42))) as buscar:
+            resposta = self.cliente.get('/recepcionista/dashboard?inicio=2024-03-01&fim=2024-03-05&status=agendado')
+        self.assertEqual(resposta.status_code, 200)
+        argumentos = buscar.call_args.kwargs
+        self.assertEqual(argumentos['data_inicio'], datetime(2024, 3, 1))
+        self.assertEqual(argumentos['data_fim'], datetime(2024, 3, 6))
+        self.assertEqual(argumentos['status'], 'agendado')
+        self.assertIsNone(argumentos['apos'])
+        html = resposta.get_data(as_text=True)
+        self.assertIn('apos_data=2024-03-05T16:30:00', html)
+        self.assertIn('apos_id=42', html)
+        self.assertIn('fim=2024-03-05', html)
+
+        with mock.patch('routes.recepcionista.get_agendamentos_recepcionista', return_value=([], None)) as buscar:
+            self.cliente.get('/recepcionista/dashboard?inicio=&fim=&apos_data=2024-03-05T16:30:00&apos_id=42')
+        self.assertEqual(buscar.call_args.kwargs['apos'], (datetime(2024, 3, 5, 16, 30), 42))
+        self.assertIsNone(buscar.call_args.kwargs['data_fim'])
+
+class ServidorLocksFalso:
+    """Simula GET_LOCK/RELEASE_LOCK/IS_USED_LOCK do MySQL para várias conexões."""
+
+    def __init__(self):
+        self.donos = {}
+        self.proximo_id = 0
+
+    def conectar(self):
+        self.proximo_id += 1
+        return ConexaoLocksFalsa(self, self.proximo_id)
+
+class ConexaoLocksFalsa:
+    def __init__(self, servidor, id_conexao):
+        self.servidor = servidor
+        self.id = id_conexao
+        self.caiu = False
+
+    def derrubar(self):
+        # Como no MySQL, os locks de uma sessão encerrada são liberados
+        self.caiu = True
+        for nome, dono in list(self.servidor.donos.items()):
+            if dono == self.id:
+                del self.servidor.donos[nome]
+
+    def _get_lock(self, nome):
+        if self.servidor.donos.get(nome, self.id) != self.id:
+            return 0
+        self.servidor.donos[nome] = self.id
+        return 1
+
+    def cursor(self):
+        conexao = self
+
+        class Cursor:
+            def execute(self, sql, parametros):
+                if conexao.caiu:
+                    raise ConnectionError('conexão perdida')
+                donos = conexao.servidor.donos
+                if sql.startswith('SELECT IS_USED_LOCK(%s) = CONNECTION_ID(), GET_LOCK'):
+                    self.linha = (int(donos.get(parametros[0]) == conexao.id), conexao._get_lock(parametros[1]))
+                elif sql.startswith('SELECT IS_USED_LOCK'):
+                    self.linha = (int(donos.get(parametros[0]) == conexao.id),)
+                elif sql.startswith('SELECT GET_LOCK'):
+                    self.linha = (conexao._get_lock(parametros[0]),)
+                elif sql.startswith('SELECT RELEASE_LOCK'):
+                    self.linha = (int(donos.pop(parametros[0], None) is not None),)
+
+            def fetchone(self):
+                return self.linha
+
+            def close(self):
+                pass
+
+        return Cursor()
+
+    def close(self):
+        pass
+
+class TestAgendador(unittest.TestCase):
+    def setUp(self):
+        self.servidor = ServidorLocksFalso()
+        self.execucoes = []
+
+    def registrar(self, job, instancia, iniciado_em, duracao, status, detalhe=None):
+        self.execucoes.append((job, status, detalhe))
+
+    def test_um_lider_e_failover(self):
+        """Só uma instância lidera; se a conexão dela cai, outra assume"""
+        a = LiderancaMySQL(self.servidor.conectar, nome='teste:agendador')
+        b = LiderancaMySQL(self.servidor.conectar, nome='teste:agendador')
+        self.assertTrue(a.renovar())
+        self.assertFalse(b.renovar())
+        a._conn.derrubar()
+        self.assertFalse(a.renovar())
+        self.assertTrue(b.renovar())
+        self.assertFalse(a.renovar())
+
+    def test_jobs_so_no_lider_e_registrados(self):
+        """Seguidores não executam; o líder registra sucesso e erro"""
+        lider = LiderancaMySQL(self.servidor.conectar, nome='teste:agendador')
+        seguidor = LiderancaMySQL(self.servidor.conectar, nome='teste:agendador')
+        lider.renovar()
+        seguidor.renovar()
+        chamadas = []
+        Agendador(seguidor, registrar=self.registrar).executar('lembretes', lambda: chamadas.append(1))
+        self.assertEqual(chamadas, [])
+
+        agendador = Agendador(lider, registrar=self.registrar)
+        self.assertEqual(agendador.executar('lembretes', lambda: 3), 3)
+        def falhar():
+            raise RuntimeError('smtp fora do ar')
+        agendador.executar('envio', falhar)
+        self.assertEqual(self.execucoes, [('lembretes', 'sucesso', '3'), ('envio', 'erro', 'smtp fora do ar')])
+        self.assertEqual(list(self.servidor.donos), ['teste:agendador'])
+
+    def test_execucao_sobreposta_e_ignorada(self):
+        """Um job ainda em andamento não é iniciado de novo"""
+        lider = LiderancaMySQL(self.servidor.conectar, nome='teste:agendador')
+        lider.renovar()
+        self.servidor.donos['teste:agendador:envio'] = 999
+        chamadas = []
+        Agendador(lider, registrar=self.registrar).executar('envio', lambda: chamadas.append(1))
+        self.assertEqual(chamadas, [])
+        self.assertEqual(self.execucoes, [('envio', 'ignorado', None)])
+
+class TestMensagens(unittest.TestCase):
+    def test_lembrete(self):
+        """O lembrete traz data, horário e o assunto próprio"""
+        texto = mensagens.renderizar_mensagem('lembrete', 'Ana', 'Raio-X', datetime(2024, 1, 5, 9, 30))
+        self.assertTrue(texto.startswith('Olá Ana,'))
+        self.assertIn('LEMBRETE: Seu exame de Raio-X está agendado para amanhã às 09:30.', texto)
+        self.assertIn('Data: 05/01/2024', texto)
+        self.assertEqual(mensagens.identificar_tipo(texto), 'lembrete')
+        self.assertEqual(mensagens.assunto('lembrete'), 'Lembrete de Exame')
+
+    def test_tipos_identificados_pelo_texto(self):
+        """Cancelamentos e remarcações recebem o assunto correto"""
+        data_hora = datetime(2024, 1, 5, 9, 30)
+        for tipo in ('confirmacao', 'cancelamento', 'remarcacao'):
+            texto = mensagens.renderizar_mensagem(tipo, 'Ana', 'Raio-X', data_hora)
+            self.assertIn('05/01/2024 às 09:30', texto)
+            self.assertEqual(mensagens.identificar_tipo(texto), tipo)
+
+    def test_html_escapa_conteudo(self):
+        """O corpo entra no invólucro HTML escapado e com quebras de linha"""
+        html = mensagens.renderizar_html('Olá <b>Ana</b>,\nTeste')
+        self.assertIn('Olá &lt;b&gt;Ana&lt;/b&gt;,<br>Teste', html)
+        self.assertIn('Sistema de Agendamento de Exames', html)
+
 if __name__ == '__main__':
     unittest.main() 
\ No newline at end of file
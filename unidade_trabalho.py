@@ -0,0 +1,163 @@
+import threading
+from contextlib import contextmanager
+from flask import g, has_app_context, jsonify
+from logs import get_logger
+
+logger = get_logger(__name__)
+
+_LEITURAS = ('SELECT', 'SHOW', 'EXPLAIN', 'DESCRIBE')
+
+_local = threading.local()
+
+
+class UnidadeDeTrabalho:
+    """Uma conexão e uma transação compartilhadas por todas as funções de db.py
+    chamadas durante uma requisição (ou execução de job)."""
+
+    def __init__(self, obter_conexao):
+        self._obter_conexao = obter_conexao
+        self.conn = None
+        self._savepoints = 0
+        self._apos_confirmar = []
+
+    def conexao(self):
+        if self.conn is None:
+            self.conn = self._obter_conexao()
+        return ConexaoUnidade(self)
+
+    def _novo_savepoint(self):
+        self._savepoints += 1
+        nome = f'uow_{self._savepoints}'
+        self._executar(f'SAVEPOINT {nome}')
+        return nome
+
+    def _executar(self, comando):
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(comando)
+        finally:
+            cursor.close()
+
+    def apos_confirmar(self, callback):
+        self._apos_confirmar.append(callback)
+
+    def finalizar(self, sucesso):
+        """Confirma (ou desfaz) a transação e devolve a conexão. Retorna False se o commit falhar."""
+        callbacks, self._apos_confirmar = self._apos_confirmar, []
+        if self.conn is None:
+            return True
+        conn, self.conn = self.conn, None
+        try:
+            if sucesso:
+                conn.commit()
+            else:
+                conn.rollback()
+        except Exception as e:
+            logger.error("Erro ao finalizar unidade de trabalho: %s", e)
+            conn.invalidar() if hasattr(conn, 'invalidar') else conn.close()
+            return False
+        conn.close()
+        if sucesso:
+            for callback in callbacks:
+                callback()
+        return True
+
+
+class ConexaoUnidade:
+    """Visão da conexão da unidade entregue a cada função.
+
+    commit() só libera o savepoint da função; close() sem commit desfaz apenas o
+    que ela escreveu. O savepoint é criado na primeira escrita, então leituras
+    não custam comandos extras.
+    """
+
+    def __init__(self, unidade):
+        self._unidade = unidade
+        self._savepoint = None
+
+    def cursor(self, *args, **kwargs):
+        return CursorUnidade(self, self._unidade.conn.cursor(*args, **kwargs))
+
+    def _antes_de_executar(self, operacao):
+        if self._savepoint is None and not operacao.lstrip().upper().startswith(_LEITURAS):
+            self._savepoint = self._unidade._novo_savepoint()
+
+    def commit(self):
+        if self._savepoint:
+            self._unidade._executar(f'RELEASE SAVEPOINT {self._savepoint}')
+            self._savepoint = None
+
+    def rollback(self):
+        if self._savepoint:
+            self._unidade._executar(f'ROLLBACK TO SAVEPOINT {self._savepoint}')
+            self._savepoint = None
+
+    def close(self):
+        if self._savepoint and self._unidade.conn is not None:
+            try:
+                self.rollback()
+            except Exception as e:
+                logger.error("Erro ao desfazer savepoint: %s", e)
+
+    def __getattr__(self, nome):
+        return getattr(self._unidade.conn, nome)
+
+
+class CursorUnidade:
+    def __init__(self, conexao, cursor):
+        self._conexao = conexao
+        self._cursor = cursor
+
+    def execute(self, operacao, *args, **kwargs):
+        self._conexao._antes_de_executar(operacao)
+        return self._cursor.execute(operacao, *args, **kwargs)
+
+    def executemany(self, operacao, *args, **kwargs):
+        self._conexao._antes_de_executar(operacao)
+        return self._cursor.executemany(operacao, *args, **kwargs)
+
+    def __getattr__(self, nome):
+        return getattr(self._cursor, nome)
+
+
+def unidade_atual():
+    if has_app_context() and 'unidade_de_trabalho' in g:
+        return g.unidade_de_trabalho
+    return getattr(_local, 'unidade', None)
+
+
+@contextmanager
+def unidade_de_trabalho(obter_conexao):
+    """Unidade de trabalho fora de requisições, por exemplo nos jobs do scheduler."""
+    if unidade_atual() is not None:
+        yield unidade_atual()
+        return
+    unidade = UnidadeDeTrabalho(obter_conexao)
+    _local.unidade = unidade
+    sucesso = False
+    try:
+        yield unidade
+        sucesso = True
+    finally:
+        _local.unidade = None
+        unidade.finalizar(sucesso)
+
+
+def init_app(app, obter_conexao):
+    @app.before_request
+    def _abrir_unidade():
+        g.unidade_de_trabalho = UnidadeDeTrabalho(obter_conexao)
+
+    @app.after_request
+    def _confirmar_unidade(response):
+        unidade = g.pop('unidade_de_trabalho', None)
+        if unidade and not unidade.finalizar(sucesso=response.status_code < 500):
+            return jsonify({"error": "Erro ao gravar as alterações"}), 500
+        return response
+
+    @app.teardown_request
+    def _encerrar_unidade(exc):
+        # Só chega aqui com a unidade aberta se a requisição terminou com exceção
+        unidade = g.pop('unidade_de_trabalho', None)
+        if unidade:
+            unidade.finalizar(sucesso=False)
@@ -0,0 +1,78 @@
+"""Worker de notificações, separado do processo web.
+
+Envia a fila de notificações continuamente e cria os lembretes de 24h. Pode rodar
+em vários processos: a fila é reservada com SKIP LOCKED e os lembretes só são
+criados pela instância líder.
+
+    python worker.py
+
+As métricas de envio e dos jobs (SMTP, duração dos jobs, liderança) ficam em
+http://<host>:WORKER_METRICS_PORT/metrics, no mesmo formato do /metrics da aplicação.
+
+EMAIL_TAXA_MAXIMA limita cada worker, não o relay: com N workers, configure o
+limite do relay dividido por N.
+
+SIGTERM ou Ctrl+C param a reserva de novos lotes; o lote em andamento termina,
+as confirmações são gravadas e as notificações não enviadas voltam para a fila.
+"""
+import os
+import signal
+import sys
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from agendador import Agendador, LiderancaMySQL
+from db import criar_conexao_dedicada
+from email_service import enviar_notificacoes, verificar_agendamentos_24h, WORKER_ID, EMAIL_TAXA_MAXIMA
+from logs import get_logger, encerrar as encerrar_logs
+import metricas
+
+logger = get_logger(__name__)
+
+# Pausa entre drenagens da fila quando ela esvazia
+WORKER_INTERVALO = float(os.getenv('WORKER_INTERVALO', '30'))
+# Porta do /metrics do worker; 0 desliga
+WORKER_METRICS_PORT = int(os.getenv('WORKER_METRICS_PORT', '9102'))
+
+
+def executar(parar, intervalo=WORKER_INTERVALO):
+    while not parar.is_set():
+        enviar_notificacoes(parar=parar)
+        parar.wait(intervalo)
+
+
+def main():
+    parar = threading.Event()
+
+    def ao_receber_sinal(signum, frame):
+        logger.info("Sinal recebido; encerrando após o lote em andamento", extra={'sinal': signum})
+        parar.set()
+
+    signal.signal(signal.SIGTERM, ao_receber_sinal)
+    signal.signal(signal.SIGINT, ao_receber_sinal)
+
+    agendador = Agendador(LiderancaMySQL(criar_conexao_dedicada))
+    agendador.adicionar('verificar_agendamentos_24h', verificar_agendamentos_24h, hours=1)
+    metricas.medidor('agendador_lider', 'Se esta instância é a líder dos jobs agendados',
+                     lambda: 1 if agendador.lideranca.eh_lider() else 0)
+    servidor_metricas = metricas.servir(WORKER_METRICS_PORT) if WORKER_METRICS_PORT else None
+    agendador.iniciar()
+    logger.info("Worker de notificações iniciado", extra={'instancia': WORKER_ID, 'intervalo': WORKER_INTERVALO,
+                                                          'porta_metricas': WORKER_METRICS_PORT,
+                                                          'taxa_maxima_processo': EMAIL_TAXA_MAXIMA})
+    try:
+        executar(parar)
+    finally:
+        # Espera um lembrete em andamento e libera a liderança para outra instância
+        agendador.parar(aguardar=True)
+        if servidor_metricas is not None:
+            servidor_metricas.shutdown()
+        logger.info("Worker de notificações encerrado", extra={'instancia': WORKER_ID})
+        encerrar_logs()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())